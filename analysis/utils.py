@@ -1,3 +1,4 @@
+import re
 import numba
 import numpy as np
 import functools
@@ -120,31 +121,160 @@ def make_profile(tobin,toreduce,edges=None,errors=True):
     return h
 
 
+def file_metadata(fname, treename="Events"):
+    """
+    Dict with the size, mtime, entry count, cluster starts and branch names of
+    `treename` in `fname` (nentries of -1 if the file can't be read)
+    """
+    import os
+    import uproot3
+    st = os.stat(fname)
+    out = dict(path=fname, size=st.st_size, mtime=int(st.st_mtime), nentries=-1, clusters=[], branches=[])
+    try:
+        t = uproot3.open(fname)[treename]
+        out["nentries"] = int(t.numentries)
+        out["clusters"] = [int(start) for start, _ in t.clusters()]
+        out["branches"] = [k.decode("ascii") for k in t.keys()]
+    except Exception:
+        pass
+    return out
+
+class FileIndex(object):
+    """
+    sqlite index of path + size + mtime -> entry count, cluster starts and branch list
+    of a tree, kept across sessions so that `get_chunking` doesn't reopen thousands
+    of files every time. Missing or changed files are (re)read in parallel on lookup.
+    Files that can't be stat'ed (e.g., xrootd) aren't indexed.
+
+    >>> index = FileIndex()
+    >>> chunks, nevents = get_chunking(tuple(fnames), 500e3, index=index)
+    """
+
+    def __init__(self, fname="~/.cache/scouting/file_index.sqlite"):
+        import os
+        self.fname = os.path.abspath(os.path.expanduser(fname))
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                path TEXT, treename TEXT, size INTEGER, mtime INTEGER,
+                nentries INTEGER, clusters TEXT, branches TEXT,
+                PRIMARY KEY (path, treename))""")
+
+    def connect(self):
+        import sqlite3
+        # several kernels/workers can share the index
+        return sqlite3.connect(self.fname, timeout=60)
+
+    def get(self, fnames, treename="Events", workers=12, client=None, progress=False):
+        """
+        Dict of fname -> metadata (see `file_metadata`) for the local files in `fnames`, reading the
+        ones that are new or changed since they were indexed with `workers` threads
+        (or `client.map` if a dask `client` is given), and adding them to the index
+        """
+        import os
+        import json
+        stats = {}
+        for fname in fnames:
+            try:
+                st = os.stat(fname)
+                stats[fname] = (st.st_size, int(st.st_mtime))
+            except OSError:
+                pass
+        out = {}
+        with self.connect() as conn:
+            rows = conn.execute("SELECT path, size, mtime, nentries, clusters, branches FROM files WHERE treename = ?", (treename,))
+            for path, size, mtime, nentries, clusters, branches in rows:
+                if stats.get(path) != (size, mtime): continue
+                out[path] = dict(path=path, size=size, mtime=mtime, nentries=nentries,
+                        clusters=json.loads(clusters), branches=json.loads(branches))
+        todo = [fname for fname in fnames if fname in stats and fname not in out]
+        if todo:
+            if client is not None:
+                import functools
+                infos = client.gather(client.map(functools.partial(file_metadata, treename=treename), todo))
+            else:
+                import concurrent.futures
+                with concurrent.futures.ThreadPoolExecutor(max(min(workers, len(todo)), 1)) as executor:
+                    infos = executor.map(lambda fname: file_metadata(fname, treename), todo)
+                    if progress:
+                        from tqdm.auto import tqdm
+                        infos = tqdm(infos, total=len(todo))
+                    infos = list(infos)
+            with self.connect() as conn:
+                for info in infos:
+                    out[info["path"]] = info
+                    # unreadable files are tried again next time
+                    if info["nentries"] < 0: continue
+                    conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (info["path"], treename, info["size"], info["mtime"], info["nentries"],
+                             json.dumps(info["clusters"]), json.dumps(info["branches"])))
+        return out
+
+def xrootd_name(fname):
+    if fname.startswith("/hadoop/cms"):
+        return fname.replace("/hadoop/cms","root://redirector.t2.ucsd.edu/")
+    return fname.replace("/store/","root://cmsxrootd.fnal.gov//store/")
+
 @functools.lru_cache(maxsize=256)
-def get_chunking(filelist, chunksize, treename="Events", workers=12, skip_bad_files=False, xrootd=False, client=None, use_dask=False):
+def get_chunking(filelist, chunksize, treename="Events", workers=12, skip_bad_files=False, xrootd=False, client=None, use_dask=False, index=None, target_mb=None):
     """
     Return 2-tuple of
     - chunks: triplets of (filename,entrystart,entrystop) calculated with input `chunksize` and `filelist`
     - total_nevents: total event count over `filelist`
+    If `index` is a `FileIndex` (or the path of one, or True for the default one), entry counts
+    of local files come from it, and only files missing from it are opened.
+    If `target_mb` is given, `chunksize` is ignored and the chunks of a `ChunkPlan` are
+    returned instead (cluster-aligned, about `target_mb` of the file per chunk).
     """
     import uproot3
     from tqdm.auto import tqdm
     import concurrent.futures
 
-    if xrootd:
-        temp = []
-        for fname in filelist:
-            if fname.startswith("/hadoop/cms"):
-                temp.append(fname.replace("/hadoop/cms","root://redirector.t2.ucsd.edu/"))
-            else:
-                temp.append(fname.replace("/store/","root://cmsxrootd.fnal.gov//store/"))
-        filelist = temp
+    if target_mb:
+        plan = ChunkPlan(filelist, target_mb, treename=treename, workers=workers, skip_bad_files=skip_bad_files,
+                index=index, client=(client if use_dask else None))
+        chunks = plan.chunks
+        if xrootd:
+            chunks = [(xrootd_name(fn), start, stop) for fn, start, stop in chunks]
+        return chunks, plan.nevents
 
     chunksize = int(chunksize)
     chunks = []
     nevents = 0
 
-    if use_dask:
+    infos = {}
+    if index:
+        if index is True:
+            index = FileIndex()
+        elif not isinstance(index, FileIndex):
+            index = FileIndex(index)
+        if use_dask and not client:
+            from dask.distributed import get_client
+            client = get_client()
+        infos = index.get(filelist, treename, workers=workers, client=(client if use_dask else None))
+    order = dict((fname, i) for i, fname in enumerate(filelist))
+
+    if xrootd:
+        temp = [xrootd_name(fname) for fname in filelist]
+        order = dict((new, order[old]) for old, new in zip(filelist, temp))
+        infos = dict((new, infos[old]) for old, new in zip(filelist, temp) if old in infos)
+        filelist = temp
+
+    for fn, info in infos.items():
+        nentries = info["nentries"]
+        if nentries < 0:
+            if skip_bad_files:
+                print("Skipping bad file: {}".format(fn))
+                continue
+            else: raise RuntimeError("Bad file: {}".format(fn))
+        nevents += nentries
+        for start in range(0, nentries, chunksize):
+            chunks.append((fn, start, min(start+chunksize, nentries)))
+    filelist = [fname for fname in filelist if fname not in infos]
+
+    if not filelist:
+        pass
+    elif use_dask:
         if not client:
             from dask.distributed import get_client
             client = get_client()
@@ -162,8 +292,8 @@ def get_chunking(filelist, chunksize, treename="Events", workers=12, skip_bad_fi
                     continue
                 else: raise RuntimeError("Bad file: {}".format(fn))
             nevents += nentries
-            for index in range(nentries // chunksize + 1):
-                chunks.append((fn, chunksize*index, min(chunksize*(index+1), nentries)))
+            for start in range(0, nentries, chunksize):
+                chunks.append((fn, start, min(start+chunksize, nentries)))
     else:
         if skip_bad_files:
             # slightly slower (serial loop), but can skip bad files
@@ -175,17 +305,137 @@ def get_chunking(filelist, chunksize, treename="Events", workers=12, skip_bad_fi
                     continue
                 for fn, nentries in items:
                     nevents += nentries
-                    for index in range(nentries // chunksize + 1):
-                        chunks.append((fn, chunksize*index, min(chunksize*(index+1), nentries)))
+                    for start in range(0, nentries, chunksize):
+                        chunks.append((fn, start, min(start+chunksize, nentries)))
         else:
             executor = None if len(filelist) < 5 else concurrent.futures.ThreadPoolExecutor(min(workers, len(filelist)))
             for fn, nentries in uproot3.numentries(filelist, treename, total=False, executor=executor).items():
                 nevents += nentries
-                for index in range(nentries // chunksize + 1):
-                    chunks.append((fn, chunksize*index, min(chunksize*(index+1), nentries)))
+                for start in range(0, nentries, chunksize):
+                    chunks.append((fn, start, min(start+chunksize, nentries)))
 
+    if infos:
+        # same file order as without an index
+        chunks.sort(key=lambda chunk: order.get(chunk[0], len(order)))
     return chunks, nevents
 
+class ChunkPlan(object):
+    """
+    Plan of reading tasks over `filelist`, with boundaries at the cluster (basket) edges of
+    the tree, so that no two tasks decompress the same baskets. Consecutive clusters are
+    grouped until a task covers about `target_mb` of the file on disk, and files smaller than
+    that are coalesced into shared tasks. Entry counts and cluster edges come from the
+    `FileIndex` `index` if given (True for the default one). Files have to be local (stat-able);
+    with `skip_bad_files`, the ones that aren't or can't be read are left out instead of raising.
+
+    tasks: list of tasks, each a list of (filename, entrystart, entrystop)
+    chunks: the flattened triplets, as returned by `get_chunking`
+    nevents: total event count
+
+    >>> plan = ChunkPlan(fnames, target_mb=200, index=True)
+    >>> df = make_df(fnames, plan=plan, branches=["DV_x", "DV_y", "pass_*"], cut="pass_baseline_iso")
+    >>> ddf = plan.to_dask(lambda fname, start, stop: read_chunk(fname, ["DV_x", "DV_y"], "pass_l1", start, stop))
+    >>> hist2d_dask(ddf, x="DV_x", y="DV_y", bins=bins)
+    """
+
+    def __init__(self, filelist, target_mb=100., treename="Events", workers=12, skip_bad_files=False, index=None, client=None):
+        import os
+        # the sizes are needed for planning, so only local files can be planned (also with an index)
+        statable = []
+        for fname in filelist:
+            try:
+                os.stat(fname)
+            except OSError:
+                if skip_bad_files:
+                    print("Skipping file that can't be stat'ed: {}".format(fname))
+                    continue
+                raise RuntimeError("No metadata for {} (remote files need get_chunking)".format(fname))
+            statable.append(fname)
+        filelist = statable
+        if index:
+            if index is True:
+                index = FileIndex()
+            elif not isinstance(index, FileIndex):
+                index = FileIndex(index)
+            infos = index.get(filelist, treename, workers=workers, client=client)
+        else:
+            import functools
+            import concurrent.futures
+            readable = functools.partial(file_metadata, treename=treename)
+            if client is not None:
+                infos = client.gather(client.map(readable, filelist))
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max(min(workers, len(filelist)), 1)) as executor:
+                    infos = list(executor.map(readable, filelist))
+            infos = dict((info["path"], info) for info in infos)
+        self.target_bytes = target_mb*1e6
+        self.tasks = []
+        self.nevents = 0
+        pending, pending_bytes = [], 0.
+        for fname in filelist:
+            if fname not in infos:
+                raise RuntimeError("No metadata for {} (remote files need get_chunking)".format(fname))
+            info = infos[fname]
+            nentries = info["nentries"]
+            if nentries < 0:
+                if skip_bad_files:
+                    print("Skipping bad file: {}".format(fname))
+                    continue
+                else: raise RuntimeError("Bad file: {}".format(fname))
+            if nentries == 0: continue
+            self.nevents += nentries
+            bytes_per_entry = info["size"]/nentries
+            if info["size"] < self.target_bytes:
+                # small file: shares a task with its neighbors
+                pending.append((fname, 0, nentries))
+                pending_bytes += info["size"]
+                if pending_bytes >= self.target_bytes:
+                    self.tasks.append(pending)
+                    pending, pending_bytes = [], 0.
+                continue
+            edges = sorted(set([x for x in info["clusters"] if 0 < x < nentries] + [0, nentries]))
+            start = 0
+            for lo, hi in zip(edges[:-1], edges[1:]):
+                # close the task at this edge if the next cluster would overshoot the target by more than it undershoots
+                if lo > start and (hi-start)*bytes_per_entry - self.target_bytes > self.target_bytes - (lo-start)*bytes_per_entry:
+                    self.tasks.append([(fname, start, lo)])
+                    start = lo
+            self.tasks.append([(fname, start, nentries)])
+        if pending:
+            self.tasks.append(pending)
+
+    @property
+    def chunks(self):
+        return [chunk for task in self.tasks for chunk in task]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    @staticmethod
+    def read_task(func, task):
+        """
+        DataFrame from calling `func(fname, entrystart, entrystop)` over the chunks of `task`
+        """
+        dfs = [func(*chunk) for chunk in task]
+        if len(dfs) == 1:
+            return dfs[0]
+        return pd.concat(dfs, sort=True, ignore_index=True, copy=False)
+
+    def to_dask(self, func, meta=None):
+        """
+        Dask dataframe with one partition per task, read with `func(fname, entrystart, entrystop)`
+        """
+        import dask.dataframe as dd
+        from dask import delayed
+        if meta is None:
+            fname, start, stop = self.tasks[0][0]
+            meta = func(fname, start, min(stop, start+1000))
+        delayed_func = delayed(self.read_task)
+        return dd.from_delayed([delayed_func(func, task) for task in self.tasks], meta=meta).reset_index(drop=True)
+
 def hist2d_dask(df, x, y, bins, method=1):
     """
     np.histogram2d from dask dataframe.
@@ -198,6 +448,7 @@ def hist2d_dask(df, x, y, bins, method=1):
     --------
     >>> bins = [np.linspace(-15,15,200),np.linspace(-15,15,200)]
     >>> hist2d_dask(df, x="DV_x", y="DV_y", bins=bins).compute()
+    `df` can also come from `ChunkPlan.to_dask` to have one partition per planned task.
     """
     if method == 1:
         from dask import delayed
@@ -334,6 +585,73 @@ def plot_overlay_pixel_rhoz(ax,**kwargs):
         ax.plot(p1,p2,color=color,alpha=alpha,lw=lw,**kwargs)
     return ax
 
+def import_batch_module(name):
+    """
+    Import one of the pure-numpy modules shared with the babymaker from `../batch/`
+    """
+    import os
+    import sys
+    import importlib
+    batchdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "batch")
+    if batchdir not in sys.path:
+        sys.path.append(batchdir)
+    return importlib.import_module(name)
+
+@functools.lru_cache()
+def get_pixel_lookup():
+    """
+    Returns the (cached) pixel module lookup used by the babymaker, e.g.,
+        imodule, layernum, planedist = get_pixel_lookup().lookup(df["DV_x"], df["DV_y"], df["DV_z"])
+    This reads the shared voxel map in `batch/data/` if it has been built.
+    """
+    return import_batch_module("pixel_lookup").get_pixel_lookup()
+
+def nearest_dr(eta, phi, qeta, qphi, qevt=None):
+    """
+    For each (`qeta`, `qphi`), e.g., one muon per event, find the nearest object
+    in DeltaR among the jagged `eta`/`phi` (e.g., `Jet_eta`/`Jet_phi` JaggedArrays
+    from uproot). Query `i` is matched within event `i`, unless `qevt` gives the
+    event index of each query. Returns the index local to the event (-1 if there
+    are no objects) and the DeltaR (999 if there are no objects), e.g.,
+        ijet, drjet = nearest_dr(t["Jet_eta"].array(), t["Jet_phi"].array(), df["Muon1_eta"], df["Muon1_phi"])
+    """
+    kernels = import_batch_module("kernels")
+    offsets = np.zeros(len(eta.counts)+1, dtype=np.int64)
+    np.cumsum(eta.counts, out=offsets[1:])
+    qeta = np.asarray(qeta)
+    if qevt is None:
+        qevt = np.arange(len(qeta))
+    return kernels.nearest_dr(offsets, eta.flatten(), phi.flatten(), qevt, qeta, np.asarray(qphi))
+
+def dimuon_kinematics(df, which="lead"):
+    """
+    Recompute the dimuon/DV kinematics of the babymaker (dimuon_pt/eta/phi/mass, dimuon_massRaw,
+    lxy, lxyError, cosphi, ctau, logabsetaphi, absdphimumu, absdphimudv) from the muon and DV
+    columns of a dataframe, for the leading (Muon1/2_, DV_) or subleading (sublead_*) pair, e.g.,
+    after changing the muon momenta or the reference point in `PVM_x`/`PVM_y`
+    """
+    dimuon = import_batch_module("dimuon")
+    pfx = "" if which == "lead" else "sublead_"
+    def muon(name):
+        cols = dict((k, df[pfx+name+k].values) for k in ["pt", "eta", "phi"])
+        cols["phiCorr"] = df[pfx+name+"phiCorr"].values if (pfx+name+"phiCorr") in df.columns else cols["phi"]
+        return cols
+    dv = dict((k, df[pfx+"DV_"+k].values) for k in ["x", "y", "xError", "yError"])
+    out = dimuon.pair_kinematics(muon("Muon1_"), muon("Muon2_"), dv, df["PVM_x"].values, df["PVM_y"].values)
+    out.pop("p4corr")
+    return pd.DataFrame(out, index=df.index)
+
+def evaluate_selections(df):
+    """
+    Re-derive the pass_* flags of the babymaker (except pass_l1 and the gen matching) from
+    the baby columns in `df` with the cuts in `batch/selections.py`, e.g., to try a changed
+    cut without rerunning the babymaker. `df` needs the columns the cuts use (lxy,
+    Muon1_passid, DV_distPixel, ..., for both the leading and sublead_ pairs, plus pass_l1
+    and FourMuon_mass). Returns a dataframe with the same index.
+    """
+    selections = import_batch_module("selections")
+    return pd.DataFrame(selections.evaluate_all(df), index=df.index)
+
 def futures_widget(futures):
     """
     Takes a list of futures and returns a jupyter widget object of squares,
@@ -430,6 +748,9 @@ class LorentzVectorAccessor:
     def dimu(self):
         return self.mu1 + self.mu2
 
+# branch -> dtype for the known small ranges. batch/readschema.py has the same list
+# (NARROW_DTYPES) and is used when it can be imported, this copy is for workers
+# without the batch/ directory.
 smaller_dtypes = [
     ["dimuon_mass","float32"],
     ["dimuon_pt","float32"],
@@ -474,7 +795,516 @@ smaller_dtypes = [
     ["nPVM","int8"],
     ["run","int32"],
 ]
+# the subleading pair is 999 in events without a second DV, so its small integers need int16
+smaller_dtypes += [["sublead_"+name, "int16" if dtype == "int8" else dtype] for name, dtype in smaller_dtypes if name.startswith(("Muon1_", "Muon2_", "DV_"))]
+
+def _import_readschema():
+    # None on a worker without the batch/ directory
+    try:
+        return import_batch_module("readschema")
+    except ImportError:
+        return None
+
+@functools.lru_cache(maxsize=32)
+def _read_schema(extra, bools):
+    readschema = _import_readschema()
+    if readschema is None:
+        # only the known small ranges, without knowing which branches are booleans
+        if bools != "bool":
+            raise ImportError("bools={!r} needs batch/readschema.py to know the boolean branches".format(bools))
+        schema = dict(smaller_dtypes)
+        schema.update(extra)
+        return schema
+    try:
+        branch_types = readschema.init_branch_types()
+    except (IOError, OSError):
+        # batch/ without babymaker.py, only the known small ranges are used
+        branch_types = {}
+    return readschema.make_schema(branch_types, extra=dict(extra), bools=bools)
+
+def read_schema(dtypes=None, bools="bool"):
+    """
+    Branch name -> dtype to read babies with (see batch/readschema.py): the types of the
+    branches in `Looper.init_branches`, narrowed where the values are known to be small,
+    plus `dtypes` (name -> dtype) on top. Booleans are read as `bools` ("bool", "uint8",
+    or "packed" into bitmask columns, see `pack_bools`).
+    """
+    return _read_schema(tuple(sorted((dtypes or {}).items())), bools)
+
+def pack_bools(df, schema):
+    """
+    Replace the "packed" boolean columns of `schema` in `df` by uint64 bitmask columns
+    (packed_bools0, ...), with the bit positions of `readschema.packed_columns(schema)`
+    """
+    if "packed" not in schema.values():
+        return df
+    packed = import_batch_module("readschema").packed_columns(schema)
+    names = [name for name in packed if name in df.columns]
+    if not names:
+        return df
+    words = dict()
+    for name in names:
+        column, bit = packed[name]
+        if column not in words:
+            words[column] = np.zeros(len(df), dtype=np.uint64)
+        words[column] |= df[name].values.astype(np.uint64) << np.uint64(bit)
+    df = df.drop(columns=names)
+    for column in sorted(words):
+        df[column] = words[column]
+    return df
+
+def unpack_bools(df, names=None, dtypes=None):
+    """
+    DataFrame of boolean columns unpacked from the bitmask columns of a `make_df(..., bools="packed")`
+    output (all of the packed flags if `names` is None). `dtypes` has to be the same as for `make_df`.
+    """
+    packed = import_batch_module("readschema").packed_columns(read_schema(dtypes, "packed"))
+    if names is None:
+        names = [name for name, (column, _) in packed.items() if column in df.columns]
+    out = pd.DataFrame(index=df.index)
+    for name in names:
+        column, bit = packed[name]
+        out[name] = ((df[column].values >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+    return out
+
+def dtype_report(df, dtypes=None, bools="bool"):
+    """
+    Memory per column of a `make_df` output compared to the stored (decoded) branch types,
+    as a DataFrame of decoded dtype, dtype, decoded MB, MB and saved MB, sorted by the savings.
+    Bitmask columns are compared to one byte per packed flag of the schema.
+    """
+    readschema = import_batch_module("readschema")
+    try:
+        branch_types = readschema.init_branch_types()
+    except (IOError, OSError):
+        branch_types = {}
+    packed = readschema.packed_columns(read_schema(dtypes, bools))
+    rows = []
+    for column in df.columns:
+        values = df[column].values
+        mb = values.nbytes/1e6
+        if column.startswith("packed_bools"):
+            nflags = sum(1 for c, _ in packed.values() if c == column)
+            rows.append([column, "{}*bool".format(nflags), str(values.dtype), nflags*len(df)/1e6, mb])
+            continue
+        branch = column if column in branch_types else re.sub(r"^(Muon|Jet)[12]_", r"\1_", column)
+        decoded = np.dtype(readschema.DEFAULT_DTYPES.get(branch_types.get(branch), values.dtype))
+        rows.append([column, str(decoded), str(values.dtype), decoded.itemsize*len(df)/1e6, mb])
+    report = pd.DataFrame(rows, columns=["column", "decoded_dtype", "dtype", "decoded_mb", "mb"]).set_index("column")
+    report["saved_mb"] = report["decoded_mb"] - report["mb"]
+    return report.sort_values("saved_mb", ascending=False)
+
+
+def resolve_branches(patterns, keys):
+    """
+    Branch names in `keys` (in tree order) matching any of `patterns`
+    (names, glob strings or "/regex/" strings, like `uproot3.tree.TTreeMethods.arrays`)
+    """
+    import fnmatch
+    matchers = []
+    for pattern in patterns:
+        if len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/"):
+            matchers.append(re.compile(pattern[1:-1]).match)
+        elif any(c in pattern for c in "*?["):
+            matchers.append(re.compile(fnmatch.translate(pattern)).match)
+        else:
+            matchers.append(pattern.__eq__)
+    return [k for k in keys if any(m(k) for m in matchers)]
+
+def arrays_to_df(arrs, schema=None):
+    """
+    DataFrame from a dict of uproot arrays of baby branches, keeping the first DV/PVM,
+    the first two muons (Muon1_/Muon2_) and jets (Jet1_/Jet2_, -1 if missing) and the scalar
+    sum `ht` of the first Jet_ branch (meant to be Jet_pt).
+    Columns get the dtype of their branch in `schema` (default: `smaller_dtypes`), with "packed"
+    booleans kept as bool (see `pack_bools`). Arrays that were decoded with that dtype already
+    (see `narrow_interpretations`) are used as is, others are converted while filling.
+    """
+    if schema is None:
+        schema = dict(smaller_dtypes)
+    df = pd.DataFrame()
+    def put(name, branch, v):
+        dtype = schema.get(name) or schema.get(branch)
+        if dtype == "packed":
+            dtype = "bool"
+        if dtype is None or getattr(v, "dtype", None) == np.dtype(dtype):
+            df[name] = v
+            return
+        # convert straight into the narrow array instead of making a full width column first
+        out = np.empty(len(v), dtype=dtype)
+        np.copyto(out, v, casting="unsafe")
+        if out.dtype.kind in "iu" and not np.array_equal(out, v):
+            import warnings
+            warnings.warn("Values of {} don't fit in {} and were wrapped".format(name, out.dtype))
+        df[name] = out
+    for k in arrs.keys():
+        v = arrs[k]
+        is_jagged = ("Jagged" in str(type(v)))
+        if is_jagged:
+            if k.startswith("DV_"):
+                put(k, k, v[:,0])
+            elif k.startswith("PVM_"):
+                put(k, k, v[:,0])
+            elif k.startswith("Muon_"):
+                put(k.replace("Muon_","Muon1_"), k, v[:,0])
+                put(k.replace("Muon_","Muon2_"), k, v[:,1])
+            elif k.startswith("Jet_"):
+                if "ht" not in df.columns:
+                    df["ht"] = v.sum()
+                v = v.pad(2).fillna(-1)
+                put(k.replace("Jet_","Jet1_"), k, v[:,0])
+                put(k.replace("Jet_","Jet2_"), k, v[:,1])
+            else:
+                df[k] = v
+        else:
+            put(k, k, v)
+    return df
+
+def narrow_interpretations(t, names, schema):
+    """
+    Dict of branch name -> uproot3 interpretation for `t.arrays`, which decodes the flat and
+    jagged numeric branches in `names` straight into their dtype in `schema` (for jagged
+    Muon_/Jet_ branches, the one of the Muon1_/Jet1_ columns), so no full width array is made.
+    Other branches keep their default interpretation.
+    """
+    import uproot3
+    out = dict()
+    for name in names:
+        interp = t[name].interpretation
+        dtype = schema.get(name) or schema.get(re.sub(r"^(Muon|Jet)_", r"\g<1>1_", name))
+        if dtype == "packed":
+            dtype = "bool"
+        if dtype is not None and isinstance(interp, uproot3.asdtype) and not interp.fromdims:
+            interp = uproot3.asdtype(interp.fromdtype, np.dtype(dtype))
+        elif dtype is not None and isinstance(interp, uproot3.asjagged) and isinstance(interp.content, uproot3.asdtype) and not interp.content.fromdims:
+            interp = uproot3.asjagged(uproot3.asdtype(interp.content.fromdtype, np.dtype(dtype)), skipbytes=interp.skipbytes)
+        out[name] = interp
+    return out
+
+def cut_branches(cut, branches):
+    """
+    Branches among `branches` needed to evaluate `cut` on the output of `arrays_to_df`,
+    or None if the cut uses a column that can't be traced back to one of them
+    (then the whole chunk has to be read before cutting)
+    """
+    branches = list(branches)
+    needed = []
+    for name in re.findall(r"(?<![\w.])[A-Za-z_]\w*", cut):
+        if name in ("and", "or", "not", "in", "True", "False", "abs"):
+            continue
+        source = re.sub(r"^(Muon|Jet)[12]_", r"\1_", name)
+        if name == "ht":
+            source = next((b for b in branches if b.startswith("Jet_")), None)
+        if source not in branches:
+            return None
+        if source not in needed:
+            needed.append(source)
+    return needed
+
+def read_chunk(fname, branches, cut=None, entrystart=None, entrystop=None, treename="Events", dtypes=None, bools="bool"):
+    """
+    Read the entries in [`entrystart`, `entrystop`) of `fname` that pass `cut` into a DataFrame
+    (see `arrays_to_df`). The branches used by `cut` are read first, and the rest of
+    `branches` are only read over the range spanned by passing entries, and then sliced,
+    so tight cuts skip most of the decompression and conversion.
+    Columns have the dtypes of `read_schema(dtypes, bools)`, which uproot decodes into directly
+    (see `narrow_interpretations`), and the cut sees booleans as bool.
+    """
+    import uproot3
+    schema = read_schema(dtypes, bools)
+    cut_schema = read_schema(dtypes, "bool")
+    t = uproot3.open(fname)[treename]
+    names = resolve_branches(branches, [k.decode("ascii") for k in t.keys()])
+    def read(which, start, stop, schema=schema):
+        return t.arrays(narrow_interpretations(t, which, schema), outputtype=dict, namedecode="ascii", entrystart=start, entrystop=stop)
+    needed = cut_branches(cut, names) if cut else None
+    if not needed:
+        df = arrays_to_df(read(names, entrystart, entrystop, cut_schema), cut_schema)
+        if cut:
+            df = df.query(cut)
+        if bools != "bool":
+            df = arrays_to_df(dict((k, df[k].values) for k in df.columns), schema)
+        return pack_bools(df, schema)
+
+    first = read(needed, entrystart, entrystop, cut_schema)
+    mask = np.asarray(arrays_to_df(first, cut_schema).eval(cut), dtype=bool)
+    idxs = np.nonzero(mask)[0]
+    rest = [name for name in names if name not in first]
+    if len(idxs) and rest:
+        start = (entrystart or 0) + idxs[0]
+        stop = (entrystart or 0) + idxs[-1] + 1
+        second = read(rest, start, stop)
+        submask = mask[idxs[0]:idxs[-1]+1]
+    else:
+        # nothing passes, so only the (empty) columns are needed
+        second = read(rest, entrystart or 0, entrystart or 0) if rest else {}
+        submask = np.zeros(0, dtype=bool)
+    arrs = dict()
+    for name in names:
+        arrs[name] = first[name][mask] if name in first else second[name][submask]
+    return pack_bools(arrays_to_df(arrs, schema), schema)
+
+# bump when the output of the default reader changes in ways the hashed code can't see
+READER_VERSION = 1
+
+def _func_token(func):
+    """
+    Hash of what a reading function computes: its bytecode, constants (including nested
+    functions and lambdas), names, defaults and the values in its closure, recursively.
+    Globals are only hashed by name, and callables without code by their repr.
+    """
+    import types
+    import hashlib
+    h = hashlib.sha1()
+
+    def add(obj, depth=0):
+        if depth > 8:
+            h.update(repr(obj).encode())
+        elif isinstance(obj, functools.partial):
+            add([obj.func, obj.args, obj.keywords], depth+1)
+        elif isinstance(obj, types.CodeType):
+            h.update(obj.co_code)
+            add([obj.co_names, obj.co_consts], depth+1)
+        elif hasattr(obj, "__code__"):
+            cells = []
+            for cell in getattr(obj, "__closure__", None) or ():
+                try:
+                    cells.append(cell.cell_contents)
+                except ValueError:
+                    cells.append(None)
+            add([obj.__code__, getattr(obj, "__defaults__", None), getattr(obj, "__kwdefaults__", None), cells], depth+1)
+        elif isinstance(obj, np.ndarray):
+            h.update(repr((obj.dtype, obj.shape)).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, (list, tuple)):
+            h.update(b"(")
+            for x in obj:
+                add(x, depth+1)
+            h.update(b")")
+        elif isinstance(obj, dict):
+            add(sorted(obj.items(), key=repr), depth+1)
+        else:
+            h.update(repr(obj).encode())
+    add(func)
+    return h.hexdigest()
+
+class FrameCache(object):
+    """
+    Directory of feather files with `make_df` results, keyed by the input files (with their
+    sizes and modification times), the branches, the cut and the reading function. Entries
+    are loaded memory-mapped, and the least recently used ones are removed once the
+    directory exceeds `max_gb`. Needs pyarrow.
+
+    >>> cache = FrameCache("/tmp/namin/make_df_cache", max_gb=50)
+    >>> df = make_df(fnames, branches=["dimuon_mass", "pass_*"], cut="pass_baseline_iso", cache=cache)
+    """
+
+    def __init__(self, directory="~/.cache/scouting/make_df", max_gb=20.):
+        import os
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_gb*1e9)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(paths, branches, cut, func=None, index=None, **kwargs):
+        """
+        Hash of everything the output of `make_df` depends on. Branch patterns are resolved
+        against the first file (from the `FileIndex` `index` if given), and `func` is identified by its
+        name and `_func_token` (so a changed threshold or captured variable is a different key).
+        The default reader is identified by READER_VERSION, the code of `read_chunk` and the
+        helpers it uses, and the read schema, so editing any of them invalidates old entries.
+        Extra `kwargs` are added as is.
+        """
+        import os
+        import json
+        import hashlib
+        files = []
+        for fname in paths:
+            try:
+                st = os.stat(fname)
+                files.append([fname, st.st_size, int(st.st_mtime)])
+            except OSError:
+                # remote (xrootd) or missing file, only the name is known
+                files.append([fname, None, None])
+        if not paths or files[0][1] is None:
+            resolved = sorted(branches)
+        elif isinstance(index, FileIndex):
+            resolved = resolve_branches(branches, index.get(paths[:1])[paths[0]]["branches"])
+        else:
+            t = uproot3.open(paths[0])["Events"]
+            resolved = resolve_branches(branches, [k.decode("ascii") for k in t.keys()])
+        if func is None:
+            helpers = [read_chunk, arrays_to_df, cut_branches, resolve_branches, narrow_interpretations,
+                    pack_bools, read_schema, _read_schema.__wrapped__, _import_readschema]
+            ident = ["read_chunk", READER_VERSION] + [_func_token(f) for f in helpers]
+            ident.append(list(read_schema(kwargs.get("dtypes"), kwargs.get("bools", "bool")).items()))
+        else:
+            ident = [getattr(func, "__module__", ""), getattr(func, "__qualname__", repr(func)), _func_token(func)]
+        blob = json.dumps([files, resolved, cut, ident, sorted(kwargs.items())], sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def path(self, key):
+        import os
+        return os.path.join(self.directory, "{}.feather".format(key))
+
+    def load(self, key):
+        """
+        Cached DataFrame for `key` (memory-mapped, so numeric columns aren't copied), or None
+        """
+        import os
+        fname = self.path(key)
+        if not os.path.exists(fname):
+            return None
+        from pyarrow import feather
+        df = feather.read_table(fname, memory_map=True).to_pandas(split_blocks=True)
+        # mark as recently used for the eviction
+        os.utime(fname)
+        return df
+
+    def store(self, key, df):
+        import os
+        from pyarrow import feather
+        fname = self.path(key)
+        tmpname = "{}.tmp{}".format(fname, os.getpid())
+        # uncompressed, so that reading back can be zero-copy
+        feather.write_feather(df.reset_index(drop=True), tmpname, compression="uncompressed")
+        os.replace(tmpname, fname)
+        self.evict(keep=fname)
+
+    def entries(self):
+        """
+        List of (path, size in bytes, last use time), least recently used first
+        """
+        import os
+        out = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".feather"): continue
+            fname = os.path.join(self.directory, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            out.append((fname, st.st_size, st.st_mtime))
+        return sorted(out, key=lambda x: x[2])
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries (except `keep`) until the total size is within `max_gb`
+        """
+        import os
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for fname, size, _ in entries:
+            if total <= self.max_bytes: break
+            if fname == keep: continue
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        import os
+        for fname, _, _ in self.entries():
+            os.remove(fname)
+
+class DataFrameStream(object):
+    """
+    Iterable over the filtered DataFrames of the `make_df` tasks, read by `nthreads` threads
+    with at most `prefetch` tasks in flight, so only a few chunks are in memory at once.
+    Returned by `make_df` for selections that don't fit in memory, e.g.,
+
+    >>> stream = make_df(fnames, branches=["DV_x", "DV_y", "dimuon_mass", "pass_l1"], cut="pass_l1", stream=True)
+    >>> h = stream.draw("dimuon_mass", "DV_x > 0", bins=np.linspace(0, 10, 101))
+    >>> counts = stream.histogram2d("DV_x", "DV_y", bins=np.linspace(-15, 15, 200))
+    >>> dataframe_to_ttree(stream, "skim.root")
+    >>> stream.spill("skim.parquet") # then pd.read_parquet("skim.parquet", columns=[...])
+
+    Every pass re-reads the inputs.
+    """
+
+    def __init__(self, tasks, func, nthreads=6, prefetch=None, progress=True):
+        self.tasks = tasks
+        self.func = func
+        self.nthreads = nthreads
+        self.prefetch = prefetch or 2*nthreads
+        self.progress = progress
 
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        import collections
+        import concurrent.futures
+        tasks = iter(self.tasks)
+        pending = collections.deque()
+        bar = None
+        if self.progress:
+            from tqdm.auto import tqdm
+            bar = tqdm(total=len(self.tasks))
+        with concurrent.futures.ThreadPoolExecutor(self.nthreads) as executor:
+            for task in tasks:
+                pending.append(executor.submit(ChunkPlan.read_task, self.func, task))
+                if len(pending) >= self.prefetch: break
+            while pending:
+                df = pending.popleft().result()
+                task = next(tasks, None)
+                if task is not None:
+                    pending.append(executor.submit(ChunkPlan.read_task, self.func, task))
+                if bar is not None:
+                    bar.update(1)
+                yield df
+        if bar is not None:
+            bar.close()
+
+    def draw(self, varexp, sel, bins, overflow=True, label=None):
+        """
+        yahist Hist1D of `varexp` for rows passing `sel` (see `df.tree.draw`), summed over chunks.
+        `bins` must be the bin edges so that the chunks can be added.
+        """
+        h = None
+        for df in self:
+            hchunk = df.tree.draw(varexp, sel, bins=bins, overflow=overflow, fast=False, label=label)
+            h = hchunk if h is None else h + hchunk
+        return h
+
+    def histogram2d(self, x, y, bins, weights=None, overflow=False):
+        """
+        2D counts of the expressions `x` and `y` (and optional `weights` expression) as in
+        `numba_histogram2d`, summed over chunks. `bins` are the edges (same for x and y), or a
+        tuple `(binsx, binsy)` of them.
+        """
+        if isinstance(bins, tuple):
+            binsx, binsy = bins
+        else:
+            binsx, binsy = bins, bins
+        binsx, binsy = np.asarray(binsx, dtype=np.float64), np.asarray(binsy, dtype=np.float64)
+        counts = np.zeros((len(binsx)-1, len(binsy)-1))
+        for df in self:
+            if not len(df): continue
+            w = None if weights is None else df.eval(weights).values.astype(np.float64)
+            counts += numba_histogram2d(df.eval(x).values.astype(np.float64), df.eval(y).values.astype(np.float64), binsx, binsy, w, overflow)[0]
+        return counts
+
+    def spill(self, fname, compression="snappy"):
+        """
+        Write all chunks into a local parquet file, one row group per chunk, and return `fname`
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for df in self:
+                if writer is None:
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    writer = pq.ParquetWriter(fname, table.schema, compression=compression)
+                else:
+                    table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return fname
 
 def make_df(
     path,
@@ -491,6 +1321,13 @@ def make_df(
     skip_bad_files = False,
     nthreads = 6,
     progress = True,
+    cache = None,
+    index = None,
+    plan = None,
+    stream = None,
+    memory_budget_gb = 15.,
+    dtypes = None,
+    bools = "bool",
 ):
     """
     Returns dataframe from input ROOT files containing given branches
@@ -498,7 +1335,7 @@ def make_df(
 
     path: file path(s) or glob string(s)
     branches: list of branches/glob strings/regex for branches to read
-    cut: selection string input to `df.query()`
+    cut: selection string input to `df.query()`, branches it uses are read first (see `read_chunk`)
     chunksize: events per task
     xrootd: use xrootd for input files
     persist: whether to return persisted dask dataframe or not
@@ -508,6 +1345,15 @@ def make_df(
     skip_bad_files: whether to skip bad files according to failure of uproot.numentries
     nthreads: number of ThreadPoolExecutor threads when not using dask (default 6)
     progress: show progress bar
+    cache: `FrameCache` (or directory for one, or True for the default one) to store/reuse the result when not using dask
+        (ignored with `stream=True`, and streams that are returned because of the size aren't stored)
+    index: `FileIndex` (or path/True) for the entry counts, passed to `get_chunking`
+    plan: `ChunkPlan` over the same files to read by task instead of by `chunksize`
+    stream: when not using dask, return a `DataFrameStream` over the filtered chunks instead of one dataframe.
+        If None, only if the estimated size exceeds `memory_budget_gb`. If False, raise an error instead.
+    memory_budget_gb: largest estimated dataframe to make in memory when not using dask
+    dtypes: extra branch -> dtype to read with, on top of `read_schema()` (see `dtype_report` for the savings)
+    bools: read booleans as "bool", "uint8" or "packed" into bitmask columns (see `unpack_bools`)
     """
     import dask.dataframe as dd
     from dask import delayed
@@ -520,68 +1366,62 @@ def make_df(
     else:
         paths = [y for x in path for y in uproot3.tree._filename_explode(x)]
 
+    cache_key = None
+    # a stream is never cached, so that stream=True always returns one
+    if cache and not use_dask and not stream:
+        if cache is True:
+            cache = FrameCache()
+        elif not isinstance(cache, FrameCache):
+            cache = FrameCache(cache)
+        if index is True:
+            index = FileIndex()
+        elif index and not isinstance(index, FileIndex):
+            index = FileIndex(index)
+        cache_key = cache.key(paths, branches, cut, func=func, index=index, skip_bad_files=skip_bad_files, dtypes=dtypes, bools=bools)
+        df = cache.load(cache_key)
+        if df is not None:
+            return df
+
     if not func:
         def func(fname, entrystart = None, entrystop = None):
-            t = uproot3.open(fname)["Events"]
-            arrs = t.arrays(
-                branches,
-                outputtype = dict,
-                namedecode = "ascii",
-                entrystart = entrystart,
-                entrystop = entrystop,
-            )
-            sel = slice(None,None)
-            df = pd.DataFrame()
-            for k in arrs.keys():
-                v = arrs[k][sel]
-                is_jagged = ("Jagged" in str(type(v)))
-                if is_jagged:
-                    if k.startswith("DV_"):
-                        df[k] = v[:,0]
-                    elif k.startswith("PVM_"):
-                        df[k] = v[:,0]
-                    elif k.startswith("Muon_"):
-                        df[k.replace("Muon_","Muon1_")] = v[:,0]
-                        df[k.replace("Muon_","Muon2_")] = v[:,1]
-                    elif k.startswith("Jet_"):
-                        if "ht" not in df.columns:
-                            df["ht"] = v.sum()
-                        v = v.pad(2).fillna(-1)
-                        df[k.replace("Jet_","Jet1_")] = v[:,0]
-                        df[k.replace("Jet_","Jet2_")] = v[:,1]
-                    else:
-                        df[k] = v
-                else:
-                    df[k] = v
-            for name,dtype in smaller_dtypes:
-                if name not in df.columns: continue
-                df[name] = df[name].astype(dtype, copy=False)
-            df = df.query(cut)
-            return df
+            return read_chunk(fname, branches, cut, entrystart=entrystart, entrystop=entrystop, dtypes=dtypes, bools=bools)
 
-    chunks, total_events = get_chunking(tuple(paths), chunksize, client=client, xrootd=xrootd, use_dask=use_dask, skip_bad_files=skip_bad_files)
+    if plan is None:
+        chunks, total_events = get_chunking(tuple(paths), chunksize, client=client, xrootd=xrootd, use_dask=use_dask, skip_bad_files=skip_bad_files, index=index)
+        tasks = [[chunk] for chunk in chunks]
+    else:
+        tasks, total_events = plan.tasks, plan.nevents
+    read_task = ChunkPlan.read_task
 
-    smallchunk_nevents = int(max(chunks[0][1] + (chunks[0][2]-chunks[0][1])//10, 1))
-    smallchunk = (chunks[0][0], chunks[0][1], smallchunk_nevents)
+    firstchunk = tasks[0][0]
+    smallchunk_nevents = int(max(firstchunk[1] + (firstchunk[2]-firstchunk[1])//10, 1))
+    smallchunk = (firstchunk[0], firstchunk[1], smallchunk_nevents)
     meta = func(*smallchunk)
 
     if not use_dask:
         smallchunk_mb = meta.memory_usage().sum()/1e6
         estimated_mb = smallchunk_mb * total_events / smallchunk_nevents
-        if estimated_mb > 15e3:
-            raise RuntimeError("This dataframe would take approx. {:.1f}GB of RAM. Reduce the input size.".format(estimated_mb*1e-3))
+        too_big = estimated_mb > memory_budget_gb*1e3
+        if stream or (too_big and stream is None):
+            if too_big:
+                print("This dataframe would take approx. {:.1f}GB of RAM, streaming the chunks instead.".format(estimated_mb*1e-3))
+            return DataFrameStream(tasks, func, nthreads=nthreads, progress=progress)
+        if too_big:
+            raise RuntimeError("This dataframe would take approx. {:.1f}GB of RAM. Reduce the input size or use `stream=True`.".format(estimated_mb*1e-3))
 
         executor = concurrent.futures.ThreadPoolExecutor(nthreads)
-        futures = [executor.submit(func, *chunk) for chunk in chunks]
+        futures = [executor.submit(read_task, func, task) for task in tasks]
         def wrapper(x):
             if progress:
                 return tqdm(x)
             return x
         ddf = pd.concat((future.result() for future in wrapper(futures)), sort=True, ignore_index=True, copy=False)
         del executor
+        if cache_key:
+            cache.store(cache_key, ddf)
     else:
-        delayed_func = delayed(func)
-        ddf = dd.from_delayed((delayed_func(*chunk) for chunk in chunks), meta=meta).reset_index(drop=True)
+        delayed_func = delayed(read_task)
+        ddf = dd.from_delayed((delayed_func(func, task) for task in tasks), meta=meta).reset_index(drop=True)
         if partition_size:
             ddf = ddf.repartition(partition_size=partition_size)
         if npartitions:
@@ -594,6 +1434,8 @@ def make_df(
 def dataframe_to_ttree(df, filename, treename="t", chunksize=1e6, compression=uproot3.LZ4(1), progress=True):
     """
     Writes ROOT file containing one TTree with the input pandas DataFrame.
+    `df` can also be an iterable of DataFrames with the same columns, e.g.,
+    a `DataFrameStream` from `make_df`, which is written one DataFrame at a time.
 
     filename: name of output file
     treename: name of output TTree
@@ -601,17 +1443,24 @@ def dataframe_to_ttree(df, filename, treename="t", chunksize=1e6, compression=up
     compression: uproot compression object (LZ4, ZLIB, LZMA, or None)
     progress: show tqdm progress bar?
     """
-    t = uproot3.newtree(df.dtypes)
+    import itertools
+    is_df = isinstance(df, pd.DataFrame)
+    frames = iter([df] if is_df else df)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError("No dataframes to write")
+    t = uproot3.newtree(first.dtypes)
     with uproot3.recreate(filename, compression=compression) as f:
         f[treename] = t
         chunksize = int(chunksize)
-        iterable = range(0, len(df), chunksize)
-        if progress:
-            from tqdm.auto import tqdm
-            iterable = tqdm(iterable)
-        for i in iterable:
-            chunk = df.iloc[i:i+chunksize]
-            f[treename].extend({ k:chunk[k].values for k in chunk.columns })
+        for frame in itertools.chain([first], frames):
+            iterable = range(0, len(frame), chunksize)
+            if progress and is_df:
+                from tqdm.auto import tqdm
+                iterable = tqdm(iterable)
+            for i in iterable:
+                chunk = frame.iloc[i:i+chunksize]
+                f[treename].extend({ k:chunk[k].values for k in first.columns })
 
 def ttree_to_dataframe(filename, treename="t", branches=None, progress=True, **kwargs):
     """
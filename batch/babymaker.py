@@ -12,16 +12,25 @@ import math
 import time
 import argparse
 import os
-import pickle
-import ast
-import uuid
+import json
+from collections import OrderedDict
 
 import socket
 import gzip
 
+import numpy as np
 
-MUON_MASS = 0.10566
-randid = str(uuid.uuid4()).split("-")[0]
+from pixel_lookup import get_pixel_lookup
+from kernels import nearest_dr
+import propagation
+from genindex import GenIndex, EXOTIC_IDS
+from beamspots import BeamspotTable, table_name
+from treewriter import EventsWriter, SideTreeWriter
+import readaudit
+from compression import parse_policy, apply_policy, side_tree_setting
+from profiling import StageTimer, NullTimer, timed, get_cache_stats, write_report, merge_reports, sidecar_name
+from dimuon import MUON_MASS, pair_kinematics, p4_mass
+import selections
 
 fast = False
 if fast:
@@ -51,13 +60,70 @@ def get_iter(ch, entrystart=None, entrystop=None):
    i = 0
    if entrystart is not None: i += entrystart
    bytes_read = ch.GetEntry(i)
-   while (bytes_read > 0) and ((entrystop is None) or (i < entrystop-1)):
+   while (bytes_read > 0) and ((entrystop is None) or (i < entrystop)):
       yield i, ch
       i += 1
       bytes_read = ch.GetEntry(i)
    if bytes_read == -1:
       raise RuntimeError( "TTree I/O error" )
 
+def get_entries_iter(ch, entries):
+    # like get_iter, but only for the given (sorted) chain entries
+    for i in entries:
+        i = int(i)
+        if ch.GetEntry(i) == -1:
+            raise RuntimeError( "TTree I/O error" )
+        yield i, ch
+
+def find_leaf(tree, prefix, member):
+    # full leaf name of a data member of an EDM product, e.g., ("ScoutingMuons_...__HLT", "pt_")
+    cands = [l.GetName() for l in tree.GetListOfLeaves() if l.GetName().startswith(prefix) and l.GetName().rstrip(".").endswith("."+member)]
+    if not cands:
+        raise KeyError("Couldn't find leaf for {} {}".format(prefix, member))
+    return min(cands, key=len)
+
+def make_skim_entry_list(fnames, treename="Events", entrystart=0, entrystop=None, min_dvs=1, min_muons=2):
+    """
+    Count-only pre-pass over the chain entries [entrystart, entrystop) of `fnames`,
+    which only reads the number of displaced vertices and muons of each event.
+    Returns the (chain) entries with at least `min_dvs` DVs and `min_muons` muons,
+    and a list of dicts with the number of entries and passing entries per file.
+    """
+    entries = []
+    skim_info = []
+    offset = 0
+    for fname in fnames:
+        if (entrystop is not None) and (offset >= entrystop): break
+        f = r.TFile.Open(fname)
+        tree = f.Get(treename)
+        nfile = tree.GetEntries()
+        lo = max(entrystart - offset, 0)
+        hi = nfile if entrystop is None else min(entrystop - offset, nfile)
+        if hi > lo:
+            cut = "(Length$({}) >= {}) && (Length$({}) >= {})".format(
+                    find_leaf(tree, "ScoutingVertexs_hltScoutingMuonPackerCalo_displacedVtx_HLT", "x_"), min_dvs,
+                    find_leaf(tree, "ScoutingMuons_hltScoutingMuonPackerCalo__HLT", "pt_"), min_muons,
+                    )
+            f.cd()
+            tree.Draw(">>skim_entrylist", cut, "entrylist", hi-lo, lo)
+            elist = r.gDirectory.Get("skim_entrylist")
+            npassed = elist.GetN()
+            entries.append(offset + np.array([elist.GetEntry(i) for i in range(npassed)], dtype=np.int64))
+            skim_info.append(dict(fname=fname, nentries=hi-lo, npassed=npassed, fraction=float(npassed)/(hi-lo)))
+        offset += nfile
+        f.Close()
+    entries = np.concatenate(entries) if entries else np.zeros(0, dtype=np.int64)
+    return entries, skim_info
+
+# leaf types of the scalar branches made by Looper.make_branch
+LEAF_TYPES = {"f": "F", "b": "O", "i": "I", "l": "L"}
+
+# entries between checkpoints if --resume is given without --checkpoint
+DEFAULT_CHECKPOINT_EVERY = 100000
+
+def skim_sidecar_name(fname_out):
+    return os.path.splitext(fname_out)[0] + ".skim.json"
+
 
 def delta_phi(phi1,phi2):
     return (phi1 - phi2 + math.pi) % (2*math.pi) - math.pi
@@ -65,22 +131,6 @@ def delta_phi(phi1,phi2):
 def delta_r(eta1,eta2,phi1,phi2):
     return math.hypot(eta1-eta2, delta_phi(phi1,phi2))
 
-mask_ranges = [
-    [0.43,0.49],
-    [0.52,0.58],
-    [0.73,0.84],
-    [0.96,1.08],
-    [2.91,3.27],
-    [3.47,3.89],
-    [8.99,9.87],
-    [9.61,10.77],
-    ]
-def pass_mass_mask(mass):
-    for low, high in mask_ranges:
-        if low <= mass <= high:
-            return False
-    return True
-
 def get_filter_eff_info(origch):
     fnames = [f.GetTitle().replace("/output_","/aodsim/output_") for f in origch.GetListOfFiles()]
     ch = r.TChain("LuminosityBlocks")
@@ -119,6 +169,45 @@ def get_track_reference_point(muon):
     refy =  cosphi*dxy - (sinphi/sinlmb)*dsz + (sinphi/tanlmb)*refz
     return refx, refy, refz
 
+def get_pair_kinematics(muons, dvs, pvx, pvy):
+    """
+    `pair_kinematics` for the leading (muons 0,1 with DV 0) and, if there is one,
+    subleading (muons 2,3 with DV 1) pair of the selected objects, in one call
+    """
+    npairs = min(len(dvs), len(muons)//2, 2)
+    def muon_arrays(mus):
+        return dict(
+                pt=np.array([m.pt() for m in mus]),
+                eta=np.array([m.eta() for m in mus]),
+                phi=np.array([m.phi() for m in mus]),
+                phiCorr=np.array([m.phi_corr for m in mus]),
+                )
+    dv = dict(
+            x=np.array([d.x() for d in dvs[:npairs]]),
+            y=np.array([d.y() for d in dvs[:npairs]]),
+            xError=np.array([d.xError() for d in dvs[:npairs]]),
+            yError=np.array([d.yError() for d in dvs[:npairs]]),
+            )
+    return pair_kinematics(muon_arrays(muons[0:2*npairs:2]), muon_arrays(muons[1:2*npairs:2]), dv, pvx, pvy)
+
+def get_pair_columns(mu1, mu2, dv, kin, ipair):
+    """
+    Columns of pair `ipair` of `kin` (output names without the sublead_ prefix)
+    for evaluating the cuts in `selections`
+    """
+    cols = dict((k, float(v[ipair])) for k, v in kin.items() if k != "p4corr")
+    cols["DV_distPixel"] = dv.distPixel
+    cols["dimuon_isos"] = mu1.charge()*mu2.charge() < 0
+    for pfx, mu in [("Muon1_", mu1), ("Muon2_", mu2)]:
+        cols[pfx+"nValidPixelHits"] = mu.nValidPixelHits()
+        cols[pfx+"nExpectedPixelHits"] = mu.nExpectedPixelHits
+        cols[pfx+"dxyCorr"] = mu.dxyCorr
+        cols[pfx+"dxyError"] = mu.dxyError()
+        cols[pfx+"passid"] = mu.passid
+        cols[pfx+"passiso"] = mu.passiso
+        cols[pfx+"passiso4mu"] = mu.passiso4mu
+    return cols
+
 def does_dv_pass_id(dv):
     if dv.xError() > 0.05: return False
     if dv.yError() > 0.05: return False
@@ -274,28 +363,35 @@ def write_metadata_to_tfile(tfile, metadata):
         obj = r.TString(str(v))
         tfile.WriteObject(obj, k)
 
-def get_btophi_gen_info(genparts):
-    d_daughters = {}
-    for genpart in genparts:
-        pdgid = genpart.pdgId()
-        if abs(pdgid) not in [13,6000211]: continue
-        motheridx = genpart.motherRef().index()
-        mother = genparts[motheridx]
-        motherid = mother.pdgId()
-        if ((motherid == 6000211)) and (abs(pdgid)==13): 
-            if motheridx not in d_daughters:
-                d_daughters[motheridx] = {"daughters":[], "mother":None}
-            d_daughters[motheridx]["daughters"].append(genpart)
-            bmesonidx = mother.motherRef().index()
-            bmeson = genparts[bmesonidx]
-            d_daughters[motheridx]["bmeson"] = bmeson
+# side tree branches (without the BToPhi_/HZdZd_/ggPhi_ prefixes) for the gen-info
+# records, in the order they are written
+BTOPHI_SCHEMA = [
+        ("nphi", "i"), ("mu1pt", "f"), ("mu2pt", "f"), ("mu1eta", "f"), ("mu2eta", "f"),
+        ("mu1phi", "f"), ("mu2phi", "f"), ("phimass", "f"), ("phipt", "f"), ("phieta", "f"),
+        ("phiphi", "f"), ("bmesonmass", "f"), ("bmesonid", "i"), ("bmesonpt", "f"), ("bmesoneta", "f"),
+        ("run", "l"), ("luminosityBlock", "l"), ("event", "l"), ("vx", "f"), ("vy", "f"), ("vz", "f"),
+        ]
+HZDZD_SCHEMA = [
+        ("nzd", "i"), ("run", "l"), ("luminosityBlock", "l"), ("event", "l"),
+        ("mu1pt", "f"), ("mu2pt", "f"), ("mu1eta", "f"), ("mu2eta", "f"), ("mu1phi", "f"), ("mu2phi", "f"),
+        ("zdpt", "f"), ("zdeta", "f"), ("zdphi", "f"), ("zdmass", "f"), ("vx", "f"), ("vy", "f"), ("vz", "f"),
+        ]
+GGPHI_SCHEMA = [
+        ("nphi", "i"), ("run", "l"), ("luminosityBlock", "l"), ("event", "l"),
+        ("mu1pt", "f"), ("mu2pt", "f"), ("mu1eta", "f"), ("mu2eta", "f"), ("mu1phi", "f"), ("mu2phi", "f"),
+        ("phipt", "f"), ("phieta", "f"), ("phiphi", "f"), ("phimass", "f"), ("vx", "f"), ("vy", "f"), ("vz", "f"),
+        ]
+
+def get_btophi_gen_info(gen):
+    d_daughters = gen.daughters_by_mother(6000211)
     nphi = len(d_daughters.keys())
     out = {}
     out["nphi"] = nphi
     if nphi == 1:
-        d = d_daughters.values()[0]
-        mu1 = d["daughters"][0]
-        mu2 = d["daughters"][1]
+        imus = list(d_daughters.values())[0]
+        mu1 = gen.parts[imus[0]]
+        mu2 = gen.parts[imus[1]]
+        bmeson = gen.parts[gen.grandmother[imus[0]]]
         if mu2.pt() > mu1.pt(): mu1, mu2 = mu2, mu1
         out["mu1pt"] = round(mu1.pt(),4)
         out["mu2pt"] = round(mu2.pt(),4)
@@ -307,34 +403,24 @@ def get_btophi_gen_info(genparts):
         out["phipt"] = round((mu1.p4()+mu2.p4()).pt(),4)
         out["phieta"] = round((mu1.p4()+mu2.p4()).eta(),4)
         out["phiphi"] = round((mu1.p4()+mu2.p4()).phi(),4)
-        out["bmesonmass"] = round(d["bmeson"].p4().mass(),4)
-        out["bmesonid"] = d["bmeson"].pdgId()
-        out["bmesonpt"] = round(d["bmeson"].pt(),4)
-        out["bmesoneta"] = round(d["bmeson"].eta(),4)
+        out["bmesonmass"] = round(bmeson.p4().mass(),4)
+        out["bmesonid"] = bmeson.pdgId()
+        out["bmesonpt"] = round(bmeson.pt(),4)
+        out["bmesoneta"] = round(bmeson.eta(),4)
         out["vx"] = round(mu1.vx(),4)
         out["vy"] = round(mu1.vy(),4)
         out["vz"] = round(mu1.vz(),4)
     return out
 
-def get_hzdzd_gen_info(genparts):
-    d_daughters = {}
-    for genpart in genparts:
-        pdgid = genpart.pdgId()
-        if abs(pdgid) not in [13,23]: continue
-        motheridx = genpart.motherRef().index()
-        mother = genparts[motheridx]
-        motherid = mother.pdgId()
-        if ((motherid == 23)) and (abs(pdgid)==13): 
-            if motheridx not in d_daughters:
-                d_daughters[motheridx] = {"daughters":[], "mother":None}
-            d_daughters[motheridx]["daughters"].append(genpart)
+def get_hzdzd_gen_info(gen):
+    d_daughters = gen.daughters_by_mother(23)
     nzd = len(d_daughters.keys())
     out = {}
     out["nzd"] = nzd
     if nzd == 1:
-        d = d_daughters.values()[0]
-        mu1 = d["daughters"][0]
-        mu2 = d["daughters"][1]
+        imus = list(d_daughters.values())[0]
+        mu1 = gen.parts[imus[0]]
+        mu2 = gen.parts[imus[1]]
         if mu2.pt() > mu1.pt(): mu1, mu2 = mu2, mu1
         out["mu1pt"] = round(mu1.pt(),4)
         out["mu2pt"] = round(mu2.pt(),4)
@@ -351,25 +437,15 @@ def get_hzdzd_gen_info(genparts):
         out["vz"] = round(mu1.vz(),4)
     return out
 
-def get_ggphi_gen_info(genparts):
-    d_daughters = {}
-    for genpart in genparts:
-        pdgid = genpart.pdgId()
-        if abs(pdgid) not in [13,6000211,3000022]: continue
-        motheridx = genpart.motherRef().index()
-        mother = genparts[motheridx]
-        motherid = mother.pdgId()
-        if (motherid == 6000211) and (abs(pdgid)==13): 
-            if motheridx not in d_daughters:
-                d_daughters[motheridx] = {"daughters":[], "mother":None}
-            d_daughters[motheridx]["daughters"].append(genpart)
+def get_ggphi_gen_info(gen):
+    d_daughters = gen.daughters_by_mother(6000211)
     nphi = len(d_daughters.keys())
     out = {}
     if nphi == 1:
         out["nphi"] = nphi
-        d = d_daughters.values()[0]
-        mu1 = d["daughters"][0]
-        mu2 = d["daughters"][1]
+        imus = list(d_daughters.values())[0]
+        mu1 = gen.parts[imus[0]]
+        mu2 = gen.parts[imus[1]]
         if mu2.pt() > mu1.pt(): mu1, mu2 = mu2, mu1
         out["mu1pt"] = round(mu1.pt(),4)
         out["mu2pt"] = round(mu2.pt(),4)
@@ -388,7 +464,7 @@ def get_ggphi_gen_info(genparts):
 
 class Looper(object):
 
-    def __init__(self,fnames=[], output="output.root", nevents=-1, expected=-1, treename="Events", year=2018, fourmu=False):
+    def __init__(self,fnames=[], output="output.root", nevents=-1, expected=-1, treename="Events", year=2018, fourmu=False, entrystart=None, entrystop=None, profile=False, prepass=False, audit_reads=False, checkpoint_every=0, resume=False, compression=None):
         if any("*" in x for x in fnames):
             fnames = sum(map(glob.glob,fnames),[])
         self.fnames = map(xrootdify,sum(map(lambda x:x.split(","),fnames),[]))
@@ -398,6 +474,7 @@ class Looper(object):
         self.has_gen_info = False
         self.expected = expected
         self.branches = {}
+        self.schema = OrderedDict()
         self.treename = treename
         self.fname_out = output
         self.year = year
@@ -405,6 +482,24 @@ class Looper(object):
         self.outtree = None
         self.outfile = None
         self.fourmu = fourmu
+        # optional entry range (in the full chain) for sharded running
+        self.entrystart = entrystart
+        self.entrystop = entrystop
+        # per-stage timing, see profiling.py
+        self.timer = StageTimer() if profile else NullTimer()
+        # only visit entries with enough DVs/muons, see make_skim_entry_list
+        self.prepass = prepass
+        # record which input branches are used, see readaudit.py
+        self.audit_reads = audit_reads
+        # with checkpoints, the output is written in segments that are merged at the end (see write_checkpoint)
+        self.checkpoint_every = checkpoint_every
+        if resume and (self.checkpoint_every <= 0):
+            self.checkpoint_every = DEFAULT_CHECKPOINT_EVERY
+        # output compression per branch group, see compression.py (ROOT defaults if not given)
+        self.compression = parse_policy(compression) if compression else {}
+        self.checkpoint_name = os.path.splitext(self.fname_out)[0] + ".ckpt.json"
+        self.checkpoint = self.load_checkpoint() if resume else None
+        self.segments = [str(x) for x in self.checkpoint["segments"]] if self.checkpoint else []
         if self.fourmu:
             print(">>> Keeping only potentially fourmu events")
 
@@ -415,17 +510,20 @@ class Looper(object):
             self.year = 2018
             print(">>> Autodetected year and overrided it to {}".format(self.year))
 
-        # beamspot stuff - index is [year][is_mc]
+        # beamspot stuff - index is [year][is_mc], BeamspotTable once loaded
         self.bs_data = { 
-                2017: {False: {}, True: {}},
-                2018: {False: {}, True: {}},
+                2017: {False: None, True: None},
+                2018: {False: None, True: None},
                 }
 
-        self.loaded_pixel_code = False
-        self.loaded_prop_code = False
+        self.pixel_lookup = None
+
+        # buffers the entries of the output tree, see treewriter.EventsWriter
+        self.writer = None
 
         self.init_tree()
         self.init_branches()
+        apply_policy(self.outtree, self.schema, self.compression)
 
 
     def init_tree(self):
@@ -476,14 +574,156 @@ class Looper(object):
         if self.has_bs_info:
             ch.SetBranchStatus("*beamSpotMaker*",1)
 
-        self.outfile = r.TFile(self.fname_out, "recreate")
-        # self.outfile.SetCompressionSettings(int(404)) # https://root.cern.ch/doc/master/Compression_8h_source.html
+        # if an audit (--audit-reads) found which branches are used for this type of input, only enable those
+        self.input_type = readaudit.get_input_type(self.is_mc, self.has_hit_info, self.has_bs_info)
+        read_profile = None if self.audit_reads else readaudit.load_profiles().get(self.input_type)
+        if read_profile:
+            print(">>> Enabling only the {} branches of the {} read profile".format(len(read_profile["branches"]), self.input_type))
+            ch.SetBranchStatus("*",0)
+            for name in read_profile["branches"]:
+                if name in branchnames:
+                    ch.SetBranchStatus(str(name)+"*",1)
+
+        self.outfile = self.open_output()
         self.outtree = r.TTree(self.treename,"")
 
-        cachesize = 30000000
+        # enough cache for a cluster of the enabled branches
+        if read_profile:
+            cachesize = read_profile["cachesize"]
+        else:
+            ch.LoadTree(self.entrystart or 0)
+            tree = ch.GetTree()
+            cachesize = readaudit.suggest_cache_size(tree) if tree else readaudit.DEFAULT_CACHE_SIZE
+        print(">>> Using a {:.1f}MB read cache".format(cachesize/1e6))
         ch.SetCacheSize(cachesize)
         ch.SetCacheLearnEntries(500)
 
+    def make_entry_list(self, nevents_in):
+        """
+        Run the count-only pre-pass over this Looper's entries, and write the
+        skim fraction of each input file to a .skim.json next to the output.
+        Returns the entries to visit and the number of entries they were picked from.
+        """
+        first = self.entrystart or 0
+        last = first + nevents_in
+        print(">>> Started count-only pre-pass")
+        t0 = time.time()
+        entries, skim_info = make_skim_entry_list(
+                self.fnames, self.treename, first, last,
+                min_dvs=(2 if self.fourmu else 1),
+                min_muons=(4 if self.fourmu else 2),
+                )
+        t1 = time.time()
+        print(">>> Pre-pass kept {} of {} entries in {:.1f} seconds".format(len(entries), last-first, t1-t0))
+        with open(skim_sidecar_name(self.fname_out), "w") as fh:
+            json.dump(skim_info, fh, indent=2)
+        return entries, last-first
+
+    def next_output_name(self):
+        if self.checkpoint_every <= 0:
+            return self.fname_out
+        fname = "{}_seg{}.root".format(os.path.splitext(self.fname_out)[0], len(self.segments))
+        self.segments.append(fname)
+        return fname
+
+    def open_output(self):
+        outfile = r.TFile(self.next_output_name(), "recreate")
+        # branches (incl. side trees) inherit this, and apply_policy overrides it per branch group
+        # https://root.cern.ch/doc/master/Compression_8h_source.html
+        if "default" in self.compression:
+            outfile.SetCompressionSettings(self.compression["default"])
+        return outfile
+
+    def load_checkpoint(self):
+        """
+        Checkpoint state written by `write_checkpoint`, if there is one for this output and input
+        """
+        if not os.path.exists(self.checkpoint_name):
+            print(">>> No checkpoint in {}, starting from the beginning".format(self.checkpoint_name))
+            return None
+        with open(self.checkpoint_name) as fh:
+            state = json.load(fh)
+        same_job = (
+                (state["fnames"] == list(self.fnames))
+                and (state["entrystart"] == self.entrystart)
+                and (state["entrystop"] == self.entrystop)
+                and (state["nevents"] == self.nevents)
+                )
+        if not same_job:
+            print(">>> Checkpoint in {} is for different inputs, starting from the beginning".format(self.checkpoint_name))
+            return None
+        if not all(os.path.exists(fname) for fname in state["segments"]):
+            print(">>> Some output segments of the checkpoint are missing, starting from the beginning")
+            return None
+        return state
+
+    def write_output(self, side_writers, nevents_input, nevents_processed):
+        # write the output tree, counters and side trees into the current output file, and close it
+        if self.writer is not None:
+            self.writer.flush()
+        self.outfile.cd()
+        self.outtree.Write()
+
+        # number of events in the input chain
+        r.TParameter(int)("nevents_input",nevents_input).Write()
+        # number of events we actually looped over
+        r.TParameter(int)("nevents_processed",nevents_processed).Write()
+        # number of events in the output tree
+        r.TParameter(int)("nevents_output",self.outtree.GetEntries()).Write()
+        # r.TParameter(int)("nevents_prefilter",self.eff_info.get("ntotal",-1)).Write()
+        # r.TParameter(int)("nevents_postfilter",self.eff_info.get("npassed",-1)).Write()
+
+        for writer in side_writers:
+            writer.write()
+
+        self.outfile.Close()
+
+    def write_checkpoint(self, side_writers, ievt, nevents_processed):
+        """
+        Close the current output segment, record that the first `ievt` entries
+        are done (plus the side tree carry-over values), and continue in a new
+        segment. `--resume` picks up from the last checkpoint.
+        """
+        # nevents_input is only written by the last segment, so that the merged sum is right
+        self.write_output(side_writers, 0, nevents_processed)
+        state = dict(
+                fnames=list(self.fnames),
+                entrystart=self.entrystart,
+                entrystop=self.entrystop,
+                nevents=self.nevents,
+                ievt=ievt,
+                segments=self.segments,
+                side_trees=dict((writer.treename, writer.current) for writer in side_writers),
+                )
+        with open(self.checkpoint_name + ".tmp", "w") as fh:
+            json.dump(state, fh, indent=2, default=lambda x: x.item())
+        os.rename(self.checkpoint_name + ".tmp", self.checkpoint_name)
+        print(">>> Wrote checkpoint after {} events ({} segments)".format(ievt, len(self.segments)))
+
+        self.outfile = self.open_output()
+        self.make_outtree()
+        self.writer = EventsWriter(self.outtree, self.schema, self.branches, rows=True)
+        for writer in side_writers:
+            writer.reset(self.outfile)
+
+    def make_outtree(self):
+        # new output tree with branches for the existing buffers
+        self.outtree = r.TTree(self.treename,"")
+        for name, tstr in self.schema.items():
+            extra = ["{}/{}".format(name, LEAF_TYPES[tstr])] if tstr in LEAF_TYPES else []
+            self.outtree.Branch(name,self.branches[name],*extra)
+        apply_policy(self.outtree, self.schema, self.compression)
+
+    def get_nevents_in(self):
+        # number of input events this Looper is responsible for: its entry range, cut to the
+        # first `nevents` entries of it if given (-n N processes exactly N events, also with -j)
+        nevents_in = self.ch.GetEntries()
+        entrystart = self.entrystart or 0
+        entrystop = nevents_in if self.entrystop is None else min(self.entrystop, nevents_in)
+        if self.nevents > 0:
+            entrystop = min(entrystop, entrystart + self.nevents)
+        return max(entrystop - entrystart, 0)
+
     def make_branch(self, name, tstr="vi"):
         # Python: https://docs.python.org/2/library/array.html
         # ROOT: https://root.cern.ch/doc/v612/classTTree.html
@@ -507,9 +747,14 @@ class Looper(object):
             obj = array.array("L",[999]) # unsigned long
             extra.append("{}/L".format(name)) # Long64_t
         self.branches[name] = obj
+        self.schema[name] = tstr
         self.outtree.Branch(name,obj,*extra)
 
     def clear_branches(self):
+        if self.writer is not None and self.writer.rows:
+            # same defaults, in one compiled call
+            self.writer.clear_row()
+            return
         for v in self.branches.values():
             if hasattr(v,"clear"):
                 v.clear()
@@ -523,48 +768,40 @@ class Looper(object):
         if self.is_mc:
             # Events->Scan("recoBeamSpot_offlineBeamSpot__RECO.obj.x0()") in miniaod (and y0). 
             # From 2017 MC with global tag of 94X_mc2017_realistic_v14
-            self.bs_data[2017][self.is_mc] = { (0,0): [-0.024793, 0.0692861, 0.789895] }
+            self.bs_data[2017][self.is_mc] = BeamspotTable.from_rows([(0,0,-0.024793, 0.0692861, 0.789895)])
             # From 2018 MC with global tag of 102X_upgrade2018_realistic_v11
-            self.bs_data[2018][self.is_mc] = { (0,0): [0.0107796, 0.041893, 0.0248755] }
+            self.bs_data[2018][self.is_mc] = BeamspotTable.from_rows([(0,0,0.0107796, 0.041893, 0.0248755)])
         else:
             print(">>> Loading beamspot data for year={}".format(year))
             t0 = time.time()
-            data = []
-            # with gzip.open("data/beamspots_{}.pkl.gz".format(year),"r") as fh:
-            with open("data/beamspots_{}.pkl".format(year),"r") as fh:
-                data = pickle.load(fh)
-            for run,lumi,x,y,z in data:
-                self.bs_data[year][self.is_mc][(run,lumi)] = [x,y,z]
+            # memory-mapped table made by `python beamspots.py data/beamspots_<year>.pkl`
+            fname = "data/beamspots_{}.pkl".format(year)
+            if os.path.exists(table_name(fname)):
+                table = BeamspotTable.load(table_name(fname))
+            else:
+                print(">>> No {}, reading the pickle instead".format(table_name(fname)))
+                table = BeamspotTable.from_pickle(fname)
+            self.bs_data[year][self.is_mc] = table
             t1 = time.time()
-            print(">>> Finished loading {} rows in {:.1f} seconds".format(len(data),t1-t0))
+            print(">>> Finished loading {} rows in {:.1f} seconds".format(len(table),t1-t0))
 
     def get_bs(self, run, lumi, year=2018):
         if fast: return 0., 0., 0.
         if self.is_mc: run,lumi = 0,0
-        if not self.bs_data[year][self.is_mc]:
+        if self.bs_data[year][self.is_mc] is None:
             self.load_bs_data(year=year)
-        data = self.bs_data[year][self.is_mc]
-        xyz = data.get((run,lumi),None)
+        table = self.bs_data[year][self.is_mc]
+        xyz = table.get(run,lumi)
         if xyz is None:
-            xyz = data.get((0,0),[0,0,0])
+            xyz = table.mean
             print(">>> WARNING: Couldn't find (run={},lumi={},is_mc={},year={}) in beamspot lookup data. Falling back to the total mean: {}".format(run,lumi,self.is_mc,year,xyz))
         return xyz
 
     def load_pixel_code(self):
-        if not self.loaded_pixel_code:
-            print(">>> Loading pixel utilities and lookup tables")
-            t0 = time.time()
-            r.gROOT.ProcessLine(".L data/calculate_pixel.cc")
-            self.loaded_pixel_code = True
-            t1 = time.time()
-            print(">>> Finished loading in {:.1f} seconds".format(t1-t0))
-
-    def load_prop_code(self):
-        if not self.loaded_prop_code:
-            print(">>> Loading propagation utilities")
+        if self.pixel_lookup is None:
+            print(">>> Loading pixel lookup tables")
             t0 = time.time()
-            r.gROOT.ProcessLine(".L data/propagation_utils.cc")
-            self.loaded_prop_code = True
+            self.pixel_lookup = get_pixel_lookup()
             t1 = time.time()
             print(">>> Finished loading in {:.1f} seconds".format(t1-t0))
 
@@ -574,28 +811,27 @@ class Looper(object):
         rho = math.hypot(px,py)
         if (0.0 < rho < 2.4): return dict()
         if (3.7 < rho < 5.7): return dict()
-        imodule = r.point_in_which_module(px, py, pz)
+        imodules, layernums, planedists = self.pixel_lookup.lookup(px, py, pz)
         return dict(
-                imodule = imodule,
-                planedist = r.dist_to_imodule_plane(px, py, pz, imodule),
-                layernum = r.imodule_to_layernum(imodule),
+                imodule = int(imodules[0]),
+                planedist = float(planedists[0]),
+                layernum = int(layernums[0]),
                 )
 
     def get_corrected_phi(self,muon,dv):
         if fast: return muon.phi()
-        self.load_prop_code()
         refx, refy, refz = get_track_reference_point(muon)
-        vec = r.TLorentzVector()
-        vec.SetPtEtaPhiM(muon.pt(), muon.eta(), muon.phi(), MUON_MASS)
-        newphi = r.recalculate_phi_at_DV(
-            refx, refy, refz, vec.Px(), vec.Py(), vec.Pz(),
+        pt = abs(muon.pt())
+        newphi = propagation.recalculate_phi_at_DV(
+            refx, refy, refz, pt*math.cos(muon.phi()), pt*math.sin(muon.phi()), pt*math.sinh(muon.eta()),
             muon.charge(),
             dv.x(), dv.y(),
             )
-        return newphi
+        return float(newphi)
 
     def init_branches(self):
 
+        # NOTE readschema.py parses these calls to get the dtypes the analysis reads branches with
         make_branch = self.make_branch
 
         make_branch("run", "l")
@@ -829,22 +1065,55 @@ class Looper(object):
 
         l1names = []
 
+        side_writers = []
         if self.is_btophi:
-            fh_btophi = open(".temp_btophi_{}.dat".format(randid), "w")
+            btophi_writer = SideTreeWriter("btophitree", "BToPhi_", BTOPHI_SCHEMA, tfile=self.outfile, compression=side_tree_setting(self.compression))
+            side_writers.append(btophi_writer)
 
         if self.is_hzdzd:
-            fh_hzdzd = open(".temp_hzdzd_{}.dat".format(randid), "w")
+            hzdzd_writer = SideTreeWriter("hzdzdtree", "HZdZd_", HZDZD_SCHEMA, tfile=self.outfile, compression=side_tree_setting(self.compression))
+            side_writers.append(hzdzd_writer)
 
         if self.is_ggphi:
-            fh_ggphi = open(".temp_ggphi_{}.dat".format(randid), "w")
+            ggphi_writer = SideTreeWriter("ggphitree", "ggPhi_", GGPHI_SCHEMA, tfile=self.outfile, compression=side_tree_setting(self.compression))
+            side_writers.append(ggphi_writer)
 
         ievt = 0
-        nevents_in = ch.GetEntries()
+        if self.checkpoint:
+            ievt = self.checkpoint["ievt"]
+            for writer in side_writers:
+                writer.current.update(self.checkpoint["side_trees"].get(writer.treename, {}))
+            print(">>> Resuming from the checkpoint after {} events".format(ievt))
+        # entries processed before the current output segment, and when to write the next checkpoint
+        ievt_segment = ievt
+        next_checkpoint = ievt + self.checkpoint_every
+        # the loop sets the branch buffers, and the entries are filled in bulk
+        self.writer = EventsWriter(self.outtree, self.schema, self.branches, rows=True)
+        first = self.entrystart or 0
+        nevents_in = self.get_nevents_in()
         print(">>> Started slimming/skimming tree with {} events".format(nevents_in))
         t0 = time.time()
         tprev = time.time()
         nprev = 0
-        for evt in ch:
+        timer = self.timer
+        entries = None
+        if self.prepass and (self.is_btophi or self.is_hzdzd or self.is_ggphi):
+            print(">>> Not using the pre-pass, since the gen-level side trees need every event")
+        elif self.prepass:
+            entries, nentries_scanned = self.make_entry_list(nevents_in)
+            entries = entries[entries >= first + ievt]
+        if entries is None:
+            entry_iter = get_iter(ch, first + ievt, first + nevents_in)
+        else:
+            entry_iter = get_entries_iter(ch, entries)
+        recorder = readaudit.AccessRecorder(ch) if self.audit_reads else None
+        for ientry, evt in timed(entry_iter, timer, "read"):
+            timer.switch("objects")
+            if recorder is not None:
+                evt = recorder
+            if entries is not None:
+                # entries dropped by the pre-pass count as looped over
+                ievt = ientry - first
             # if (ievt-1) % 1000 == 0:
             #     ch.GetTree().PrintCacheStats()
             if (ievt-1) % 1000 == 0:
@@ -853,40 +1122,49 @@ class Looper(object):
                 print(">>> [currevt={}] Last {} events in {:.2f} seconds @ {:.1f}Hz".format(nnow,nnow-nprev,(tnow-tprev),(nnow-nprev)/(tnow-tprev)))
                 tprev = tnow
                 nprev = nnow
-            if (self.nevents > 0) and (ievt > self.nevents): break
+            if (self.checkpoint_every > 0) and (ievt >= next_checkpoint):
+                self.write_checkpoint(side_writers, ievt, ievt - ievt_segment)
+                ievt_segment = ievt
+                next_checkpoint = ievt + self.checkpoint_every
 
             ievt += 1
+            gen = None
             if self.has_gen_info:
+                timer.switch("gen_info")
                 run = int(evt.EventAuxiliary.run())
                 lumi = int(evt.EventAuxiliary.luminosityBlock())
                 eventnum = int(evt.EventAuxiliary.event())
                 if self.is_btophi:
-                    genparts = list(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
+                    if gen is None:
+                        gen = GenIndex(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
                     # compute some information here before any selections for use later and in a
                     # separate ttree
-                    d_btophi_info = get_btophi_gen_info(genparts)
+                    d_btophi_info = get_btophi_gen_info(gen)
                     d_btophi_info["event"] = eventnum
                     d_btophi_info["run"] = run
                     d_btophi_info["luminosityBlock"] = lumi
-                    fh_btophi.write(str(d_btophi_info) + "\n")
+                    btophi_writer.fill(d_btophi_info)
                 if self.is_hzdzd:
-                    genparts = list(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
+                    if gen is None:
+                        gen = GenIndex(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
                     # compute some information here before any selections for use later and in a
                     # separate ttree
-                    d_hzdzd_info = get_hzdzd_gen_info(genparts)
+                    d_hzdzd_info = get_hzdzd_gen_info(gen)
                     d_hzdzd_info["event"] = eventnum
                     d_hzdzd_info["run"] = run
                     d_hzdzd_info["luminosityBlock"] = lumi
-                    fh_hzdzd.write(str(d_hzdzd_info) + "\n")
+                    hzdzd_writer.fill(d_hzdzd_info)
                 if self.is_ggphi:
-                    genparts = list(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
+                    if gen is None:
+                        gen = GenIndex(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
                     # compute some information here before any selections for use later and in a
                     # separate ttree
-                    d_ggphi_info = get_ggphi_gen_info(genparts)
+                    d_ggphi_info = get_ggphi_gen_info(gen)
                     d_ggphi_info["event"] = eventnum
                     d_ggphi_info["run"] = run
                     d_ggphi_info["luminosityBlock"] = lumi
-                    fh_ggphi.write(str(d_ggphi_info) + "\n")
+                    ggphi_writer.fill(d_ggphi_info)
+                timer.switch("objects")
 
             dvs = evt.ScoutingVertexs_hltScoutingMuonPackerCalo_displacedVtx_HLT.product()
             muons = evt.ScoutingMuons_hltScoutingMuonPackerCalo__HLT.product()
@@ -942,7 +1220,8 @@ class Looper(object):
                 dvs[i].pvmy = pvmy
                 dvs[i].rho = (vx**2 + vy**2)**0.5
                 dvs[i].rhoCorr = ((vx-pvmx)**2 + (vy-pvmy)**2)**0.5
-                pixinfo = self.get_pixel_rectangle_info(vx,vy,vz)
+                with timer.stage("pixel"):
+                    pixinfo = self.get_pixel_rectangle_info(vx,vy,vz)
                 dvs[i].inPixel = pixinfo.get("imodule",-1)>=0
                 dvs[i].distPixel = pixinfo.get("planedist",999.)
                 dvs[i].layerPixel = pixinfo.get("layernum",-1)
@@ -969,6 +1248,7 @@ class Looper(object):
 
 
             # Start filling things
+            timer.switch("branches")
 
             ########################################
             ########## # Fill L1 branches ##########
@@ -1050,23 +1330,23 @@ class Looper(object):
             ########################################
             ####### # Fill Gen muon branches #######
             ########################################
-            genparts = []
-            if self.has_gen_info:
+            timer.switch("gen_matching")
+            if self.has_gen_info and (gen is None):
                 try:
-                    genparts = list(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
+                    gen = GenIndex(evt.recoGenParticles_genParticles__HLT.product()) # rawsim
                 except:
                     pass
+            if gen is None:
+                gen = GenIndex([])
             nGenMuon = 0
             # nFiducialMuon = 0
             # nFiducialMuon_norho = 0
             genmuons = []
-            for genpart in genparts:
-                pdgid = genpart.pdgId()
-                if abs(pdgid) not in [13,23,25,6000211,3000022,999999,1999999]: continue
-                motheridx = genpart.motherRef().index()
-                mother = genparts[motheridx]
-                motherid = mother.pdgId()
-                if abs(pdgid) in [23,25,6000211,3000022,999999,1999999]: # "exotic" except muons
+            for igen in gen.interesting:
+                genpart = gen.parts[igen]
+                pdgid = int(gen.pdgid[igen])
+                motherid = int(gen.mother_pdgid(igen))
+                if abs(pdgid) in EXOTIC_IDS: # "exotic" except muons
                     branches["GenOther_pt"].push_back(genpart.pt())
                     branches["GenOther_eta"].push_back(genpart.eta())
                     branches["GenOther_phi"].push_back(genpart.phi())
@@ -1092,15 +1372,14 @@ class Looper(object):
                     branches["GenMuon_status"].push_back(genpart.status())
                     branches["GenMuon_pdgId"].push_back(pdgid)
                     branches["GenMuon_motherId"].push_back(motherid)
-                    grandmother = genparts[mother.motherRef().index()]
-                    grandmotherid = grandmother.pdgId()
+                    grandmotherid = int(gen.take(gen.pdgid, gen.grandmother[igen], default=0))
                     branches["GenMuon_grandmotherId"].push_back(grandmotherid)
                     # if (genpart.pt() > 3.) and (abs(genpart.eta()) < 2.4):
                     #     nFiducialMuon_norho += 1
                     #     if (math.hypot(genpart.vx(),genpart.vy())<11.):
                     #         nFiducialMuon += 1
                     nGenMuon += 1
-                    genmuons.append(genpart)
+                    genmuons.append(igen)
             branches["nGenMuon"][0] = nGenMuon
             # half of nGenMuon should be number of phis
             # branches["pass_fiducialgen"][0] = (nFiducialMuon >= 2) or (not self.is_mc)
@@ -1130,8 +1409,21 @@ class Looper(object):
             ########################################
             ######### # Fill Muon branches #########
             ########################################
+            timer.switch("branches")
             branches["nMuon_raw"][0] = len(muons)
             branches["nMuon"][0] = len(selected_muons)
+
+            # closest jet and GenMuon of each selected muon, by DeltaR
+            mu_eta = [muon.eta() for muon in selected_muons]
+            mu_phi = [muon.phi() for muon in selected_muons]
+            mu_evt = np.zeros(len(selected_muons), dtype=np.int64)
+            jet_idx, jet_dr = nearest_dr([0, len(jet_etaphis)],
+                    [x[0] for x in jet_etaphis], [x[1] for x in jet_etaphis], mu_evt, mu_eta, mu_phi)
+            timer.push("gen_matching")
+            genmuon_idx, genmuon_dr = nearest_dr([0, len(genmuons)],
+                    [gen.parts[igen].eta() for igen in genmuons], [gen.parts[igen].phi() for igen in genmuons], mu_evt, mu_eta, mu_phi)
+            timer.pop()
+
             for imuon,(pfx,muon) in enumerate(zip(["Muon1_", "Muon2_", "sublead_Muon1_", "sublead_Muon2_"], selected_muons)):
                 pt = muon.pt()
                 eta = muon.eta()
@@ -1163,13 +1455,8 @@ class Looper(object):
                 branches[pfx+"trk_dsz"][0] = muon.trk_dsz()
                 branches[pfx+"trk_dszError"][0] = muon.trk_dszError()
 
-                # find index of jet that is closest to this muon. `sorted_etaphis`: [(index, (eta,phi)), ...]
-                jetIdx1, drjet = -1, 999.
-                sorted_etaphis = sorted(enumerate(jet_etaphis), key=lambda x: math.hypot(eta-x[1][0], delta_phi(phi,x[1][1])))
-                if len(sorted_etaphis) > 0: jetIdx1 = sorted_etaphis[0][0]
-                if jetIdx1 >= 0:
-                    jeteta, jetphi = sorted_etaphis[0][1]
-                    drjet = math.hypot(eta-jeteta,delta_phi(phi,jetphi))
+                # DeltaR to the jet that is closest to this muon (999 if no jets)
+                drjet = float(jet_dr[imuon])
                 branches[pfx+"drjet"][0] = drjet
 
 
@@ -1184,7 +1471,8 @@ class Looper(object):
                 branches[pfx+"trk_refy"][0] = refy
                 branches[pfx+"trk_refz"][0] = refz
 
-                muon.phi_corr = self.get_corrected_phi(muon,dv)
+                with timer.stage("propagation"):
+                    muon.phi_corr = self.get_corrected_phi(muon,dv)
                 branches[pfx+"phiCorr"][0] = muon.phi_corr
 
 
@@ -1204,14 +1492,14 @@ class Looper(object):
                 branches[pfx+"passiso4mu"][0] = muon.passiso4mu
 
                 # Find closest GenMuon by DeltaR and also embed the info into the muon branches for convenience
+                timer.push("gen_matching")
                 matched_genmu = None
-                calc_dr = lambda x: math.hypot(eta-x.eta(), delta_phi(phi,x.phi()))
-                sorted_genmuons = sorted(genmuons, key=calc_dr)
-                if len(sorted_genmuons) > 0:
-                    matched_genmu = sorted_genmuons[0]
+                if genmuon_idx[imuon] >= 0:
+                    imatched = genmuons[genmuon_idx[imuon]]
+                    matched_genmu = gen.parts[imatched]
                 muon.genMatch_dr = 999.
                 if matched_genmu is not None:
-                    muon.genMatch_dr = calc_dr(matched_genmu)
+                    muon.genMatch_dr = float(genmuon_dr[imuon])
                     branches[pfx+"genMatch_dr"][0] = muon.genMatch_dr
                     branches[pfx+"genMatch_pt"][0] = matched_genmu.pt()
                     branches[pfx+"genMatch_eta"][0] = matched_genmu.eta()
@@ -1223,20 +1511,12 @@ class Looper(object):
                     branches[pfx+"genMatch_lxy"][0] = math.hypot(matched_genmu.vx(), matched_genmu.vy())
                     branches[pfx+"genMatch_status"][0] = matched_genmu.status()
                     branches[pfx+"genMatch_pdgId"][0] = matched_genmu.pdgId()
-                    # find non-muon mother recursively 
-                    mother = matched_genmu
-                    found = False
-                    for _ in range(10):
-                        motheridx = mother.motherRef().index()
-                        mother = genparts[motheridx]
-                        motherid = mother.pdgId()
-                        # stop recursing if we found a non-muon
-                        if abs(motherid) != 13:
-                            found = True
-                            break
+                    # non-muon mother, found by going up the chain of muons
+                    iancestor = gen.ancestor[imatched]
+                    found = iancestor >= 0
                     if found:
-                        grandmother = genparts[mother.motherRef().index()]
-                        branches[pfx+"genMatch_grandmotherId"][0] = grandmother.pdgId()
+                        mother = gen.parts[iancestor]
+                        branches[pfx+"genMatch_grandmotherId"][0] = int(gen.take(gen.pdgid, gen.mother[iancestor], default=0))
                         branches[pfx+"genMatch_motherId"][0] = mother.pdgId()
                         branches[pfx+"genMatch_mothervx"][0] = mother.vx()
                         branches[pfx+"genMatch_mothervy"][0] = mother.vy()
@@ -1257,6 +1537,7 @@ class Looper(object):
                         branches[pfx+"genMatch_mothervy"][0] = 0.
                         branches[pfx+"genMatch_mothervz"][0] = 0.
                         branches[pfx+"genMatch_motherct"][0] = 0.
+                timer.pop()
 
 
             ########################################
@@ -1267,40 +1548,23 @@ class Looper(object):
                 mu1 = selected_muons[0]
                 mu2 = selected_muons[1]
                 dv = selected_dvs[0]
-                mu1p4 = r.TLorentzVector()
-                mu2p4 = r.TLorentzVector()
-                mu1p4.SetPtEtaPhiM(mu1.pt(), mu1.eta(), mu1.phi(), MUON_MASS)
-                mu2p4.SetPtEtaPhiM(mu2.pt(), mu2.eta(), mu2.phi(), MUON_MASS)
-                dimuon = (mu1p4+mu2p4)
-                vecdv2d = r.TVector2(dv.x()-pvmx, dv.y()-pvmy)
-                vecdimuon2d = r.TVector2(dimuon.Px(),dimuon.Py())
-                cosphi = (vecdv2d.Px()*vecdimuon2d.Px() + vecdv2d.Py()*vecdimuon2d.Py()) / (vecdv2d.Mod()*vecdimuon2d.Mod())
-                # definition on s2 of https://indico.cern.ch/event/846681/contributions/3557724/attachments/1907377/3150380/Displaced_Scouting_Status_Update.pdf
-                # rutgers lxy is lowercase lxy from that set of slides, which does not have the cosine term
-                lxy = vecdv2d.Mod()
-                logabsetaphi = math.log10(max(abs(mu1p4.Eta()-mu2p4.Eta()),1e-6)/max(abs(mu1p4.DeltaPhi(mu2p4)),1e-6))
-
-                # corrected p4s with phi calculated at DV instead of track reference point.
-                mu1p4_corr = r.TLorentzVector()
-                mu2p4_corr = r.TLorentzVector()
-                mu1p4_corr.SetPtEtaPhiM(mu1.pt(), mu1.eta(), mu1.phi_corr, MUON_MASS)
-                mu2p4_corr.SetPtEtaPhiM(mu2.pt(), mu2.eta(), mu2.phi_corr, MUON_MASS)
-                dimuon_corr = (mu1p4_corr+mu2p4_corr)
-                mass_pair1 = dimuon_corr.M()
-
-                ctau = lxy*cosphi*dimuon_corr.M()/dimuon_corr.Pt()
-
-
-                absdphimumu = abs(mu1p4.DeltaPhi(mu2p4))
-                absdphimudv = abs(vecdimuon2d.DeltaPhi(vecdv2d))
+                kin = get_pair_kinematics(selected_muons, selected_dvs, pvmx, pvmy)
+                lxy = float(kin["lxy"][0])
+                cosphi = float(kin["cosphi"][0])
+                logabsetaphi = float(kin["logabsetaphi"][0])
+                mass_pair1 = float(kin["dimuon_mass"][0])
+                dimuon_pt = float(kin["dimuon_pt"][0])
+                ctau = float(kin["ctau"][0])
+                absdphimumu = float(kin["absdphimumu"][0])
+                absdphimudv = float(kin["absdphimudv"][0])
                 dimuon_isos = mu1.charge()*mu2.charge() < 0
                 branches["dimuon_isos"][0] = dimuon_isos
-                branches["dimuon_pt"][0] = dimuon_corr.Pt()
-                branches["dimuon_eta"][0] = dimuon_corr.Eta()
-                branches["dimuon_phi"][0] = dimuon_corr.Phi()
-                branches["dimuon_mass"][0] = dimuon_corr.M()
+                branches["dimuon_pt"][0] = dimuon_pt
+                branches["dimuon_eta"][0] = kin["dimuon_eta"][0]
+                branches["dimuon_phi"][0] = kin["dimuon_phi"][0]
+                branches["dimuon_mass"][0] = mass_pair1
                 branches["mass"][0] = mass_pair1
-                branches["dimuon_massRaw"][0] = dimuon.M()
+                branches["dimuon_massRaw"][0] = kin["dimuon_massRaw"][0]
                 branches["absdphimumu"][0] = absdphimumu
                 branches["absdphimudv"][0] = absdphimudv
                 branches["minabsdxy"][0] = min(abs(mu1.dxyCorr),abs(mu2.dxyCorr))
@@ -1308,60 +1572,17 @@ class Looper(object):
                 branches["logabsetaphi"][0] = logabsetaphi
                 branches["cosphi"][0] = cosphi
                 branches["lxy"][0] = lxy
-                branches["lxyError"][0] = ((dv.xError()*(dv.x()-pvmx))**2 + (dv.yError()*(dv.y()-pvmy))**2)**0.5 / lxy
-
-                # both muons need to have no excess hits if the displacement is >3.5cm (otherwise we're within the 1st bpix layer and extra hits don't make sense to calculate)
-                pass_excesshits = (
-                        (lxy < 3.5) or 
-                            ( (mu1.nValidPixelHits() - mu1.nExpectedPixelHits <= 0) and
-                              (mu2.nValidPixelHits() - mu2.nExpectedPixelHits <= 0)
-                            )
-                        )
-                branches["pass_excesshits"][0] = pass_excesshits
+                branches["lxyError"][0] = kin["lxyError"][0]
 
                 branches["pass_genmatch"][0] = ((mu1.genMatch_dr < 0.1) and (mu2.genMatch_dr < 0.1)) or (not self.is_mc)
 
-                pass_materialveto = (dv.distPixel > 0.05)
-                branches["pass_materialveto"][0] = pass_materialveto
-
-                pass_dxyscaled = (
-                        (abs(mu1.dxyCorr/(lxy*dimuon_corr.M()/dimuon_corr.Pt())) > 0.1) and
-                        (abs(mu2.dxyCorr/(lxy*dimuon_corr.M()/dimuon_corr.Pt())) > 0.1)
-                        )
-                branches["pass_dxyscaled"][0] = pass_dxyscaled
-                pass_dxysig = (
-                        (abs(mu1.dxyCorr/mu1.dxyError()) > 2) and
-                        (abs(mu2.dxyCorr/mu2.dxyError()) > 2)
-                        )
-                branches["pass_dxysig"][0] = pass_dxysig
-
-                # Baseline selection
-                pass_baseline = (
-                        True
-                        and mu1.passid
-                        and mu2.passid
-                        # and (cosphi > 0) # redundant with absdphimudv cut
-                        and (absdphimumu < 2.8)
-                        and (absdphimudv < 0.02)
-                        and dimuon_isos
-                        and pass_l1
-                        and (lxy < 11.)
-                        )
-                pass_baseline_iso = pass_baseline and (mu1.passiso and mu2.passiso)
-                pass_baseline_isohalf = pass_baseline and (mu1.passiso ^ mu2.passiso)
-
-                branches["pass_baseline"][0] = pass_baseline
-                branches["pass_baseline_iso"][0] = pass_baseline_iso
-                branches["pass_baseline_isohalf"][0] = pass_baseline_isohalf
-
-                # baseline+"extra" is baseline with pixel requirements and logabsetaphi<1.25
-                pass_extra = pass_excesshits and pass_materialveto and (logabsetaphi < 1.25)
-                branches["pass_baseline_extra"][0] = pass_baseline and pass_extra
-                branches["pass_baseline_extra_iso"][0] = pass_baseline_iso and pass_extra
-                branches["pass_baseline_extra_isohalf"][0] = pass_baseline_isohalf and pass_extra
-
-                lead_pass_all = pass_baseline_iso and pass_extra and pass_dxyscaled and pass_dxysig
-                branches["pass_all"][0] = lead_pass_all
+                # pass_excesshits, pass_baseline*, pass_all, ..., see selections.py
+                cols = get_pair_columns(mu1, mu2, dv, kin, 0)
+                cols["pass_l1"] = pass_l1
+                flags = selections.evaluate(cols, "lead")
+                for name in selections.output_names("lead"):
+                    branches[name][0] = bool(flags[name])
+                lead_pass_all = bool(flags["pass_all"])
 
             # Fill some branches for subleading DV and associated muons, if they exist
             if len(selected_dvs) >= 2 and len(selected_muons) >= 4:
@@ -1369,40 +1590,20 @@ class Looper(object):
                 mu1 = selected_muons[2]
                 mu2 = selected_muons[3]
                 dv = selected_dvs[1]
-                mu1p4 = r.TLorentzVector()
-                mu2p4 = r.TLorentzVector()
-                mu1p4.SetPtEtaPhiM(mu1.pt(), mu1.eta(), mu1.phi(), MUON_MASS)
-                mu2p4.SetPtEtaPhiM(mu2.pt(), mu2.eta(), mu2.phi(), MUON_MASS)
-                dimuon = (mu1p4+mu2p4)
-                vecdv2d = r.TVector2(dv.x()-pvmx, dv.y()-pvmy)
-                vecdimuon2d = r.TVector2(dimuon.Px(),dimuon.Py())
-                cosphi = (vecdv2d.Px()*vecdimuon2d.Px() + vecdv2d.Py()*vecdimuon2d.Py()) / (vecdv2d.Mod()*vecdimuon2d.Mod())
-                lxy = vecdv2d.Mod()
-                logabsetaphi = math.log10(max(abs(mu1p4.Eta()-mu2p4.Eta()),1e-6)/max(abs(mu1p4.DeltaPhi(mu2p4)),1e-6))
-                dimuon_isos = mu1.charge()*mu2.charge() < 0
-
-                # corrected p4s with phi calculated at DV instead of track reference point.
-                mu1p4_corr = r.TLorentzVector()
-                mu2p4_corr = r.TLorentzVector()
-                mu1p4_corr.SetPtEtaPhiM(mu1.pt(), mu1.eta(), mu1.phi_corr, MUON_MASS)
-                mu2p4_corr.SetPtEtaPhiM(mu2.pt(), mu2.eta(), mu2.phi_corr, MUON_MASS)
-                # save nominal 2 muons first
-                orig_dimuon_corr = dimuon_corr
-                dimuon_corr = (mu1p4_corr+mu2p4_corr)
-                mass_pair2 = dimuon_corr.M()
-                ctau = lxy*cosphi*dimuon_corr.M()/dimuon_corr.Pt()
-                fourmuon = (orig_dimuon_corr + dimuon_corr)
-
-
-
-                absdphimumu = abs(mu1p4.DeltaPhi(mu2p4))
-                absdphimudv = abs(vecdimuon2d.DeltaPhi(vecdv2d))
+                # kinematics of both pairs were computed together above
+                lxy = float(kin["lxy"][1])
+                logabsetaphi = float(kin["logabsetaphi"][1])
+                mass_pair2 = float(kin["dimuon_mass"][1])
+                dimuon_pt = float(kin["dimuon_pt"][1])
+                absdphimumu = float(kin["absdphimumu"][1])
+                absdphimudv = float(kin["absdphimudv"][1])
+                fourmuon_mass = float(p4_mass(tuple(x[0]+x[1] for x in kin["p4corr"])))
                 dimuon_isos = mu1.charge()*mu2.charge() < 0
                 branches["sublead_dimuon_isos"][0] = dimuon_isos
-                branches["sublead_dimuon_pt"][0] = dimuon_corr.Pt()
-                branches["sublead_dimuon_eta"][0] = dimuon_corr.Eta()
-                branches["sublead_dimuon_phi"][0] = dimuon_corr.Phi()
-                branches["sublead_dimuon_mass"][0] = dimuon_corr.M()
+                branches["sublead_dimuon_pt"][0] = dimuon_pt
+                branches["sublead_dimuon_eta"][0] = kin["dimuon_eta"][1]
+                branches["sublead_dimuon_phi"][0] = kin["dimuon_phi"][1]
+                branches["sublead_dimuon_mass"][0] = mass_pair2
                 branches["sublead_mass"][0] = mass_pair2
                 branches["sublead_absdphimumu"][0] = absdphimumu
                 branches["sublead_absdphimudv"][0] = absdphimudv
@@ -1410,204 +1611,60 @@ class Looper(object):
                 branches["sublead_logabsetaphi"][0] = logabsetaphi
                 branches["sublead_lxy"][0] = lxy
 
-                pass_excesshits = (
-                        (lxy < 3.5) or 
-                            ( (mu1.nValidPixelHits() - mu1.nExpectedPixelHits <= 0) and
-                              (mu2.nValidPixelHits() - mu2.nExpectedPixelHits <= 0)
-                            )
-                        )
-                pass_materialveto = (dv.distPixel > 0.05)
-
-                # NOTE loosened wrt 2mu
-                pass_dxyscaled = (
-                        (abs(mu1.dxyCorr/(lxy*dimuon_corr.M()/dimuon_corr.Pt())) > 0.05) and
-                        (abs(mu2.dxyCorr/(lxy*dimuon_corr.M()/dimuon_corr.Pt())) > 0.05)
-                        )
-                # NOTE loosened wrt 2mu
-                pass_dxysig = (
-                        (abs(mu1.dxyCorr/mu1.dxyError()) > 1) and
-                        (abs(mu2.dxyCorr/mu2.dxyError()) > 1)
-                        )
-
                 branches["sublead_pass_genmatch"][0] = ((mu1.genMatch_dr < 0.1) and (mu2.genMatch_dr < 0.1)) or (not self.is_mc)
-                branches["sublead_pass_excesshits"][0] = pass_excesshits
-                branches["sublead_pass_materialveto"][0] = pass_materialveto
-                branches["sublead_pass_dxyscaled"][0] = pass_dxyscaled
-                branches["sublead_pass_dxysig"][0] = pass_dxysig
-
-                # Baseline selection
-                pass_baseline = (
-                        True
-                        and mu1.passid
-                        and mu2.passid
-                        and (absdphimumu < 2.8)
-                        # NOTE loosened wrt 2mu
-                        and (absdphimudv < 0.1)
-                        and dimuon_isos
-                        and pass_l1
-                        and (lxy < 11.)
-                        )
-                pass_baseline_iso = pass_baseline and (mu1.passiso4mu and mu2.passiso4mu)
-                pass_extra = pass_excesshits and pass_materialveto and (logabsetaphi < 1.25)
-
-                branches["sublead_pass_baseline"][0] = pass_baseline
-                branches["sublead_pass_baseline_iso"][0] = pass_baseline_iso
-                branches["sublead_pass_baseline_extra"][0] = pass_baseline and pass_extra
-                branches["sublead_pass_baseline_extra_iso"][0] = pass_baseline_iso and pass_extra
-                sublead_pass_all = pass_baseline_iso and pass_extra and pass_dxyscaled and pass_dxysig
-                branches["sublead_pass_all"][0] = sublead_pass_all
-
-                branches["FourMuon_mass"][0] = fourmuon.M()
-
-
-                branches["pass_fourmu"][0] = (
-                    (abs(mass_pair1 - mass_pair2) < 0.05*(mass_pair1 + mass_pair2)/2.)
-                    and pass_mass_mask(mass_pair1) 
-                    and pass_mass_mask(mass_pair2)
-                    and lead_pass_all
-                    and sublead_pass_all
-                    and (115 < fourmuon.M() < 135)
-                    )
-                branches["pass_fourmu_nomask"][0] = (
-                    (abs(mass_pair1 - mass_pair2) < 0.05*(mass_pair1 + mass_pair2)/2.)
-                    # and pass_mass_mask(mass_pair1) 
-                    # and pass_mass_mask(mass_pair2)
-                    and lead_pass_all
-                    and sublead_pass_all
-                    and (115 < fourmuon.M() < 135)
-                    )
-
-            self.outtree.Fill()
 
-        t1 = time.time()
+                cols = get_pair_columns(mu1, mu2, dv, kin, 1)
+                cols["pass_l1"] = pass_l1
+                flags = selections.evaluate(cols, "sublead", prefix="")
+                for name in selections.output_names("sublead"):
+                    branches[name][0] = bool(flags[name[len("sublead_"):]])
+                sublead_pass_all = bool(flags["pass_all"])
 
-        neventsout = self.outtree.GetEntries()
-        self.outtree.Write()
+                branches["FourMuon_mass"][0] = fourmuon_mass
 
 
-        
-        # number of events in the input chain
-        r.TParameter(int)("nevents_input",nevents_in).Write()
-        # number of events we actually looped over
-        r.TParameter(int)("nevents_processed",ievt).Write()
-        # number of events in the output tree
-        r.TParameter(int)("nevents_output",self.outtree.GetEntries()).Write()
-        # r.TParameter(int)("nevents_prefilter",self.eff_info.get("ntotal",-1)).Write()
-        # r.TParameter(int)("nevents_postfilter",self.eff_info.get("npassed",-1)).Write()
+                pass_fourmu, pass_fourmu_nomask = selections.evaluate_fourmu(mass_pair1, mass_pair2, fourmuon_mass, lead_pass_all, sublead_pass_all)
+                branches["pass_fourmu"][0] = bool(pass_fourmu)
+                branches["pass_fourmu_nomask"][0] = bool(pass_fourmu_nomask)
 
-        if self.is_btophi:
-            fh_btophi.close()
-            btophitree = r.TTree("btophitree","")
-            branches = dict()
-            def make_branch(name, tstr):
-                obj = array.array(tstr,[999])
-                btophitree.Branch(name, obj, "{}/{}".format(name, tstr.upper()))
-                branches[name] = obj
-            make_branch("BToPhi_nphi", "i")
-            make_branch("BToPhi_mu1pt", "f")
-            make_branch("BToPhi_mu2pt", "f")
-            make_branch("BToPhi_mu1eta", "f")
-            make_branch("BToPhi_mu2eta", "f")
-            make_branch("BToPhi_mu1phi", "f")
-            make_branch("BToPhi_mu2phi", "f")
-            make_branch("BToPhi_phimass", "f")
-            make_branch("BToPhi_phipt", "f")
-            make_branch("BToPhi_phieta", "f")
-            make_branch("BToPhi_phiphi", "f")
-            make_branch("BToPhi_bmesonmass", "f")
-            make_branch("BToPhi_bmesonid", "i")
-            make_branch("BToPhi_bmesonpt", "f")
-            make_branch("BToPhi_bmesoneta", "f")
-            make_branch("BToPhi_run", "l")
-            make_branch("BToPhi_luminosityBlock", "l")
-            make_branch("BToPhi_event", "l")
-            make_branch("BToPhi_vx", "f")
-            make_branch("BToPhi_vy", "f")
-            make_branch("BToPhi_vz", "f")
-            with open(".temp_btophi_{}.dat".format(randid), "r") as fh:
-                for line in fh:
-                    if not line.strip(): continue
-                    for v in branches.values():
-                        v = 999
-                    d = ast.literal_eval(line)
-                    for k,v in d.items():
-                        branches["BToPhi_{}".format(k)][0] = v
-                    btophitree.Fill()
-            btophitree.Write()
+            timer.switch("fill")
+            self.writer.append_row()
+        timer.switch("fill")
+        self.writer.flush()
+        timer.switch(None)
+        if entries is not None:
+            ievt = nentries_scanned
 
-        if self.is_hzdzd:
-            fh_hzdzd.close()
-            hzdzdtree = r.TTree("hzdzdtree","")
-            branches = dict()
-            def make_branch(name, tstr):
-                obj = array.array(tstr,[999])
-                hzdzdtree.Branch(name, obj, "{}/{}".format(name, tstr.upper()))
-                branches[name] = obj
-            make_branch("HZdZd_nzd", "i")
-            make_branch("HZdZd_run", "l")
-            make_branch("HZdZd_luminosityBlock", "l")
-            make_branch("HZdZd_event", "l")
-            make_branch("HZdZd_mu1pt", "f")
-            make_branch("HZdZd_mu2pt", "f")
-            make_branch("HZdZd_mu1eta", "f")
-            make_branch("HZdZd_mu2eta", "f")
-            make_branch("HZdZd_mu1phi", "f")
-            make_branch("HZdZd_mu2phi", "f")
-            make_branch("HZdZd_zdpt", "f")
-            make_branch("HZdZd_zdeta", "f")
-            make_branch("HZdZd_zdphi", "f")
-            make_branch("HZdZd_zdmass", "f")
-            make_branch("HZdZd_vx", "f")
-            make_branch("HZdZd_vy", "f")
-            make_branch("HZdZd_vz", "f")
-            with open(".temp_hzdzd_{}.dat".format(randid), "r") as fh:
-                for line in fh:
-                    if not line.strip(): continue
-                    for v in branches.values():
-                        v = 999
-                    d = ast.literal_eval(line)
-                    for k,v in d.items():
-                        branches["HZdZd_{}".format(k)][0] = v
-                    hzdzdtree.Fill()
-            hzdzdtree.Write()
+        t1 = time.time()
 
-        if self.is_ggphi:
-            fh_ggphi.close()
-            ggphitree = r.TTree("ggphitree","")
-            branches = dict()
-            def make_branch(name, tstr):
-                obj = array.array(tstr,[999])
-                ggphitree.Branch(name, obj, "{}/{}".format(name, tstr.upper()))
-                branches[name] = obj
-            make_branch("ggPhi_nphi", "i")
-            make_branch("ggPhi_run", "l")
-            make_branch("ggPhi_luminosityBlock", "l")
-            make_branch("ggPhi_event", "l")
-            make_branch("ggPhi_mu1pt", "f")
-            make_branch("ggPhi_mu2pt", "f")
-            make_branch("ggPhi_mu1eta", "f")
-            make_branch("ggPhi_mu2eta", "f")
-            make_branch("ggPhi_mu1phi", "f")
-            make_branch("ggPhi_mu2phi", "f")
-            make_branch("ggPhi_phipt", "f")
-            make_branch("ggPhi_phieta", "f")
-            make_branch("ggPhi_phiphi", "f")
-            make_branch("ggPhi_phimass", "f")
-            make_branch("ggPhi_vx", "f")
-            make_branch("ggPhi_vy", "f")
-            make_branch("ggPhi_vz", "f")
-            with open(".temp_ggphi_{}.dat".format(randid), "r") as fh:
-                for line in fh:
-                    if not line.strip(): continue
-                    for v in branches.values():
-                        v = 999
-                    d = ast.literal_eval(line)
-                    for k,v in d.items():
-                        branches["ggPhi_{}".format(k)][0] = v
-                    ggphitree.Fill()
-            ggphitree.Write()
+        neventsout = self.outtree.GetEntries()
+        self.write_output(side_writers, nevents_in, ievt - ievt_segment)
+        if self.checkpoint_every > 0:
+            counts = merge_outputs(self.segments, self.fname_out)
+            neventsout = counts["nevents_output"]
+            for fname in self.segments:
+                os.remove(fname)
+            if os.path.exists(self.checkpoint_name):
+                os.remove(self.checkpoint_name)
+            print(">>> Merged {} output segments into {}".format(len(self.segments), self.fname_out))
+
+        if timer.enabled:
+            report = timer.report(
+                    nevents_input=nevents_in,
+                    nevents_processed=ievt,
+                    nevents_output=neventsout,
+                    fname_out=self.fname_out,
+                    fnames=list(self.fnames),
+                    cache=get_cache_stats(ch),
+                    )
+            print(">>> Wrote timing report to {}".format(write_report(report, self.fname_out)))
 
-        self.outfile.Close()
+        if recorder is not None:
+            report = readaudit.make_report(ch, recorder.touched(), ievt, self.input_type, cache_stats=get_cache_stats())
+            with open(readaudit.sidecar_name(self.fname_out), "w") as fh:
+                json.dump(report, fh, indent=2)
+            readaudit.print_summary(report)
+            print(">>> Wrote read audit to {}".format(readaudit.sidecar_name(self.fname_out)))
 
         print(">>> Finished slim/skim of {} events in {:.2f} seconds @ {:.1f}Hz".format(ievt,(t1-t0),ievt/(t1-t0)))
         print(">>> Output tree has size {:.1f}MB and {} events".format(os.stat(self.fname_out).st_size/1e6,neventsout))
@@ -1619,18 +1676,161 @@ class Looper(object):
             print(">>> Expected {} events but ran on {}. Raising exit code=2.".format(self.expected,ievt))
             sys.exit(2)
 
+def run_shard(args):
+    # Run one entry range in a worker process. Returns the exit code instead of exiting.
+    looper_class, kwargs = args
+    looper = looper_class(**kwargs)
+    try:
+        looper.run()
+    except SystemExit as e:
+        return e.code
+    return 0
+
+def merge_outputs(fnames, fname_out, treenames=["Events", "btophitree", "hzdzdtree", "ggphitree"]):
+    """
+    Merge partial babies (in order) into `fname_out`, concatenating the trees and
+    summing the `nevents_*` TParameters
+    """
+    f = r.TFile(fnames[0])
+    treenames = [name for name in treenames if f.Get(name)]
+    f.Close()
+
+    fout = r.TFile(fname_out, "recreate")
+    chains = []
+    for treename in treenames:
+        ch = r.TChain(treename)
+        for fname in fnames:
+            ch.Add(fname)
+        fout.cd()
+        t = ch.CloneTree(-1, "fast")
+        t.Write()
+        chains.append(ch)
+
+    counts = dict()
+    for fname in fnames:
+        f = r.TFile(fname)
+        for name in ["nevents_input", "nevents_processed", "nevents_output"]:
+            counts[name] = counts.get(name, 0) + int(f.Get(name).GetVal())
+        f.Close()
+    fout.cd()
+    for name in ["nevents_input", "nevents_processed", "nevents_output"]:
+        r.TParameter(int)(name, counts[name]).Write()
+    fout.Close()
+    return counts
+
+def run_sharded(looper_class, kwargs, nproc):
+    """
+    Split the input entries into `nproc` ranges, run each in a process pool and
+    merge the partial outputs into the requested output file
+    """
+    import multiprocessing
+
+    fnames = kwargs["fnames"]
+    if any("*" in x for x in fnames):
+        fnames = sum(map(glob.glob,fnames),[])
+    ch = r.TChain(kwargs.get("treename", "Events"))
+    for fname in map(xrootdify,sum(map(lambda x:x.split(","),fnames),[])):
+        ch.Add(fname)
+    nevents_total = ch.GetEntries()
+    del ch
+    nevents_todo = nevents_total
+    if kwargs.get("nevents", -1) > 0:
+        nevents_todo = min(nevents_total, kwargs["nevents"])
+
+    output = kwargs["output"]
+    edges = [nevents_todo*i//nproc for i in range(nproc+1)]
+    shards = []
+    for i in range(nproc):
+        if edges[i] == edges[i+1]: continue
+        shard_kwargs = dict(kwargs)
+        shard_kwargs.update(
+                output=output.replace(".root", "_part{}.root".format(i)),
+                nevents=-1,
+                expected=-1,
+                entrystart=edges[i],
+                entrystop=edges[i+1],
+                )
+        shards.append((looper_class, shard_kwargs))
+    print(">>> Splitting {} events into {} ranges".format(nevents_todo, len(shards)))
+
+    pool = multiprocessing.Pool(min(nproc, len(shards)))
+    exitcodes = pool.map(run_shard, shards)
+    pool.close()
+    pool.join()
+    if any(exitcodes):
+        print(">>> Some ranges failed with exit codes {}. Raising exit code=2.".format(exitcodes))
+        sys.exit(2)
+
+    partial_fnames = [shard_kwargs["output"] for _, shard_kwargs in shards]
+    counts = merge_outputs(partial_fnames, output)
+    for fname in partial_fnames:
+        os.remove(fname)
+    if kwargs.get("prepass") and not all(os.path.exists(skim_sidecar_name(fname)) for fname in partial_fnames):
+        print(">>> Not all ranges wrote a skim summary, not writing {}".format(skim_sidecar_name(output)))
+        for fname in filter(os.path.exists, map(skim_sidecar_name, partial_fnames)):
+            os.remove(fname)
+    elif kwargs.get("prepass"):
+        # combine per-file counts, since a file can be split over several ranges
+        skim_info = OrderedDict()
+        for fname in map(skim_sidecar_name, partial_fnames):
+            with open(fname) as fh:
+                for d in json.load(fh):
+                    tot = skim_info.setdefault(d["fname"], dict(fname=d["fname"], nentries=0, npassed=0))
+                    tot["nentries"] += d["nentries"]
+                    tot["npassed"] += d["npassed"]
+            os.remove(fname)
+        for d in skim_info.values():
+            d["fraction"] = float(d["npassed"])/max(d["nentries"], 1)
+        with open(skim_sidecar_name(output), "w") as fh:
+            json.dump(list(skim_info.values()), fh, indent=2)
+    if kwargs.get("audit_reads"):
+        # the audits of the ranges only differ by statistics, keep the first one
+        fnames = [readaudit.sidecar_name(fname) for fname in partial_fnames if os.path.exists(readaudit.sidecar_name(fname))]
+        if fnames:
+            os.rename(fnames[0], readaudit.sidecar_name(output))
+        else:
+            print(">>> No read audits were written by the ranges, not writing {}".format(readaudit.sidecar_name(output)))
+        for fname in fnames[1:]:
+            os.remove(fname)
+    if kwargs.get("profile"):
+        reports = []
+        for fname in map(sidecar_name, partial_fnames):
+            with open(fname) as fh:
+                reports.append(json.load(fh))
+            os.remove(fname)
+        print(">>> Wrote merged timing report to {}".format(write_report(merge_reports(reports), output)))
+    print(">>> Merged {} partial outputs into {} with {} events".format(len(partial_fnames), output, counts["nevents_output"]))
+
+    ievt = counts["nevents_processed"]
+    if (ievt != nevents_todo) or (counts["nevents_input"] != nevents_todo):
+        print(">>> Looped over {} entries instead of {}. Raising exit code=2.".format(ievt,nevents_todo))
+        sys.exit(2)
+    expected = kwargs.get("expected", -1)
+    if (expected > 0) and (int(expected) != ievt):
+        print(">>> Expected {} events but ran on {}. Raising exit code=2.".format(expected,ievt))
+        sys.exit(2)
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("fnames", help="input file(s)", nargs="*")
     parser.add_argument("-o", "--output", help="output file name", default="output.root", type=str)
-    parser.add_argument("-n", "--nevents", help="max number of events to process (-1 = all)", default=-1, type=int)
+    parser.add_argument("-n", "--nevents", help="number of events to process, i.e., the first N entries (-1 = all)", default=-1, type=int)
     parser.add_argument("-e", "--expected", help="expected number of events", default=-1, type=int)
     parser.add_argument("-y", "--year", help="year (2017 or 2018)", default=2018, type=int)
     parser.add_argument("-t", "--fourmu", help="skip non fourmu events potentially", action="store_true")
+    parser.add_argument("--columnar", help="use the chunked/vectorized engine", action="store_true")
+    parser.add_argument("--chunksize", help="entries per chunk for --columnar", default=50000, type=int)
+    parser.add_argument("-j", "--nproc", help="split the input entries over this many processes and merge the outputs", default=1, type=int)
+    parser.add_argument("--prepass", help="only loop over entries with enough DVs/muons, found by a pre-pass over the collection sizes", action="store_true")
+    parser.add_argument("--audit-reads", help="record which input branches are used and write a .reads.json report (see readaudit.py)", action="store_true")
+    parser.add_argument("--checkpoint", help="write a checkpoint every this many entries (0 = never)", default=0, type=int)
+    parser.add_argument("--resume", help="continue from the checkpoint of a previous (interrupted) run with the same arguments, if any", action="store_true")
+    parser.add_argument("--compression", help="output compression policy, e.g., mixed or 'default=lz4:4,gen=zstd:5' (see compression.py)", default="", type=str)
+    parser.add_argument("--profile", help="time the processing stages and write a .perf.json report next to the output", action="store_true")
     args = parser.parse_args()
 
-    looper = Looper(
+    kwargs = dict(
             fnames=args.fnames,
             output=args.output,
             nevents=args.nevents,
@@ -1638,4 +1838,25 @@ if __name__ == "__main__":
             year=args.year,
             fourmu=args.fourmu,
     )
-    looper.run()
+    if args.profile:
+        kwargs["profile"] = True
+    if args.prepass:
+        kwargs["prepass"] = True
+    if args.audit_reads:
+        kwargs["audit_reads"] = True
+    if args.checkpoint > 0:
+        kwargs["checkpoint_every"] = args.checkpoint
+    if args.resume:
+        kwargs["resume"] = True
+    if args.compression:
+        kwargs["compression"] = args.compression
+    looper_class = Looper
+    if args.columnar:
+        from columnar import ColumnarLooper
+        looper_class = ColumnarLooper
+        kwargs["chunksize"] = args.chunksize
+    if args.nproc > 1:
+        run_sharded(looper_class, kwargs, args.nproc)
+    else:
+        looper = looper_class(**kwargs)
+        looper.run()
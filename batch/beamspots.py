@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Compact (run, lumi) -> beamspot (x, y, z) table.
+
+`data/beamspots_<year>.pkl` is a pickled list of (run, lumi, x, y, z) rows.
+Unpickling it and turning it into a dict takes seconds and a lot of memory
+in every job, so
+
+    python beamspots.py data/beamspots_2018.pkl
+
+converts it once into `data/beamspots_2018.npz`: rows sorted by (run, lumi),
+stored as contiguous arrays plus a small per-run index. `BeamspotTable`
+memory-maps that file and only copies out the lumis of a run when the run is
+first looked up.
+"""
+
+from __future__ import print_function, division
+
+import os
+import pickle
+import argparse
+
+import numpy as np
+
+from npzutils import load_npz_mmap
+
+class BeamspotTable(object):
+    """
+    Sorted (run, lumi) -> (x, y, z) lookup. The (0, 0) row, if there is one,
+    holds the mean beamspot that is used as the fallback (`mean`)
+    """
+
+    def __init__(self, runs, run_offsets, lumis, xyz):
+        # runs/run_offsets are tiny and read fully, lumis/xyz may be memory-mapped
+        self.runs = np.asarray(runs)
+        self.run_offsets = np.asarray(run_offsets)
+        self.lumis = lumis
+        self.xyz = xyz
+        self.cache = {}
+        lumis0, xyz0 = self.get_run(0)
+        found = lumis0 == 0
+        self.mean = xyz0[found][0].tolist() if found.any() else [0., 0., 0.]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Make a table from an iterable of (run, lumi, x, y, z)
+        """
+        rows = np.array(list(rows), dtype=np.float64).reshape(-1, 5)
+        run = rows[:,0].astype(np.uint32)
+        lumi = rows[:,1].astype(np.uint32)
+        order = np.lexsort((lumi, run))
+        run, lumi, xyz = run[order], lumi[order], np.ascontiguousarray(rows[order,2:])
+        runs, starts = np.unique(run, return_index=True)
+        run_offsets = np.append(starts, len(run)).astype(np.int64)
+        return cls(runs, run_offsets, lumi, xyz)
+
+    @classmethod
+    def from_pickle(cls, fname):
+        with open(fname, "rb") as fh:
+            return cls.from_rows(pickle.load(fh))
+
+    @classmethod
+    def load(cls, fname):
+        arrays = load_npz_mmap(fname)
+        return cls(arrays["runs"], arrays["run_offsets"], arrays["lumis"], arrays["xyz"])
+
+    def save(self, fname):
+        np.savez(fname, runs=self.runs, run_offsets=self.run_offsets,
+                lumis=np.asarray(self.lumis), xyz=np.asarray(self.xyz))
+
+    def __len__(self):
+        return len(self.lumis)
+
+    def get_run(self, run):
+        """
+        (lumis, xyz) rows of one run, copied out of the table on first use
+        """
+        if run not in self.cache:
+            irun = np.searchsorted(self.runs, run)
+            if irun < len(self.runs) and self.runs[irun] == run:
+                lo, hi = self.run_offsets[irun], self.run_offsets[irun+1]
+                self.cache[run] = (np.array(self.lumis[lo:hi]), np.array(self.xyz[lo:hi]))
+            else:
+                self.cache[run] = (np.zeros(0, dtype=np.uint32), np.zeros((0, 3)))
+        return self.cache[run]
+
+    def get(self, run, lumi):
+        """
+        [x, y, z] for one (run, lumi), or None if it's not in the table
+        """
+        lumis, xyz = self.get_run(run)
+        i = np.searchsorted(lumis, lumi)
+        if i < len(lumis) and lumis[i] == lumi:
+            return xyz[i].tolist()
+        return None
+
+def table_name(fname_pkl):
+    return os.path.splitext(fname_pkl)[0] + ".npz"
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convert pickled beamspot rows into the table read by BeamspotTable")
+    parser.add_argument("fnames", help="beamspots_<year>.pkl file(s)", nargs="+")
+    args = parser.parse_args()
+
+    for fname in args.fnames:
+        table = BeamspotTable.from_pickle(fname)
+        table.save(table_name(fname))
+        print(">>> Wrote {} rows for {} runs to {}".format(len(table), len(table.runs), table_name(fname)))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Per-stage throughput of the babymaker on synthetic inputs from `synthetic.py`
+(needs a CMSSW environment for the dictionaries):
+
+    python bench_babymaker.py -n 5000
+    python bench_babymaker.py -n 20000 --ndv 2 --lxy-dist flat --lxy 11 --columnar
+
+This writes a data file and an MC file (BToPhi-like gen record, with hit and
+beamspot info), runs the babymaker on each with `--profile`, and prints the
+events/s of every stage (and overall) for the data and MC paths side by side.
+Generator settings are the same options as for `synthetic.py`.
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from collections import OrderedDict
+
+import synthetic
+from profiling import sidecar_name, print_summary
+
+# input type -> (file name, which picks the year and gen-info side tree in the Looper, make_file kwargs)
+INPUTS = OrderedDict([
+    ("data", ("synthetic_Run{year}_data.root", dict(is_mc=False, hit_info=False, bs_info=True))),
+    ("mc", ("synthetic_BToPhi_Run{year}_mc.root", dict(is_mc=True, hit_info=True, bs_info=True))),
+    ])
+
+def run_baby(fname, output, columnar=False):
+    from babymaker import Looper
+    looper_class = Looper
+    if columnar:
+        from columnar import ColumnarLooper
+        looper_class = ColumnarLooper
+    looper = looper_class(fnames=[fname], output=output, profile=True)
+    try:
+        looper.run()
+    except SystemExit:
+        # a mismatch of processed and expected events is reported as an error by the Looper
+        pass
+    with open(sidecar_name(output)) as fh:
+        return json.load(fh)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nevents", help="number of events per input type", default=5000, type=int)
+    parser.add_argument("-t", "--types", help="comma separated input types", default=",".join(INPUTS), type=str)
+    parser.add_argument("--columnar", help="run the columnar engine", action="store_true")
+    parser.add_argument("--seed", help="random seed", default=42, type=int)
+    parser.add_argument("--keep", help="keep the inputs and outputs in this directory (and reuse existing inputs)", default="", type=str)
+    synthetic.add_config_args(parser)
+    args = parser.parse_args()
+
+    config = synthetic.get_config(args)
+    workdir = args.keep or tempfile.mkdtemp()
+    reports = OrderedDict()
+    for itype in args.types.split(","):
+        pattern, kwargs = INPUTS[itype]
+        cfg = OrderedDict(config)
+        if itype == "mc" and not cfg["grandmother_id"]:
+            # B meson, so that the BToPhi side tree gets filled
+            cfg["grandmother_id"] = 521
+        fname = os.path.join(workdir, pattern.format(year=cfg["year"]))
+        if not os.path.exists(fname):
+            synthetic.make_file(fname, args.nevents, config=cfg, seed=args.seed, **kwargs)
+        output = os.path.join(workdir, "baby_{}.root".format(itype))
+        reports[itype] = run_baby(fname, output, columnar=args.columnar)
+        print(">>> {}".format(itype))
+        print_summary(reports[itype])
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+    stages = []
+    for report in reports.values():
+        stages += [name for name in sorted(report["stages"], key=lambda x: -report["stages"][x]["total"]) if name not in stages]
+    print()
+    print("{:<16s} ".format("events/s") + " ".join("{:>12s}".format(itype) for itype in reports))
+    for name in stages + ["total"]:
+        rates = []
+        for report in reports.values():
+            total = report["walltime"] if name == "total" else report["stages"].get(name, {}).get("total", 0.)
+            rates.append(report["nevents_timed"]/total if total > 0 else float("nan"))
+        print("{:<16s} ".format(name) + " ".join("{:>12.0f}".format(rate) for rate in rates))
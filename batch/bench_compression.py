@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Write and read cost of the output compression policies in `compression.py`:
+
+    python bench_compression.py input.root -n 50000
+    python bench_compression.py input.root -p root,lz4,mixed,"default=zstd:3" --read-branches "*"
+
+For each policy, this runs the babymaker on the first `n` entries of the input,
+and reports the write throughput and the output size. The read throughput is
+for `make_df` from `analysis/utils.py` (needs the analysis environment: python3,
+uproot3, pandas), which is how the outputs get read over and over in notebooks.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from babymaker import Looper
+from compression import POLICIES
+
+def write_baby(fnames, output, nevents, policy, columnar=False):
+    looper_class = Looper
+    kwargs = dict(fnames=fnames, output=output, nevents=nevents, compression=(policy if policy != "root" else None))
+    if columnar:
+        from columnar import ColumnarLooper
+        looper_class = ColumnarLooper
+    looper = looper_class(**kwargs)
+    t0 = time.time()
+    try:
+        looper.run()
+    except SystemExit:
+        # running on part of the input is reported as an error by the Looper
+        pass
+    t1 = time.time()
+    import ROOT as r
+    f = r.TFile(output)
+    nprocessed = int(f.Get("nevents_processed").GetVal())
+    f.Close()
+    return nprocessed, t1-t0
+
+def read_baby(fname, branches, cut, repeat=3):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+    from utils import make_df
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        df = make_df(fname, branches=branches, cut=cut, nthreads=1, progress=False)
+        times.append(time.time()-t0)
+    return len(df), min(times)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fnames", help="input file(s)", nargs="+")
+    parser.add_argument("-n", "--nevents", help="number of events to process", default=50000, type=int)
+    parser.add_argument("-p", "--policies", help="comma separated policies to compare", default=",".join(POLICIES), type=str)
+    parser.add_argument("--columnar", help="write with the columnar engine", action="store_true")
+    parser.add_argument("--read-branches", help="comma separated branches for make_df", default="dimuon_mass,pass_*", type=str)
+    parser.add_argument("--read-cut", help="cut for make_df", default="pass_baseline_iso", type=str)
+    parser.add_argument("--no-read", help="only measure writing", action="store_true")
+    parser.add_argument("--keep", help="keep the outputs in this directory", default="", type=str)
+    args = parser.parse_args()
+
+    outdir = args.keep or tempfile.mkdtemp()
+    rows = []
+    for policy in args.policies.split(","):
+        output = os.path.join(outdir, "bench_{}.root".format(policy.replace("=", "_").replace(":", "").replace(",", "_")))
+        nprocessed, twrite = write_baby(args.fnames, output, args.nevents, policy, columnar=args.columnar)
+        size = os.stat(output).st_size
+        tread = float("nan")
+        if not args.no_read:
+            _, tread = read_baby(output, args.read_branches.split(","), args.read_cut)
+        rows.append((policy, nprocessed, twrite, size, tread))
+        if not args.keep:
+            os.remove(output)
+    if not args.keep:
+        os.rmdir(outdir)
+
+    print("{:<32s} {:>10s} {:>12s} {:>10s} {:>12s} {:>10s}".format("policy", "events", "write [Hz]", "size [MB]", "read [Hz]", "read [MB/s]"))
+    for policy, nprocessed, twrite, size, tread in rows:
+        print("{:<32s} {:>10d} {:>12.1f} {:>10.2f} {:>12.0f} {:>10.1f}".format(
+            policy, nprocessed, nprocessed/twrite, size/1e6, nprocessed/tread, size/1e6/tread))
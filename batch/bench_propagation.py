@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Accuracy and speed of the closed-form helix propagation in `propagation.py`
+against the stepped `recalculate_phi_at_DV` (dt=0.1) in `data/propagation_utils.cc`,
+binned in DV displacement:
+
+    python bench_propagation.py -n 100000
+    python bench_propagation.py -n 2000 --root   # stepped reference from the C++ code via ROOT
+
+Without `--root`, the stepped reference is a line-by-line python port of the
+C++ loop in single precision (jitted if numba is available).
+"""
+from __future__ import print_function, division
+
+import time
+import argparse
+
+import numpy as np
+
+from kernels import jit
+import propagation
+
+@jit
+def stepped_phi(refx, refy, px, py, pz, charge, dvx, dvy, dt, out):
+    for i in range(len(refx)):
+        P = np.float32(np.sqrt(np.float32(px[i]*px[i] + py[i]*py[i] + pz[i]*pz[i])))
+        Pxy = np.float32(np.sqrt(np.float32(px[i]*px[i] + py[i]*py[i])))
+        E = np.float32(np.sqrt(np.float32(P*P + np.float32(0.10566)**2)))
+        vx = np.float32(px[i]/E*np.float32(0.29979))
+        vy = np.float32(py[i]/E*np.float32(0.29979))
+        vxy = np.float32(np.sqrt(np.float32(vx*vx + vy*vy)))
+        R = np.float32(1e3*Pxy/(3.*charge[i]*3.8))
+        w = np.float32(vxy/R)
+        t = np.float32(0.)
+        rho = np.float32(-1.)
+        target = np.float32(np.sqrt(np.float32(dvx[i]*dvx[i] + dvy[i]*dvy[i])))
+        nsteps = 0
+        while rho < target:
+            x = np.float32(refx[i] + (vy/w)*(1-np.cos(w*t)) + (vx/w)*np.sin(w*t))
+            y = np.float32(refy[i] + (vx/w)*(-1+np.cos(w*t)) + (vy/w)*np.sin(w*t))
+            rho = np.float32(np.sqrt(np.float32(x*x + y*y)))
+            t = np.float32(t + dt)
+            nsteps += 1
+            if nsteps > 10000:
+                break
+        out[i] = np.arctan2(vy*np.cos(w*t) - vx*np.sin(w*t), vy*np.sin(w*t) + vx*np.cos(w*t))
+
+def make_muons(n, seed=42):
+    """
+    Muons from displaced vertices: DV at rho up to 50cm, muon momentum roughly
+    along the DV direction, and the track reference point at the point of closest
+    approach to the beamline of the corresponding straight line.
+    """
+    rng = np.random.RandomState(seed)
+    pt = 3.+rng.exponential(10., n)
+    eta = rng.uniform(-2.4, 2.4, n)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    charge = rng.choice([-1, 1], n)
+    rho = rng.uniform(0., 50., n)
+    dvphi = phi + rng.normal(0., 0.2, n)
+    dvx, dvy = rho*np.cos(dvphi), rho*np.sin(dvphi)
+    px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+    lxy = dvx*np.cos(phi) + dvy*np.sin(phi)
+    refx, refy = dvx - lxy*np.cos(phi), dvy - lxy*np.sin(phi)
+    refz = rng.normal(0., 5., n)
+    return dict(refx=refx, refy=refy, refz=refz, px=px, py=py, pz=pz, charge=charge, dvx=dvx, dvy=dvy)
+
+def stepped_root(m):
+    import ROOT as r
+    r.gROOT.ProcessLine(".L data/propagation_utils.cc")
+    return np.array([r.recalculate_phi_at_DV(
+        m["refx"][i], m["refy"][i], m["refz"][i], m["px"][i], m["py"][i], m["pz"][i],
+        int(m["charge"][i]), m["dvx"][i], m["dvy"][i])
+        for i in range(len(m["refx"]))])
+
+def dphi(a, b):
+    return np.abs(np.mod(a - b + np.pi, 2*np.pi) - np.pi)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nmuons", help="number of muons", default=100000, type=int)
+    parser.add_argument("--root", help="use propagation_utils.cc through ROOT as the stepped reference", action="store_true")
+    args = parser.parse_args()
+
+    m = make_muons(args.nmuons)
+    n = len(m["refx"])
+
+    t0 = time.time()
+    if args.root:
+        ref = stepped_root(m)
+    else:
+        ref = np.zeros(n)
+        f32 = dict((k, v.astype(np.float32)) for k, v in m.items())
+        f32["charge"] = m["charge"].astype(np.int32)
+        stepped_phi(f32["refx"][:1], f32["refy"][:1], f32["px"][:1], f32["py"][:1], f32["pz"][:1], f32["charge"][:1], f32["dvx"][:1], f32["dvy"][:1], np.float32(0.1), ref[:1]) # compile
+        t0 = time.time()
+        stepped_phi(f32["refx"], f32["refy"], f32["px"], f32["py"], f32["pz"], f32["charge"], f32["dvx"], f32["dvy"], np.float32(0.1), ref)
+    t_stepped = time.time()-t0
+
+    args_prop = [m[k] for k in ["refx", "refy", "refz", "px", "py", "pz", "charge", "dvx", "dvy"]]
+    t0 = time.time()
+    exact = propagation.recalculate_phi_at_DV(*args_prop)
+    t_exact = time.time()-t0
+    emulated = propagation.recalculate_phi_at_DV(*args_prop, dt=0.1)
+
+    print(">>> {} muons: stepped {:.3f}s ({:.2f}us/muon), closed-form {:.3f}s ({:.3f}us/muon)".format(
+        n, t_stepped, 1e6*t_stepped/n, t_exact, 1e6*t_exact/n))
+    rho = np.hypot(m["dvx"], m["dvy"])
+    edges = [0., 1., 5., 10., 20., 30., 50.]
+    print("{:>12s} {:>8s} {:>14s} {:>14s} {:>16s}".format("DV rho [cm]", "muons", "median |dphi|", "max |dphi|", "max |dphi| (dt)"))
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        sel = (rho >= lo) & (rho < hi)
+        if not sel.any(): continue
+        d = dphi(exact[sel], ref[sel])
+        de = dphi(emulated[sel], ref[sel])
+        print("{:>12s} {:>8d} {:>14.2e} {:>14.2e} {:>16.2e}".format("{:g}-{:g}".format(lo, hi), sel.sum(), np.median(d), d.max(), de.max()))
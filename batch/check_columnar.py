@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Parity check of the columnar engine against the event loop on synthetic inputs
+from `synthetic.py` (needs a CMSSW environment for the dictionaries, and uproot3):
+
+    python check_columnar.py -n 5000
+    python check_columnar.py -n 20000 --ndv 2 --njets 4 -t data,btophi
+
+This writes a data file and MC files with the BToPhi, HZdZd and ggPhi gen-info
+side trees, runs both engines on each, and compares the Events tree and the side
+tree with `compare_babies.compare` at zero tolerance. Exits with code 1 if any
+of them differ. Generator settings are the same options as for `synthetic.py`.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from collections import OrderedDict
+
+import synthetic
+from compare_babies import compare
+
+# input type -> (file name, which picks the year and gen-info side tree in the Looper,
+# make_file kwargs, generator settings to override, trees to compare)
+INPUTS = OrderedDict([
+    ("data", ("synthetic_Run{year}_data.root", dict(is_mc=False, hit_info=False, bs_info=True), {}, ["Events"])),
+    ("btophi", ("synthetic_BToPhi_Run{year}_mc.root", dict(is_mc=True, hit_info=True, bs_info=True),
+        dict(mother_id=6000211, grandmother_id=521), ["Events", "btophitree"])),
+    ("hzdzd", ("synthetic_HToZdZd_Run{year}_mc.root", dict(is_mc=True, hit_info=True, bs_info=False),
+        dict(mother_id=23, grandmother_id=0), ["Events", "hzdzdtree"])),
+    ("ggphi", ("synthetic_ggPhi_Run{year}_mc.root", dict(is_mc=True, hit_info=False, bs_info=True),
+        dict(mother_id=6000211, grandmother_id=0), ["Events", "ggphitree"])),
+    ])
+
+def run_engine(fname, output, columnar=False, chunksize=0):
+    from babymaker import Looper
+    looper_class, kwargs = Looper, {}
+    if columnar:
+        from columnar import ColumnarLooper
+        looper_class = ColumnarLooper
+        if chunksize > 0:
+            kwargs["chunksize"] = chunksize
+    looper = looper_class(fnames=[fname], output=output, **kwargs)
+    looper.run()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nevents", help="number of events per input type", default=5000, type=int)
+    parser.add_argument("-t", "--types", help="comma separated input types", default=",".join(INPUTS), type=str)
+    parser.add_argument("--chunksize", help="entries per chunk for the columnar engine (small values check the chunk boundaries)", default=0, type=int)
+    parser.add_argument("--seed", help="random seed", default=42, type=int)
+    parser.add_argument("--keep", help="keep the inputs and outputs in this directory (and reuse existing inputs)", default="", type=str)
+    synthetic.add_config_args(parser)
+    args = parser.parse_args()
+
+    config = synthetic.get_config(args)
+    workdir = args.keep or tempfile.mkdtemp()
+    results = OrderedDict()
+    for itype in args.types.split(","):
+        pattern, kwargs, overrides, treenames = INPUTS[itype]
+        cfg = OrderedDict(config)
+        cfg.update(overrides)
+        fname = os.path.join(workdir, pattern.format(year=cfg["year"]))
+        if not os.path.exists(fname):
+            synthetic.make_file(fname, args.nevents, config=cfg, seed=args.seed, **kwargs)
+        reference = os.path.join(workdir, "baby_{}_loop.root".format(itype))
+        other = os.path.join(workdir, "baby_{}_columnar.root".format(itype))
+        run_engine(fname, reference)
+        run_engine(fname, other, columnar=True, chunksize=args.chunksize)
+        for treename in treenames:
+            results[(itype, treename)] = compare(reference, other, treename=treename, tolerance=0.)
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+    print()
+    for (itype, treename), ok in results.items():
+        print("{:<8s} {:<12s} {}".format(itype, treename, "identical" if ok else "DIFFERENT"))
+    sys.exit(0 if all(results.values()) else 1)
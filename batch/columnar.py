@@ -0,0 +1,803 @@
+"""
+Columnar alternative to the per-event `Looper.run`.
+
+Input collections are read in chunks with uproot as flat (content, offsets) arrays
+and all branches of the `Events` tree are computed with numpy over the whole chunk.
+The output tree is made with the same `Looper.make_branch` calls, so the schema is
+identical to the event loop output. Use `compare_babies.py` to check parity
+(`check_columnar.py` does it on synthetic data and MC files).
+
+For MC, the gen particles of a chunk are indexed at once with `ChunkGenIndex`,
+which gives the GenMuon/GenOther branches, the gen matching of the selected muons
+and the gen-info side trees (btophitree, ...), filled for every event like the
+event loop does.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import time
+
+import numpy as np
+
+from babymaker import Looper, MUON_MASS, fast, BTOPHI_SCHEMA, HZDZD_SCHEMA, GGPHI_SCHEMA
+from kernels import pick_best_objects_chunk, nearest_dr
+from dimuon import pair_kinematics, p4_from_ptetaphim, p4_add, p4_mass, p4_pt, p4_phi, lv_from_ptetaphim, lv_mass, lv_eta
+from genindex import ChunkGenIndex, EXOTIC_IDS, MUON_ID
+import selections
+import propagation
+from treewriter import EventsWriter, SideTreeWriter
+from compression import side_tree_setting
+from profiling import get_cache_stats, write_report
+
+
+DEFAULT_CHUNKSIZE = 50000
+
+# mothers of the gen muons that are stored in the GenMuon_ branches
+GENMUON_MOTHER_IDS = [23, 6000211, 999999, 1999999, 3000022]
+
+class Jagged(object):
+    """
+    Minimal jagged array: flat `content` with `offsets` of length nevents+1
+    """
+    __slots__ = ["content", "offsets"]
+
+    def __init__(self, content, offsets):
+        self.content = np.asarray(content)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_counts(cls, content, counts):
+        offsets = np.zeros(len(counts)+1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(content, offsets)
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def starts(self):
+        return self.offsets[:-1]
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def parents(self):
+        # event index of each element of `content`
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def local_index(self):
+        return np.arange(len(self.content)) - np.repeat(self.starts, self.counts)
+
+    def take(self, evtidx, localidx, default=999.):
+        # one element per event at `localidx` (negative means missing -> `default`)
+        localidx = np.asarray(localidx)
+        good = (localidx >= 0) & (localidx < self.counts[evtidx])
+        out = np.full(len(evtidx), default, dtype=np.float64 if self.content.dtype.kind == "f" else self.content.dtype)
+        out[good] = self.content[self.starts[evtidx][good] + localidx[good]]
+        return out
+
+    def mask_events(self, mask):
+        counts = self.counts[mask]
+        sel = np.repeat(mask, self.counts)
+        return Jagged.from_counts(self.content[sel], counts)
+
+def to_jagged(arr, dtype=None):
+    """
+    Convert an uproot3/awkward0 jagged array (or an object array of sequences)
+    into a `Jagged`
+    """
+    if hasattr(arr, "counts") and hasattr(arr, "flatten"):
+        content = np.asarray(arr.flatten())
+        counts = np.asarray(arr.counts)
+    else:
+        counts = np.array([len(x) for x in arr], dtype=np.int64)
+        content = np.array([y for x in arr for y in x])
+    if dtype is not None:
+        content = content.astype(dtype)
+    return Jagged.from_counts(content, counts)
+
+def to_doubly_jagged(arr):
+    """
+    Convert a per-event list of per-object vectors (e.g., muon vtxIndx_) into
+    (outer Jagged of inner counts, flat inner content).
+    """
+    content = getattr(arr, "content", None)
+    if content is not None and hasattr(content, "counts") and hasattr(content, "flatten"):
+        inner = Jagged.from_counts(np.asarray(content.flatten()).astype(np.int64), np.asarray(content.counts))
+        outer_counts = np.asarray(arr.counts)
+    else:
+        outer_counts = np.array([len(x) for x in arr], dtype=np.int64)
+        inner_counts = np.array([len(y) for x in arr for y in x], dtype=np.int64)
+        inner_content = np.array([z for x in arr for y in x for z in y], dtype=np.int64)
+        inner = Jagged.from_counts(inner_content, inner_counts)
+    return Jagged.from_counts(np.arange(len(inner)), outer_counts), inner
+
+def take_flat(arr, indices, default):
+    # arr[indices], with `default` where the index is -1 (also for an empty `arr`)
+    indices = np.asarray(indices)
+    good = indices >= 0
+    out = np.full(len(indices), default, dtype=np.result_type(arr, np.asarray(default)))
+    out[good] = arr[indices[good]]
+    return out
+
+def round4(values):
+    # round(x, 4) of the `get_*_gen_info` records, which python rounds correctly (unlike np.round)
+    return np.array([round(x, 4) for x in np.asarray(values, dtype=np.float64).tolist()])
+
+def gen_pair_columns(gen, kin, motherid, sumname, bmeson=False):
+    """
+    Vectorized `get_btophi_gen_info`/`get_hzdzd_gen_info`/`get_ggphi_gen_info` for a chunk.
+    Returns the number of `motherid` mothers of gen muons per event, the mask of events
+    with exactly one, and the side tree columns (mu1pt, ..., `sumname`+"pt", ..., vx, vy, vz,
+    and the bmeson* ones if `bmeson`), which have values for those events only.
+    """
+    nmothers, first = gen.first_daughters(motherid)
+    one = nmothers == 1
+    ev = np.nonzero(one)[0]
+    i1, i2 = first[ev,0], first[ev,1]
+    if (i2 < 0).any():
+        raise IndexError("Gen {} with a single muon daughter".format(motherid))
+    ib = gen.grandmother[i1]
+    swap = kin["pt"][i2] > kin["pt"][i1]
+    i1, i2 = np.where(swap, i2, i1), np.where(swap, i1, i2)
+
+    p4 = (kin["px"], kin["py"], kin["pz"], kin["energy"])
+    pair = tuple(x[i1]+x[i2] for x in p4)
+    values = [
+            ("mu1pt", kin["pt"][i1]), ("mu2pt", kin["pt"][i2]),
+            ("mu1eta", kin["eta"][i1]), ("mu2eta", kin["eta"][i2]),
+            ("mu1phi", kin["phi"][i1]), ("mu2phi", kin["phi"][i2]),
+            (sumname+"pt", p4_pt(pair)), (sumname+"eta", lv_eta(pair)),
+            (sumname+"phi", p4_phi(pair)), (sumname+"mass", lv_mass(pair)),
+            ("vx", kin["vx"][i1]), ("vy", kin["vy"][i1]), ("vz", kin["vz"][i1]),
+            ]
+    if bmeson:
+        # a missing grandmother is index -1, i.e., the last particle of the event
+        ib = np.where(ib >= 0, ib, gen.offsets[ev+1]-1)
+        values += [
+                ("bmesonmass", lv_mass(tuple(x[ib] for x in p4))),
+                ("bmesonpt", kin["pt"][ib]), ("bmesoneta", kin["eta"][ib]),
+                ]
+    columns = {}
+    for name, v in values:
+        columns[name] = np.zeros(len(one))
+        columns[name][ev] = round4(v)
+    if bmeson:
+        columns["bmesonid"] = np.zeros(len(one), dtype=np.int64)
+        columns["bmesonid"][ev] = gen.pdgid[ib]
+    return nmothers, one, columns
+
+
+# collection -> (EDM product prefix, data members to read)
+COLLECTIONS = {
+    "Muon": ("ScoutingMuons_hltScoutingMuonPackerCalo__HLT", [
+        "pt_", "eta_", "phi_", "trackIso_", "chi2_", "ndof_", "charge_", "dxy_", "dz_",
+        "nValidMuonHits_", "nValidPixelHits_", "nMatchedStations_", "nTrackerLayersWithMeasurement_",
+        "nValidStripHits_", "dxyError_", "dzError_", "trk_qoverp_", "trk_lambda_", "trk_qoverpError_",
+        "trk_lambdaError_", "trk_phiError_", "trk_dsz_", "trk_dszError_",
+        ]),
+    "DV": ("ScoutingVertexs_hltScoutingMuonPackerCalo_displacedVtx_HLT", [
+        "x_", "y_", "z_", "xError_", "yError_", "zError_", "chi2_", "ndof_",
+        ]),
+    "PVM": ("ScoutingVertexs_hltScoutingPrimaryVertexPackerCaloMuon_primaryVtx_HLT", [
+        "x_", "y_", "z_",
+        ]),
+    "Jet": ("ScoutingCaloJets_hltScoutingCaloPacker__HLT", [
+        "pt_", "eta_", "phi_", "m_", "mvaDiscriminator_", "btagDiscriminator_",
+        ]),
+    }
+SCALARS = {
+    "MET_pt": "double_hltScoutingCaloPacker_caloMetPt_HLT",
+    "MET_phi": "double_hltScoutingCaloPacker_caloMetPhi_HLT",
+    "rho": "double_hltScoutingCaloPacker_rho_HLT",
+    "BS_x": "float_beamSpotMaker_x_SLIM",
+    "BS_y": "float_beamSpotMaker_y_SLIM",
+    "BS_z": "float_beamSpotMaker_z_SLIM",
+    }
+
+# gen particles (MC), as member -> candidate data members, which depend on the
+# reco::GenParticle version (ParticleState in m_state, or the older flat LeafCandidate)
+GEN_PREFIX = "recoGenParticles_genParticles__HLT"
+GEN_MEMBERS = [
+    ("pt", ["p4Polar_.fCoordinates.fPt", "pt_"]),
+    ("eta", ["p4Polar_.fCoordinates.fEta", "eta_"]),
+    ("phi", ["p4Polar_.fCoordinates.fPhi", "phi_"]),
+    ("mass", ["p4Polar_.fCoordinates.fM", "mass_"]),
+    ("vx", ["vertex_.fCoordinates.fX"]),
+    ("vy", ["vertex_.fCoordinates.fY"]),
+    ("vz", ["vertex_.fCoordinates.fZ"]),
+    ("pdgId", ["pdgId_"]),
+    ("status", ["status_"]),
+    ("motherkeys", ["mom.refVector_.keys_"]),
+    ]
+# the cartesian p4 that `p4()` returns, if it is stored (otherwise converted from the polar one)
+GEN_OPTIONAL_MEMBERS = [
+    ("px", ["p4Cartesian_.fCoordinates.fX"]),
+    ("py", ["p4Cartesian_.fCoordinates.fY"]),
+    ("pz", ["p4Cartesian_.fCoordinates.fZ"]),
+    ("energy", ["p4Cartesian_.fCoordinates.fT"]),
+    ]
+
+def find_branch(keys, prefix, member=None):
+    """
+    Find the full uproot branch name for an EDM product `prefix` and
+    (optionally) a data `member`, which differ a bit between EDM versions
+    """
+    cands = [k for k in keys if k.startswith(prefix)]
+    if member is None:
+        cands = [k for k in cands if k.endswith(".obj") or k.endswith(".obj.")]
+    else:
+        cands = [k for k in cands if k.rstrip(".").endswith("."+member)]
+    if not cands:
+        raise KeyError("Couldn't find branch for {} {}".format(prefix, member or ""))
+    return min(cands, key=len)
+
+class ChunkReader(object):
+    """
+    Reads the Scouting collections for entry ranges of a file with uproot
+    """
+    def __init__(self, fname, treename="Events", has_hit_info=True, has_bs_info=False, has_gen_info=False):
+        import uproot3
+        self.fname = fname
+        self.tree = uproot3.open(fname)[treename]
+        self.keys = [k.decode("ascii") if isinstance(k, bytes) else k for k in self.tree.allkeys()]
+        self.has_hit_info = has_hit_info
+        self.has_bs_info = has_bs_info
+        self.has_gen_info = has_gen_info
+        self.names = {}
+        for coll, (prefix, members) in COLLECTIONS.items():
+            for member in members:
+                self.names["{}_{}".format(coll, member.rstrip("_"))] = find_branch(self.keys, prefix, member)
+        self.names["Muon_vtxIndx"] = find_branch(self.keys, COLLECTIONS["Muon"][0], "vtxIndx_")
+        for name, prefix in SCALARS.items():
+            if name.startswith("BS_") and not self.has_bs_info: continue
+            self.names[name] = find_branch(self.keys, prefix)
+        self.names["run"] = find_branch(self.keys, "EventAuxiliary", "run_")
+        self.names["luminosityBlock"] = find_branch(self.keys, "EventAuxiliary", "luminosityBlock_")
+        self.names["event"] = find_branch(self.keys, "EventAuxiliary", "event_")
+        self.names["l1result"] = find_branch(self.keys, "bools_triggerMaker_l1result_SLIM")
+        if self.has_hit_info:
+            self.names["nExpectedPixelHits"] = find_branch(self.keys, "ints_hitMaker_nexpectedhitsmultiple_SLIM")
+        if self.has_gen_info:
+            for name, members in GEN_MEMBERS + GEN_OPTIONAL_MEMBERS:
+                for member in members:
+                    try:
+                        self.names["Gen_"+name] = find_branch(self.keys, GEN_PREFIX, member)
+                        break
+                    except KeyError:
+                        pass
+                else:
+                    if (name, members) in GEN_MEMBERS:
+                        raise KeyError("Couldn't find branch for {} {}".format(GEN_PREFIX, " or ".join(members)))
+            if not all("Gen_"+name in self.names for name, _ in GEN_OPTIONAL_MEMBERS):
+                for name, _ in GEN_OPTIONAL_MEMBERS:
+                    self.names.pop("Gen_"+name, None)
+
+    def __len__(self):
+        return self.tree.numentries
+
+    def l1names(self):
+        bname = find_branch(self.keys, "Strings_triggerMaker_l1name_SLIM")
+        names = self.tree[bname].array(entrystart=0, entrystop=1)[0]
+        return [x.decode("ascii") if isinstance(x, bytes) else str(x) for x in names]
+
+    def read(self, entrystart, entrystop):
+        """
+        Return dict of numpy arrays (event-level) and `Jagged`s (collections)
+        """
+        toread = dict((v, k) for k, v in self.names.items())
+        arrs = self.tree.arrays(list(toread.keys()), entrystart=entrystart, entrystop=entrystop, namedecode="ascii")
+        out = {}
+        for bname, arr in arrs.items():
+            name = toread[bname]
+            if name == "Muon_vtxIndx":
+                out["Muon_vtxIndx"] = to_doubly_jagged(arr)
+            elif name == "Gen_motherkeys":
+                # key of the first mother of each particle (as in `motherRef()`), -1 if none
+                particles, keys = to_doubly_jagged(arr)
+                first = np.full(len(keys), -1, dtype=np.int64)
+                hasmother = keys.counts > 0
+                first[hasmother] = keys.content[keys.starts[hasmother]]
+                out[name] = Jagged(first, particles.offsets)
+            elif name.startswith("Gen_"):
+                out[name] = to_jagged(arr)
+            elif name.split("_")[0] in COLLECTIONS or name in ["l1result", "nExpectedPixelHits"]:
+                out[name] = to_jagged(arr)
+            elif name in SCALARS:
+                # edm::Wrapper<double> can come back as a length-1 jagged array
+                arr = arr.flatten() if hasattr(arr, "flatten") and len(arr) and hasattr(arr, "counts") else arr
+                out[name] = np.asarray(arr, dtype=np.float64)
+            else:
+                out[name] = np.asarray(arr).astype(np.int64)
+        return out
+
+
+class ColumnarLooper(Looper):
+    """
+    Drop-in replacement for `Looper` that computes the `Events` tree chunk by chunk
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.chunksize = int(kwargs.pop("chunksize", DEFAULT_CHUNKSIZE))
+        checkpoint_every = kwargs.pop("checkpoint_every", 0)
+        resume = kwargs.pop("resume", False)
+        if (checkpoint_every > 0) or resume:
+            print(">>> Checkpoints are only supported by the default engine, ignoring them")
+        if kwargs.pop("audit_reads", False):
+            # no AccessRecorder here, the branches read are fixed by ChunkReader
+            print(">>> Read audits are only supported by the default engine, ignoring them")
+        if kwargs.pop("prepass", False):
+            # chunks are read whole, so skipping entries would not save any reading
+            print(">>> The skim pre-pass is only supported by the default engine, ignoring it")
+        super(ColumnarLooper, self).__init__(*args, **kwargs)
+
+    def gen_info(self, chunk):
+        """
+        Index the gen particles of a chunk, and compute the gen-info side tree columns
+        of every event (before any selection, like `get_btophi_gen_info` etc. in `Looper.run`).
+        Returns a dict with the `ChunkGenIndex` ("index"), the flat particle arrays ("kin")
+        and, per side tree ("btophi", ...), the (columns, present) for `SideTreeWriter.fill_columns`.
+        """
+        index = ChunkGenIndex(chunk["Gen_pdgId"].offsets, chunk["Gen_pdgId"].content, chunk["Gen_motherkeys"].content)
+        kin = {}
+        for k, v in chunk.items():
+            if not k.startswith("Gen_") or k == "Gen_motherkeys": continue
+            kin[k[len("Gen_"):]] = v.content.astype(np.float64 if v.content.dtype.kind == "f" else np.int64)
+        if "px" not in kin:
+            kin["px"], kin["py"], kin["pz"], kin["energy"] = lv_from_ptetaphim(kin["pt"], kin["eta"], kin["phi"], kin["mass"])
+        info = dict(index=index, kin=kin)
+        ids = dict((k, chunk[k]) for k in ["run", "luminosityBlock", "event"])
+        for name, flag, motherid, nname, sumname, bmeson in [
+                ("btophi", self.is_btophi, 6000211, "nphi", "phi", True),
+                ("hzdzd", self.is_hzdzd, 23, "nzd", "zd", False),
+                ("ggphi", self.is_ggphi, 6000211, "nphi", "phi", False),
+                ]:
+            if not flag: continue
+            nmothers, one, columns = gen_pair_columns(index, kin, motherid, sumname, bmeson=bmeson)
+            present = dict((k, one) for k in columns)
+            columns[nname] = nmothers
+            if name == "ggphi":
+                # only in the records with one phi
+                present[nname] = one
+            columns.update(ids)
+            info[name] = (columns, present)
+        return info
+
+    def process_chunk(self, chunk, l1indices, gen=None):
+        """
+        Compute all output branches for one chunk (`gen` is the `gen_info` of the chunk for MC).
+        Returns dict of branch name -> per-selected-event arrays (or lists of arrays for vector branches)
+        """
+        mu = dict((k[len("Muon_"):], v) for k, v in chunk.items() if k.startswith("Muon_") and k != "Muon_vtxIndx")
+        dv = dict((k[len("DV_"):], v) for k, v in chunk.items() if k.startswith("DV_"))
+        ndv = dv["x"].counts
+        nmu = mu["pt"].counts
+
+        # same preselection as the event loop
+        presel = (ndv >= 1) & (nmu >= 2)
+        if self.fourmu:
+            presel &= (ndv >= 2) & (nmu >= 4)
+
+        run = chunk["run"]
+        bugged = (100000 < run) & (run < 305405) & (not self.is_mc)
+
+        pvm_counts = chunk["PVM_x"].counts
+        has_pvm = pvm_counts > 0
+        pvmx = np.zeros(len(run))
+        pvmy = np.zeros(len(run))
+        pvmx[has_pvm] = chunk["PVM_x"].content[chunk["PVM_x"].starts[has_pvm]]
+        pvmy[has_pvm] = chunk["PVM_y"].content[chunk["PVM_y"].starts[has_pvm]]
+
+        # DV-level quantities
+        dv_parent = dv["x"].parents()
+        dvx = dv["x"].content.astype(np.float64)
+        dvy = dv["y"].content.astype(np.float64)
+        dv_rho = (dvx**2 + dvy**2)**0.5
+        dv_rhoCorr = ((dvx-pvmx[dv_parent])**2 + (dvy-pvmy[dv_parent])**2)**0.5
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dv_passid = ~(
+                    (dv["xError"].content > 0.05)
+                    | (dv["yError"].content > 0.05)
+                    | (dv["zError"].content > 0.10)
+                    | (dv["chi2"].content.astype(np.float64)/dv["ndof"].content > 5)
+                    | (dv_rhoCorr > 11.)
+                    )
+
+        vtxindx = chunk["Muon_vtxIndx"][1]
+        best, secondary = pick_best_objects_chunk(
+                presel, dv["x"].offsets, dv["chi2"].content, dv_passid,
+                mu["pt"].offsets, mu["pt"].content, mu["charge"].content,
+                vtxindx.offsets, vtxindx.content, bugged,
+                )
+        has_secondary = secondary[:,0] >= 0
+        if self.fourmu:
+            presel &= has_secondary
+        sel = presel & (best[:,0] >= 0)
+        has_secondary = has_secondary[sel]
+        evt = np.nonzero(sel)[0]
+        nsel = len(evt)
+
+        out = {}
+        out["run"] = run[sel]
+        out["luminosityBlock"] = chunk["luminosityBlock"][sel]
+        out["event"] = chunk["event"][sel]
+        out["year"] = np.full(nsel, self.year)
+
+        out["nPVM_raw"] = pvm_counts[sel]
+        for k in ["x", "y", "z"]:
+            out["PVM_"+k] = chunk["PVM_"+k].take(evt, np.where(pvm_counts[sel] > 0, 0, -1))
+        pvmx, pvmy = pvmx[sel], pvmy[sel]
+
+        # L1
+        l1results = chunk["l1result"]
+        pass_l1 = np.zeros(nsel, dtype=bool)
+        for name, idx in l1indices.items():
+            bit = l1results.take(evt, np.full(nsel, idx), default=0).astype(bool)
+            out[name] = bit
+            if name in self.seeds_to_OR:
+                pass_l1 |= bit
+        out["pass_l1"] = pass_l1
+
+        for name in ["MET_pt", "MET_phi", "rho"]:
+            out[name] = chunk[name][sel]
+        for name in ["BS_x", "BS_y", "BS_z"]:
+            out[name] = chunk[name][sel] if self.has_bs_info else np.zeros(nsel)
+
+        # Jets (vector branches)
+        jets = dict((k[len("Jet_"):], v.mask_events(sel)) for k, v in chunk.items() if k.startswith("Jet_"))
+        out["nJet"] = jets["pt"].counts
+        for k in ["pt", "eta", "phi", "m", "mvaDiscriminator", "btagDiscriminator"]:
+            out["Jet_"+k] = jets[k]
+
+        # DVs
+        out["nDV_raw"] = ndv[sel]
+        out["nDV"] = 1 + has_secondary.astype(np.int64)
+        dvs = {}
+        for pfx, idvs in [("DV_", best[sel,0]), ("sublead_DV_", secondary[sel,0])]:
+            d = {}
+            for k in ["x", "y", "z", "xError", "yError", "zError", "chi2", "ndof"]:
+                d[k] = dv[k].take(evt, idvs)
+            gidx = dv["x"].starts[evt] + np.maximum(idvs, 0)
+            valid = idvs >= 0
+            d["rho"] = np.where(valid, dv_rho[gidx], 999.)
+            d["rhoCorr"] = np.where(valid, dv_rhoCorr[gidx], 999.)
+            d["passid"] = np.where(valid, dv_passid[gidx], False)
+            with self.timer.stage("pixel"):
+                d["inPixel"], d["distPixel"], d["layerPixel"] = self.get_pixel_info_columnar(d["x"], d["y"], d["z"], valid)
+            for k, v in d.items():
+                out[pfx+k] = v
+            dvs[pfx] = d
+
+        # Muons
+        out["nMuon_raw"] = nmu[sel]
+        out["nMuon"] = 2 + 2*has_secondary.astype(np.int64)
+        nexp = chunk.get("nExpectedPixelHits")
+        jeteta = jets["eta"].content.astype(np.float64)
+        jetphi = jets["phi"].content.astype(np.float64)
+        muons = {}
+        imuons = {}
+        for pfx, imus, dvpfx in [
+                ("Muon1_", best[sel,1], "DV_"),
+                ("Muon2_", best[sel,2], "DV_"),
+                ("sublead_Muon1_", secondary[sel,1], "sublead_DV_"),
+                ("sublead_Muon2_", secondary[sel,2], "sublead_DV_"),
+                ]:
+            valid = imus >= 0
+            m = {}
+            for k in [
+                    "pt", "eta", "phi", "trackIso", "chi2", "ndof", "charge", "dxy", "dz",
+                    "nValidMuonHits", "nValidPixelHits", "nMatchedStations", "nTrackerLayersWithMeasurement",
+                    "nValidStripHits", "dxyError", "dzError", "trk_qoverp", "trk_lambda", "trk_qoverpError",
+                    "trk_lambdaError", "trk_phiError", "trk_dsz", "trk_dszError",
+                    ]:
+                m[k] = mu[k].take(evt, imus)
+            m["m"] = np.where(valid, MUON_MASS, 999.)
+            if nexp is not None:
+                m["nExpectedPixelHits"] = nexp.take(evt, imus)
+            else:
+                m["nExpectedPixelHits"] = np.full(nsel, 999)
+
+            # closest jet
+            _, drjet = nearest_dr(jets["eta"].offsets, jeteta, jetphi, np.where(valid, np.arange(nsel), -1), m["eta"], m["phi"])
+            m["drjet"] = drjet
+
+            d = dvs[dvpfx]
+            phi = m["phi"]
+            dxyCorr = -(d["x"]-pvmx)*np.sin(phi) + (d["y"]-pvmy)*np.cos(phi)
+            m["dxyCorr"] = np.where(valid, dxyCorr, 999.)
+
+            sinphi, cosphi = np.sin(phi), np.cos(phi)
+            lmb = m["trk_lambda"]
+            sinlmb = np.sin(lmb)
+            tanlmb = sinlmb/np.cos(lmb)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                refz = 1.0*m["dz"]
+                refx = -sinphi*dxyCorr - (cosphi/sinlmb)*m["trk_dsz"] + (cosphi/tanlmb)*refz
+                refy =  cosphi*dxyCorr - (sinphi/sinlmb)*m["trk_dsz"] + (sinphi/tanlmb)*refz
+            m["trk_refx"] = np.where(valid, refx, 999.)
+            m["trk_refy"] = np.where(valid, refy, 999.)
+            m["trk_refz"] = np.where(valid, refz, 999.)
+
+            with self.timer.stage("propagation"):
+                m["phiCorr"] = self.get_corrected_phi_columnar(m, refx, refy, refz, d, valid)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                m["passid"] = valid & (m["chi2"]/m["ndof"] < 3.0) & (m["nTrackerLayersWithMeasurement"] > 5)
+            m["passiso"] = valid & (m["trackIso"] < 0.1) & (m["drjet"] > 0.3)
+            m["passiso4mu"] = valid & (m["trackIso"] < 0.2) & (m["drjet"] > 0.3)
+            for k, v in m.items():
+                out[pfx+k] = v
+            muons[pfx] = m
+            imuons[pfx] = imus
+
+        # Event-level for the leading and subleading pairs
+        lead = self.compute_pair_columnar(muons["Muon1_"], muons["Muon2_"], dvs["DV_"], pvmx, pvmy, pass_l1, "lead")
+        for k, v in lead.items():
+            if not k.startswith("_"): out[k] = v
+        sub = self.compute_pair_columnar(muons["sublead_Muon1_"], muons["sublead_Muon2_"], dvs["sublead_DV_"], pvmx, pvmy, pass_l1, "sublead")
+        fourmuon = p4_add(lead["_dimuon_corr"], sub["_dimuon_corr"])
+        fourmuon_mass = p4_mass(fourmuon)
+        for k, v in sub.items():
+            if k.startswith("_"): continue
+            if "sublead_"+k not in self.branches: continue
+            out["sublead_"+k] = np.where(has_secondary, v, self.default_for("sublead_"+k, v))
+        with np.errstate(invalid="ignore"):
+            pass_fourmu, pass_fourmu_nomask = selections.evaluate_fourmu(lead["mass"], sub["mass"], fourmuon_mass, lead["pass_all"], sub["pass_all"])
+        out["FourMuon_mass"] = np.where(has_secondary, fourmuon_mass, 999.)
+        out["pass_fourmu"] = has_secondary & pass_fourmu
+        out["pass_fourmu_nomask"] = has_secondary & pass_fourmu_nomask
+
+        if gen is None:
+            out["pass_genmatch"] = np.ones(nsel, dtype=bool)
+            out["sublead_pass_genmatch"] = has_secondary.copy()
+            out["nGenMuon"] = np.zeros(nsel, dtype=np.int64)
+        else:
+            with self.timer.stage("gen_matching"):
+                self.compute_gen_columnar(gen, sel, muons, imuons, has_secondary, out)
+
+        return nsel, out
+
+    def compute_gen_columnar(self, gen, sel, muons, imuons, has_secondary, out):
+        """
+        Vectorized gen-level blocks of `Looper.run` for the selected events (`sel`):
+        GenOther_*/GenMuon_*, the genMatch_* of the selected muons, pass_genmatch
+        and the BToPhi_/HZdZd_ event branches
+        """
+        index, kin = gen["index"], gen["kin"]
+        evt = np.nonzero(sel)[0]
+        nsel = len(evt)
+        pdgid = index.pdgid
+        abspdgid = np.abs(pdgid)
+        motherid = index.mother_pdgid(np.arange(len(pdgid)))
+        grandmotherid = index.take(pdgid, index.grandmother, default=0)
+        lxy = np.hypot(kin["vx"], kin["vy"])
+        insel = sel[index.parents]
+
+        def collection(mask):
+            # particles of the selected events, in record order
+            idx = np.nonzero(mask & insel)[0]
+            return Jagged.from_counts(idx, np.bincount(index.parents[idx], minlength=len(sel))[evt])
+
+        others = collection(np.isin(abspdgid, EXOTIC_IDS))
+        genmuons = collection((abspdgid == MUON_ID) & np.isin(motherid, GENMUON_MOTHER_IDS))
+        for pfx, coll, gmid in [("GenOther_", others, np.zeros_like(pdgid)), ("GenMuon_", genmuons, grandmotherid)]:
+            idx = coll.content
+            for k, v in [
+                    ("pt", kin["pt"]), ("eta", kin["eta"]), ("phi", kin["phi"]), ("m", kin["mass"]),
+                    ("vx", kin["vx"]), ("vy", kin["vy"]), ("vz", kin["vz"]), ("lxy", lxy),
+                    ("status", kin["status"]), ("pdgId", pdgid), ("motherId", motherid), ("grandmotherId", gmid),
+                    ]:
+                out[pfx+k] = Jagged(v[idx], coll.offsets)
+        out["nGenMuon"] = genmuons.counts
+
+        # nearest GenMuon of each selected muon, and its first non-muon ancestor
+        geneta, genphi = kin["eta"][genmuons.content], kin["phi"][genmuons.content]
+        genmatch_dr = {}
+        for pfx, m in muons.items():
+            valid = imuons[pfx] >= 0
+            ilocal, dr = nearest_dr(genmuons.offsets, geneta, genphi, np.where(valid, np.arange(nsel), -1), m["eta"], m["phi"])
+            matched = ilocal >= 0
+            igen = -np.ones(nsel, dtype=np.int64)
+            igen[matched] = genmuons.content[genmuons.starts[matched] + ilocal[matched]]
+            ianc = take_flat(index.ancestor, igen, -1)
+            found = ianc >= 0
+            g = {}
+            g["dr"] = dr
+            for k, v in [
+                    ("pt", kin["pt"]), ("eta", kin["eta"]), ("phi", kin["phi"]), ("m", kin["mass"]),
+                    ("vx", kin["vx"]), ("vy", kin["vy"]), ("vz", kin["vz"]), ("lxy", lxy),
+                    ("status", kin["status"]), ("pdgId", pdgid),
+                    ]:
+                g[k] = take_flat(v, igen, 0)
+            g["motherId"] = take_flat(pdgid, ianc, 0)
+            g["grandmotherId"] = take_flat(pdgid, take_flat(index.mother, ianc, -1), 0)
+            g["mothervx"] = take_flat(kin["vx"], ianc, 0.)
+            g["mothervy"] = take_flat(kin["vy"], ianc, 0.)
+            g["mothervz"] = take_flat(kin["vz"], ianc, 0.)
+            # https://arxiv.org/pdf/1710.08949.pdf eq 1, with the B displacement subtracted for BToPhi
+            vx, vy = g["vx"], g["vy"]
+            if self.is_btophi:
+                vx, vy = vx - g["mothervx"], vy - g["mothervy"]
+            mpt = take_flat(kin["pt"], ianc, 0.)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ct = (vx*take_flat(kin["px"], ianc, 0.)+vy*take_flat(kin["py"], ianc, 0.))*take_flat(kin["mass"], ianc, 0.)/mpt**2.
+            g["motherct"] = np.where(found, ct, 0.)
+            for k, v in g.items():
+                out[pfx+"genMatch_"+k] = np.where(matched, v, 999)
+            genmatch_dr[pfx] = out[pfx+"genMatch_dr"]
+        out["pass_genmatch"] = (genmatch_dr["Muon1_"] < 0.1) & (genmatch_dr["Muon2_"] < 0.1)
+        out["sublead_pass_genmatch"] = has_secondary & (genmatch_dr["sublead_Muon1_"] < 0.1) & (genmatch_dr["sublead_Muon2_"] < 0.1)
+
+        if self.is_btophi:
+            columns, present = gen["btophi"]
+            out["BToPhi_nphi"] = columns["nphi"][sel]
+            one = present["mu1pt"][sel]
+            for k in ["mu1pt", "mu2pt", "mu1eta", "mu2eta", "phimass", "phipt", "phieta",
+                    "bmesonmass", "bmesonid", "bmesonpt", "bmesoneta"]:
+                out["BToPhi_"+k] = np.where(one, columns[k][sel], 999)
+        if self.is_hzdzd:
+            out["HZdZd_nzd"] = gen["hzdzd"][0]["nzd"][sel]
+
+    def default_for(self, name, v):
+        obj = self.branches[name]
+        if obj.typecode == "b": return np.zeros(len(v), dtype=bool)
+        return np.full(len(v), 999)
+
+    def compute_pair_columnar(self, mu1, mu2, dv, pvmx, pvmy, pass_l1, which):
+        """
+        Vectorized version of the leading/subleading blocks of `Looper.run`
+        """
+        kin = pair_kinematics(mu1, mu2, dv, pvmx, pvmy)
+        lxy, mass, dimuon_pt = kin["lxy"], kin["dimuon_mass"], kin["dimuon_pt"]
+        absdphimumu, absdphimudv, logabsetaphi = kin["absdphimumu"], kin["absdphimudv"], kin["logabsetaphi"]
+        out = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dimuon_isos = mu1["charge"]*mu2["charge"] < 0
+
+            out["_dimuon_corr"] = kin["p4corr"]
+            out["dimuon_isos"] = dimuon_isos
+            out["dimuon_pt"] = dimuon_pt
+            out["dimuon_eta"] = kin["dimuon_eta"]
+            out["dimuon_phi"] = kin["dimuon_phi"]
+            out["dimuon_mass"] = mass
+            out["mass"] = mass
+            out["absdphimumu"] = absdphimumu
+            out["absdphimudv"] = absdphimudv
+            out["minabsdxy"] = np.minimum(np.abs(mu1["dxyCorr"]), np.abs(mu2["dxyCorr"]))
+            out["logabsetaphi"] = logabsetaphi
+            out["lxy"] = lxy
+
+        # pass_excesshits, pass_baseline*, pass_all, ..., see selections.py
+        cols = dict(kin)
+        for pfx, d in [("Muon1_", mu1), ("Muon2_", mu2), ("DV_", dv)]:
+            cols.update((pfx+k, v) for k, v in d.items())
+        cols["dimuon_isos"] = dimuon_isos
+        cols["pass_l1"] = pass_l1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            flags = selections.evaluate(cols, which, prefix="")
+        prefix = "" if which == "lead" else "sublead_"
+        for name in selections.output_names(which):
+            out[name[len(prefix):]] = flags[name[len(prefix):]]
+        if which == "lead":
+            out["cosphi"] = kin["cosphi"]
+            out["ctau"] = kin["ctau"]
+            out["dimuon_massRaw"] = kin["dimuon_massRaw"]
+            out["lxyError"] = kin["lxyError"]
+        return out
+
+    def get_pixel_info_columnar(self, x, y, z, valid):
+        inpixel = np.zeros(len(x), dtype=bool)
+        dist = np.full(len(x), 999.)
+        # unfilled (missing subleading DV) branches keep the `clear_branches` defaults
+        layer = np.where(valid, -1, 999)
+        if fast or not valid.any():
+            return inpixel, dist, layer
+        self.load_pixel_code()
+        imodule, layernum, planedist = self.pixel_lookup.get_pixel_info(x[valid], y[valid], z[valid])
+        inpixel[valid] = imodule >= 0
+        dist[valid] = planedist
+        layer[valid] = layernum
+        return inpixel, dist, layer
+
+    def get_corrected_phi_columnar(self, m, refx, refy, refz, dv, valid):
+        phicorr = np.full(len(valid), 999.)
+        if fast:
+            phicorr[valid] = m["phi"][valid]
+            return phicorr
+        px, py, pz, _ = p4_from_ptetaphim(m["pt"], m["eta"], m["phi"], MUON_MASS)
+        newphi = propagation.recalculate_phi_at_DV(
+                refx, refy, refz, px, py, pz,
+                m["charge"], dv["x"], dv["y"],
+                )
+        phicorr[valid] = newphi[valid]
+        return phicorr
+
+    def fill_events(self, nsel, out):
+        if self.writer is None:
+            self.writer = EventsWriter(self.outtree, self.schema, self.branches)
+        self.writer.append(nsel, out)
+
+    def iter_chunks(self, nevents_in):
+        """
+        Yield (reader, entrystart, entrystop) with file-local entry ranges covering
+        this Looper's [entrystart, entrystop) range of the chain in chunks
+        """
+        first = self.entrystart or 0
+        last = first + nevents_in
+        offset = 0
+        for fname in self.fnames:
+            if offset >= last: break
+            reader = ChunkReader(fname, treename=self.treename, has_hit_info=self.has_hit_info, has_bs_info=self.has_bs_info, has_gen_info=self.has_gen_info)
+            nfile = len(reader)
+            lo, hi = max(first-offset, 0), min(last-offset, nfile)
+            offset += nfile
+            for entrystart in range(lo, hi, self.chunksize):
+                yield reader, entrystart, min(entrystart+self.chunksize, hi)
+
+    def run(self):
+        side_writers = []
+        for name, flag, treename, prefix, schema in [
+                ("btophi", self.is_btophi, "btophitree", "BToPhi_", BTOPHI_SCHEMA),
+                ("hzdzd", self.is_hzdzd, "hzdzdtree", "HZdZd_", HZDZD_SCHEMA),
+                ("ggphi", self.is_ggphi, "ggphitree", "ggPhi_", GGPHI_SCHEMA),
+                ]:
+            if flag:
+                side_writers.append((name, SideTreeWriter(treename, prefix, schema, tfile=self.outfile,
+                    compression=side_tree_setting(self.compression))))
+
+        ievt = 0
+        nevents_in = self.get_nevents_in()
+        print(">>> Started slimming/skimming tree with {} events (columnar)".format(nevents_in))
+        t0 = time.time()
+        l1indices = None
+        timer = self.timer
+        for reader, entrystart, entrystop in self.iter_chunks(nevents_in):
+            timer.new_event(entrystop-entrystart)
+            if l1indices is None:
+                l1names = reader.l1names()
+                l1indices = dict((name, l1names.index(name)) for name in self.seeds_to_save)
+            tnow = time.time()
+            timer.switch("read")
+            chunk = reader.read(entrystart, entrystop)
+            gen = None
+            if self.has_gen_info:
+                timer.switch("gen_info")
+                gen = self.gen_info(chunk)
+                for name, writer in side_writers:
+                    writer.fill_columns(entrystop-entrystart, *gen[name])
+            timer.switch("compute")
+            nsel, out = self.process_chunk(chunk, l1indices, gen=gen)
+            timer.switch("fill")
+            self.fill_events(nsel, out)
+            timer.switch(None)
+            ievt += entrystop-entrystart
+            print(">>> [currevt={}] Last {} events in {:.2f} seconds @ {:.1f}Hz".format(ievt,entrystop-entrystart,time.time()-tnow,(entrystop-entrystart)/(time.time()-tnow)))
+        if self.writer is not None:
+            timer.switch("fill")
+            self.writer.flush()
+            timer.switch(None)
+        t1 = time.time()
+
+        neventsout = self.outtree.GetEntries()
+        self.write_output([writer for _, writer in side_writers], nevents_in, ievt)
+        if timer.enabled:
+            report = timer.report(
+                    nevents_input=nevents_in,
+                    nevents_processed=ievt,
+                    nevents_output=neventsout,
+                    fname_out=self.fname_out,
+                    fnames=list(self.fnames),
+                    cache=get_cache_stats(),
+                    )
+            print(">>> Wrote timing report to {}".format(write_report(report, self.fname_out)))
+
+        print(">>> Finished slim/skim of {} events in {:.2f} seconds @ {:.1f}Hz".format(ievt,(t1-t0),ievt/(t1-t0)))
+
+        if (ievt != nevents_in):
+            print(">>> Looped over {} entries instead of {}. Raising exit code=2.".format(ievt,nevents_in))
+            sys.exit(2)
+        if (self.expected > 0) and (int(self.expected) != ievt):
+            print(">>> Expected {} events but ran on {}. Raising exit code=2.".format(self.expected,ievt))
+            sys.exit(2)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Branch-for-branch comparison of two baby files, e.g., the output of the default
+event loop and the columnar engine on the same input:
+
+    python babymaker.py input.root -o loop.root
+    python babymaker.py input.root -o columnar.root --columnar
+    python compare_babies.py loop.root columnar.root
+
+Exits with code 1 if the schemas, event counts or any values differ.
+"""
+from __future__ import print_function
+
+import sys
+import argparse
+
+import ROOT as r
+
+def get_schema(tree):
+    schema = {}
+    for b in tree.GetListOfBranches():
+        leaf = b.GetLeaf(b.GetName())
+        schema[b.GetName()] = b.GetClassName() or leaf.GetTypeName()
+    return schema
+
+def get_values(tree, name):
+    vals = []
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        v = getattr(tree, name)
+        if hasattr(v, "size"): v = list(v)
+        vals.append(v)
+    return vals
+
+def same(a, b, tolerance):
+    if isinstance(a, list):
+        return (len(a) == len(b)) and all(same(x, y, tolerance) for x, y in zip(a, b))
+    if tolerance > 0 and isinstance(a, float):
+        return abs(a-b) <= tolerance*max(abs(a), abs(b), 1.)
+    return a == b
+
+def compare(fname1, fname2, treename="Events", tolerance=0., maxprint=5):
+    f1 = r.TFile(fname1)
+    f2 = r.TFile(fname2)
+    t1 = f1.Get(treename)
+    t2 = f2.Get(treename)
+    ok = True
+
+    for name in ["nevents_input", "nevents_processed", "nevents_output"]:
+        p1, p2 = f1.Get(name), f2.Get(name)
+        v1 = p1.GetVal() if p1 else None
+        v2 = p2.GetVal() if p2 else None
+        if v1 != v2:
+            print(">>> {} differs: {} vs {}".format(name, v1, v2))
+            ok = False
+
+    s1, s2 = get_schema(t1), get_schema(t2)
+    for name in sorted(set(s1) ^ set(s2)):
+        print(">>> Branch {} only in {}".format(name, fname1 if name in s1 else fname2))
+        ok = False
+    common = sorted(set(s1) & set(s2))
+    for name in common:
+        if s1[name] != s2[name]:
+            print(">>> Branch {} has type {} vs {}".format(name, s1[name], s2[name]))
+            ok = False
+
+    if t1.GetEntries() != t2.GetEntries():
+        print(">>> Trees have {} vs {} entries".format(t1.GetEntries(), t2.GetEntries()))
+        return False
+
+    nbad_branches = 0
+    for name in common:
+        v1, v2 = get_values(t1, name), get_values(t2, name)
+        bad = [i for i, (a, b) in enumerate(zip(v1, v2)) if not same(a, b, tolerance)]
+        if bad:
+            nbad_branches += 1
+            print(">>> Branch {} differs in {} entries, e.g.,".format(name, len(bad)))
+            for i in bad[:maxprint]:
+                print("      entry {}: {} vs {}".format(i, v1[i], v2[i]))
+    if nbad_branches:
+        ok = False
+    print(">>> Compared {} branches over {} entries: {}".format(len(common), t1.GetEntries(), "identical" if ok else "DIFFERENT"))
+    return ok
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reference", help="reference baby (e.g., from the event loop)")
+    parser.add_argument("other", help="baby to check against the reference")
+    parser.add_argument("-t", "--treename", help="tree name", default="Events", type=str)
+    parser.add_argument("--tolerance", help="relative tolerance for float branches (0 = exact)", default=0., type=float)
+    args = parser.parse_args()
+
+    sys.exit(0 if compare(args.reference, args.other, treename=args.treename, tolerance=args.tolerance) else 1)
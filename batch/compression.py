@@ -0,0 +1,94 @@
+"""
+Per-branch-group compression of the babymaker output.
+
+A policy maps groups of output branches to ROOT compression settings
+(100*algorithm + level, see ROOT's Compression.h). Groups are decided from
+the branch name and its `make_branch` type:
+- flags: booleans (pass_*, passid, ...)
+- ints: int and long scalars (counts, run/lumi/event, ...)
+- floats: float scalars
+- vectors: vector branches (jets, L1 bits, ...)
+- gen: GenMuon_*/GenPart_*/genMatch_* branches (MC only, rarely read), and
+  all branches of the gen-info side trees (btophitree, hzdzdtree, ggphitree)
+Groups that a policy doesn't mention use its "default".
+
+Policies are given by name (see POLICIES) or as a spec like
+"default=lz4:4,floats=zstd:3,gen=lzma:6".
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+ALGORITHMS = OrderedDict([("zlib", 1), ("lzma", 2), ("lz4", 4), ("zstd", 5)])
+GROUPS = ["flags", "ints", "floats", "vectors", "gen"]
+
+POLICIES = OrderedDict([
+    # whatever ROOT uses by default (nothing is set)
+    ("root", {}),
+    ("lz4", {"default": "lz4:4"}),
+    ("zstd", {"default": "zstd:5"}),
+    ("zlib", {"default": "zlib:1"}),
+    # fast to read where notebooks spend their time, small where they don't
+    ("mixed", OrderedDict([
+        ("default", "lz4:4"),
+        ("flags", "zstd:5"),
+        ("vectors", "zstd:5"),
+        ("gen", "lzma:6"),
+        ])),
+    ])
+
+def parse_setting(setting):
+    """
+    "lz4:4" -> 404
+    """
+    alg, _, level = setting.partition(":")
+    if alg not in ALGORITHMS:
+        raise ValueError("Unknown compression algorithm {} (choose from {})".format(alg, ", ".join(ALGORITHMS)))
+    level = int(level or 4)
+    if not 0 <= level <= 9:
+        raise ValueError("Compression level must be 0-9, got {}".format(level))
+    return 100*ALGORITHMS[alg] + level
+
+def parse_policy(spec):
+    """
+    Dict of group -> ROOT compression setting for a policy name or spec
+    """
+    if spec in POLICIES:
+        items = POLICIES[spec].items()
+    else:
+        items = [x.split("=", 1) for x in spec.split(",") if x]
+        if not all(len(x) == 2 for x in items):
+            raise ValueError("Compression policy must be one of {} or like 'default=lz4:4,gen=zstd:5', got {}".format(", ".join(POLICIES), spec))
+    policy = {}
+    for group, setting in items:
+        if group != "default" and group not in GROUPS:
+            raise ValueError("Unknown branch group {} (choose from default, {})".format(group, ", ".join(GROUPS)))
+        policy[group] = parse_setting(setting)
+    return policy
+
+def branch_group(name, tstr):
+    if name.startswith("Gen") or ("genMatch" in name):
+        return "gen"
+    if tstr.startswith("v"):
+        return "vectors"
+    if tstr == "b":
+        return "flags"
+    if tstr in ["i", "l"]:
+        return "ints"
+    return "floats"
+
+def side_tree_setting(policy):
+    """
+    Compression setting for the gen-info side trees (None for ROOT's default)
+    """
+    return policy.get("gen", policy.get("default"))
+
+def apply_policy(tree, schema, policy):
+    """
+    Set the compression of the branches of `tree` made from `schema` (name -> `make_branch` type)
+    """
+    for name, tstr in schema.items():
+        setting = policy.get(branch_group(name, tstr), policy.get("default"))
+        if setting is None: continue
+        tree.GetBranch(name).SetCompressionSettings(setting)
@@ -0,0 +1,145 @@
+#include <vector>
+#include <cstring>
+#include "TTree.h"
+
+// Fills a TTree from columns (e.g., numpy arrays) without going back to python
+// for every entry. Scalar columns are copied into the branch buffers (the
+// addresses the branches were made with), and vector columns given as flat
+// content + offsets are assigned to the std::vector branch objects.
+// Addresses are passed as integers, e.g., `arr.ctypes.data` for numpy arrays.
+//
+// In row mode (for a per-event loop that sets the branch buffers itself),
+// store_row() copies the current buffers into staging storage, fill_rows()
+// fills the staged rows into the tree in bulk, and clear_row() resets the
+// buffers to their defaults, all in one call each.
+class ColumnFiller {
+    public:
+        ColumnFiller(TTree* tree) : tree_(tree), row_count_(0) {}
+
+        void clear() {
+            scalar_dst_.clear(); scalar_src_.clear(); scalar_size_.clear();
+            vf_dst_.clear(); vf_src_.clear(); vf_offsets_.clear();
+            vi_dst_.clear(); vi_src_.clear(); vi_offsets_.clear();
+        }
+
+        void add_scalar(Long64_t dst, Long64_t src, int itemsize) {
+            scalar_dst_.push_back(reinterpret_cast<char*>(dst));
+            scalar_src_.push_back(reinterpret_cast<const char*>(src));
+            scalar_size_.push_back(itemsize);
+        }
+
+        void add_vector_float(std::vector<float>& dst, Long64_t content, Long64_t offsets) {
+            vf_dst_.push_back(&dst);
+            vf_src_.push_back(reinterpret_cast<const float*>(content));
+            vf_offsets_.push_back(reinterpret_cast<const Long64_t*>(offsets));
+        }
+
+        void add_vector_int(std::vector<int>& dst, Long64_t content, Long64_t offsets) {
+            vi_dst_.push_back(&dst);
+            vi_src_.push_back(reinterpret_cast<const int*>(content));
+            vi_offsets_.push_back(reinterpret_cast<const Long64_t*>(offsets));
+        }
+
+        void add_row_scalar(Long64_t dst, Long64_t dflt, int itemsize) {
+            const char* d = reinterpret_cast<const char*>(dflt);
+            row_scalar_dst_.push_back(reinterpret_cast<char*>(dst));
+            row_scalar_default_.push_back(std::vector<char>(d, d + itemsize));
+            row_scalar_data_.push_back(std::vector<char>());
+        }
+
+        void add_row_vector_float(std::vector<float>& dst) {
+            row_vf_dst_.push_back(&dst);
+            row_vf_data_.push_back(std::vector<float>());
+            row_vf_offsets_.push_back(std::vector<Long64_t>(1, 0));
+        }
+
+        void add_row_vector_int(std::vector<int>& dst) {
+            row_vi_dst_.push_back(&dst);
+            row_vi_data_.push_back(std::vector<int>());
+            row_vi_offsets_.push_back(std::vector<Long64_t>(1, 0));
+        }
+
+        void clear_row() {
+            for (unsigned int j = 0; j < row_scalar_dst_.size(); j++) {
+                memcpy(row_scalar_dst_[j], &row_scalar_default_[j][0], row_scalar_default_[j].size());
+            }
+            for (unsigned int j = 0; j < row_vf_dst_.size(); j++) row_vf_dst_[j]->clear();
+            for (unsigned int j = 0; j < row_vi_dst_.size(); j++) row_vi_dst_[j]->clear();
+        }
+
+        Long64_t store_row() {
+            for (unsigned int j = 0; j < row_scalar_dst_.size(); j++) {
+                row_scalar_data_[j].insert(row_scalar_data_[j].end(), row_scalar_dst_[j], row_scalar_dst_[j] + row_scalar_default_[j].size());
+            }
+            for (unsigned int j = 0; j < row_vf_dst_.size(); j++) {
+                row_vf_data_[j].insert(row_vf_data_[j].end(), row_vf_dst_[j]->begin(), row_vf_dst_[j]->end());
+                row_vf_offsets_[j].push_back(row_vf_data_[j].size());
+            }
+            for (unsigned int j = 0; j < row_vi_dst_.size(); j++) {
+                row_vi_data_[j].insert(row_vi_data_[j].end(), row_vi_dst_[j]->begin(), row_vi_dst_[j]->end());
+                row_vi_offsets_[j].push_back(row_vi_data_[j].size());
+            }
+            return ++row_count_;
+        }
+
+        Long64_t fill_rows() {
+            for (Long64_t i = 0; i < row_count_; i++) {
+                for (unsigned int j = 0; j < row_scalar_dst_.size(); j++) {
+                    int size = row_scalar_default_[j].size();
+                    memcpy(row_scalar_dst_[j], &row_scalar_data_[j][0] + i*size, size);
+                }
+                for (unsigned int j = 0; j < row_vf_dst_.size(); j++) {
+                    row_vf_dst_[j]->assign(row_vf_data_[j].begin() + row_vf_offsets_[j][i], row_vf_data_[j].begin() + row_vf_offsets_[j][i+1]);
+                }
+                for (unsigned int j = 0; j < row_vi_dst_.size(); j++) {
+                    row_vi_dst_[j]->assign(row_vi_data_[j].begin() + row_vi_offsets_[j][i], row_vi_data_[j].begin() + row_vi_offsets_[j][i+1]);
+                }
+                tree_->Fill();
+            }
+            Long64_t nrows = row_count_;
+            for (unsigned int j = 0; j < row_scalar_data_.size(); j++) row_scalar_data_[j].clear();
+            for (unsigned int j = 0; j < row_vf_data_.size(); j++) { row_vf_data_[j].clear(); row_vf_offsets_[j].resize(1); }
+            for (unsigned int j = 0; j < row_vi_data_.size(); j++) { row_vi_data_[j].clear(); row_vi_offsets_[j].resize(1); }
+            row_count_ = 0;
+            clear_row();
+            return nrows;
+        }
+
+        Long64_t fill(Long64_t nrows) {
+            for (Long64_t i = 0; i < nrows; i++) {
+                for (unsigned int j = 0; j < scalar_dst_.size(); j++) {
+                    memcpy(scalar_dst_[j], scalar_src_[j] + i*scalar_size_[j], scalar_size_[j]);
+                }
+                for (unsigned int j = 0; j < vf_dst_.size(); j++) {
+                    vf_dst_[j]->assign(vf_src_[j] + vf_offsets_[j][i], vf_src_[j] + vf_offsets_[j][i+1]);
+                }
+                for (unsigned int j = 0; j < vi_dst_.size(); j++) {
+                    vi_dst_[j]->assign(vi_src_[j] + vi_offsets_[j][i], vi_src_[j] + vi_offsets_[j][i+1]);
+                }
+                tree_->Fill();
+            }
+            return nrows;
+        }
+
+    private:
+        TTree* tree_;
+        std::vector<char*> scalar_dst_;
+        std::vector<const char*> scalar_src_;
+        std::vector<int> scalar_size_;
+        std::vector<std::vector<float>*> vf_dst_;
+        std::vector<const float*> vf_src_;
+        std::vector<const Long64_t*> vf_offsets_;
+        std::vector<std::vector<int>*> vi_dst_;
+        std::vector<const int*> vi_src_;
+        std::vector<const Long64_t*> vi_offsets_;
+        Long64_t row_count_;
+        std::vector<char*> row_scalar_dst_;
+        std::vector<std::vector<char> > row_scalar_default_;
+        std::vector<std::vector<char> > row_scalar_data_;
+        std::vector<std::vector<float>*> row_vf_dst_;
+        std::vector<std::vector<float> > row_vf_data_;
+        std::vector<std::vector<Long64_t> > row_vf_offsets_;
+        std::vector<std::vector<int>*> row_vi_dst_;
+        std::vector<std::vector<int> > row_vi_data_;
+        std::vector<std::vector<Long64_t> > row_vi_offsets_;
+};
@@ -0,0 +1,43 @@
+#include <memory>
+#include <new>
+#include <string>
+#include <vector>
+#include "DataFormats/Common/interface/Wrapper.h"
+#include "DataFormats/Provenance/interface/EventAuxiliary.h"
+#include "DataFormats/Scouting/interface/ScoutingMuon.h"
+#include "DataFormats/Scouting/interface/ScoutingVertex.h"
+#include "DataFormats/Scouting/interface/ScoutingCaloJet.h"
+#include "DataFormats/HepMCCandidate/interface/GenParticle.h"
+
+// Helpers for synthetic.py, which writes EDM-like Events trees with the
+// products the babymaker reads. edm::Wrapper can't be assigned to, so the
+// branch objects are destroyed and constructed again in place for every event.
+#define SET_WRAPPER(T) \
+    void set_wrapper(edm::Wrapper<T>& w, T const& obj) { \
+        w.~Wrapper<T>(); \
+        new (&w) edm::Wrapper<T>(std::make_unique<T>(obj)); \
+    }
+
+SET_WRAPPER(std::vector<ScoutingMuon>)
+SET_WRAPPER(std::vector<ScoutingVertex>)
+SET_WRAPPER(std::vector<ScoutingCaloJet>)
+SET_WRAPPER(std::vector<reco::GenParticle>)
+SET_WRAPPER(std::vector<bool>)
+SET_WRAPPER(std::vector<int>)
+SET_WRAPPER(std::vector<std::string>)
+SET_WRAPPER(double)
+SET_WRAPPER(float)
+
+void set_aux(edm::EventAuxiliary& aux, unsigned int run, unsigned int lumi, unsigned long long event, bool is_data) {
+    aux = edm::EventAuxiliary(edm::EventID(run, lumi, event), "", edm::Timestamp(), is_data);
+}
+
+// Mothers are refs into the same collection (only `motherRef().index()` is used downstream).
+// `imother` < 0 for none.
+void add_gen_particle(std::vector<reco::GenParticle>& parts, int charge,
+        double px, double py, double pz, double e, double vx, double vy, double vz,
+        int pdgid, int status, int imother) {
+    reco::GenParticle p(charge, reco::Particle::LorentzVector(px, py, pz, e), reco::Particle::Point(vx, vy, vz), pdgid, status, true);
+    if (imother >= 0) p.addMother(reco::GenParticleRef(edm::ProductID(1, 1), imother, nullptr));
+    parts.push_back(p);
+}
@@ -0,0 +1,132 @@
+"""
+Dimuon + DV kinematics for arrays of muon pairs, shared by the event loop
+(the leading and subleading pairs of an event at once), the columnar engine
+(whole chunks) and the analysis notebooks (`utils.dimuon_kinematics`).
+
+Four-vectors are tuples of (px, py, pz, E) arrays. The helpers follow the
+TLorentzVector/TVector2 conventions that the event loop used to get from ROOT
+objects, so the outputs agree to floating point precision.
+"""
+
+from __future__ import print_function, division
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+MUON_MASS = 0.10566
+
+def phi_mpi_pi(x):
+    # TVector2::Phi_mpi_pi for inputs within (-3pi, 3pi)
+    x = np.where(x >= np.pi, x - 2*np.pi, x)
+    x = np.where(x < -np.pi, x + 2*np.pi, x)
+    return x
+
+def delta_phi(phi1, phi2):
+    return np.mod(phi1 - phi2 + math.pi, 2*math.pi) - math.pi
+
+def p4_from_ptetaphim(pt, eta, phi, mass):
+    # TLorentzVector::SetPtEtaPhiM
+    pt = np.abs(pt)
+    px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+    e = np.sqrt(px*px + py*py + pz*pz + mass*mass)
+    return px, py, pz, e
+
+def p4_pt(p4):
+    return np.sqrt(p4[0]*p4[0] + p4[1]*p4[1])
+
+def p4_phi(p4):
+    px, py = p4[0], p4[1]
+    return np.where((px == 0) & (py == 0), 0., np.arctan2(py, px))
+
+def p4_eta(p4):
+    # TVector3::PseudoRapidity
+    px, py, pz = p4[0], p4[1], p4[2]
+    mag = np.sqrt(px*px + py*py + pz*pz)
+    costheta = np.where(mag == 0, 1., pz/np.where(mag == 0, 1., mag))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eta = -0.5*np.log((1.0-costheta)/(1.0+costheta))
+    eta = np.where(costheta*costheta < 1, eta, np.where(pz == 0, 0., np.where(pz > 0, 10e10, -10e10)))
+    return eta
+
+def p4_mass(p4):
+    px, py, pz, e = p4
+    mm = e*e - (px*px + py*py + pz*pz)
+    return np.where(mm < 0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+def p4_add(a, b):
+    return tuple(x+y for x, y in zip(a, b))
+
+# ROOT::Math::LorentzVector (GenVector) conventions of the reco::Candidate p4()s,
+# for the gen particles in the columnar engine
+
+def lv_from_ptetaphim(pt, eta, phi, mass):
+    # PtEtaPhiM4D -> PxPyPzE4D
+    p = pt*np.cosh(eta)
+    e2 = p*p + np.where(mass >= 0, mass*mass, -mass*mass)
+    return pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta), np.sqrt(np.where(e2 > 0, e2, 0.))
+
+def lv_mass(p4):
+    # PxPyPzE4D::M
+    px, py, pz, e = p4
+    mm = e*e - px*px - py*py - pz*pz
+    return np.where(mm < 0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+def lv_eta(p4):
+    # Impl::Eta_FromRhoZ
+    rho, z = p4_pt(p4), p4[2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zs = z/rho
+        eta = np.where(np.abs(zs) < 2.0**13, np.log(zs + np.sqrt(zs*zs + 1.0)),
+                np.where(z > 0, np.log(2.0*zs + 0.5/zs), -np.log(-2.0*zs)))
+    return np.where(rho > 0, eta, np.where(z == 0, 0., np.where(z > 0, z + 22756.0, z - 22756.0)))
+
+def vec2_phi(x, y):
+    # TVector2::Phi, in [0, 2pi)
+    return np.pi + np.arctan2(-y, -x)
+
+def pair_kinematics(mu1, mu2, dv, pvx, pvy):
+    """
+    Kinematics of muon pairs and their DVs, one element per pair.
+    `mu1`/`mu2` map pt, eta, phi and phiCorr (phi at the DV) to arrays,
+    `dv` maps x, y, xError and yError, and the displacement is measured from (`pvx`, `pvy`).
+    Returns an OrderedDict with
+    - dimuon_pt/eta/phi/mass: from the muons with phiCorr
+    - dimuon_massRaw: from the muons with the track phi
+    - lxy, lxyError, cosphi, ctau, logabsetaphi, absdphimumu, absdphimudv
+    - p4corr: the corrected dimuon four-vector, e.g., for the four-muon mass
+    Divisions by zero (e.g., lxy == 0) give inf/nan instead of raising.
+    """
+    mu1p4 = p4_from_ptetaphim(mu1["pt"], mu1["eta"], mu1["phi"], MUON_MASS)
+    mu2p4 = p4_from_ptetaphim(mu2["pt"], mu2["eta"], mu2["phi"], MUON_MASS)
+    dimuon = p4_add(mu1p4, mu2p4)
+    dvx, dvy = dv["x"]-pvx, dv["y"]-pvy
+    dimx, dimy = dimuon[0], dimuon[1]
+    mu1p4_corr = p4_from_ptetaphim(mu1["pt"], mu1["eta"], mu1["phiCorr"], MUON_MASS)
+    mu2p4_corr = p4_from_ptetaphim(mu2["pt"], mu2["eta"], mu2["phiCorr"], MUON_MASS)
+    dimuon_corr = p4_add(mu1p4_corr, mu2p4_corr)
+    mass = p4_mass(dimuon_corr)
+    dimuon_pt = p4_pt(dimuon_corr)
+
+    out = OrderedDict()
+    # definition on s2 of https://indico.cern.ch/event/846681/contributions/3557724/attachments/1907377/3150380/Displaced_Scouting_Status_Update.pdf
+    # rutgers lxy is lowercase lxy from that set of slides, which does not have the cosine term
+    lxy = np.sqrt(dvx*dvx + dvy*dvy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosphi = (dvx*dimx + dvy*dimy) / (lxy*np.sqrt(dimx*dimx + dimy*dimy))
+        dphimumu = phi_mpi_pi(p4_phi(mu1p4) - p4_phi(mu2p4))
+        out["dimuon_pt"] = dimuon_pt
+        out["dimuon_eta"] = p4_eta(dimuon_corr)
+        out["dimuon_phi"] = p4_phi(dimuon_corr)
+        out["dimuon_mass"] = mass
+        out["dimuon_massRaw"] = p4_mass(dimuon)
+        out["lxy"] = lxy
+        out["lxyError"] = ((dv["xError"]*dvx)**2 + (dv["yError"]*dvy)**2)**0.5 / lxy
+        out["cosphi"] = cosphi
+        out["ctau"] = lxy*cosphi*mass/dimuon_pt
+        out["logabsetaphi"] = np.log10(np.maximum(np.abs(p4_eta(mu1p4)-p4_eta(mu2p4)), 1e-6)/np.maximum(np.abs(dphimumu), 1e-6))
+        out["absdphimumu"] = np.abs(dphimumu)
+        out["absdphimudv"] = np.abs(phi_mpi_pi(vec2_phi(dvx, dvy) - vec2_phi(dimx, dimy)))
+    out["p4corr"] = dimuon_corr
+    return out
@@ -0,0 +1,142 @@
+"""
+One-pass index over the gen particle record of an event.
+
+The gen-info extractors, the GenMuon/GenOther branches and the gen matching of
+reco muons all need pdgIds and mother/grandmother/ancestor lookups. Going
+through `motherRef()` in PyROOT is slow, so `GenIndex` converts the collection
+once, reads every pdgId once, and resolves mothers only for the particles that
+are ever looked at (muons, the exotic mothers, and their mothers). Kinematics
+still come from the original objects in `parts`.
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+import numpy as np
+
+# particles we ever need mothers for. |pdgId| 13 plus the "exotic" mothers
+MUON_ID = 13
+EXOTIC_IDS = [23, 25, 6000211, 3000022, 999999, 1999999]
+
+# how far up a chain of muons (e.g., from FSR) to look for the first non-muon ancestor
+MAX_ANCESTOR_DEPTH = 10
+
+class GenIndex(object):
+    """
+    Arrays over the gen particles of one event, with -1 for missing/unresolved indices:
+    - pdgid: pdgId of every particle
+    - mother: index of the mother (resolved for muons, exotics and their mothers)
+    - grandmother: mother of the mother
+    - ancestor: for muons, index of the first non-muon ancestor within MAX_ANCESTOR_DEPTH generations
+    """
+
+    def __init__(self, genparts):
+        self.parts = list(genparts)
+        n = len(self.parts)
+        self.pdgid = np.array([p.pdgId() for p in self.parts], dtype=np.int64)
+        self.mother = -np.ones(n, dtype=np.int64)
+
+        abspdgid = np.abs(self.pdgid)
+        self.interesting = np.nonzero((abspdgid == MUON_ID) | np.isin(abspdgid, EXOTIC_IDS))[0]
+        self.resolve_mothers(self.interesting)
+        self.resolve_mothers(self.mother[self.interesting])
+        self.grandmother = self.take(self.mother, self.mother)
+
+        # walk up muon chains for all muons at once
+        ismuon = abspdgid == MUON_ID
+        cur = np.where(ismuon, self.mother, -1)
+        found = np.zeros(n, dtype=bool)
+        for _ in range(MAX_ANCESTOR_DEPTH):
+            todo = ismuon & ~found & (cur >= 0)
+            if not todo.any(): break
+            self.resolve_mothers(cur[todo])
+            found[todo] = np.abs(self.pdgid[cur[todo]]) != MUON_ID
+            climb = todo & ~found
+            cur[climb] = self.mother[cur[climb]]
+        self.ancestor = np.where(found, cur, -1)
+        self.resolve_mothers(self.ancestor[self.ancestor >= 0])
+
+    def resolve_mothers(self, indices):
+        n = len(self.parts)
+        for i in np.unique(indices):
+            if i < 0 or self.mother[i] >= 0: continue
+            imother = self.parts[i].motherRef().index()
+            self.mother[i] = imother if 0 <= imother < n else -1
+
+    def take(self, arr, indices, default=-1):
+        """
+        arr[indices], with `default` where the index is -1
+        """
+        indices = np.asarray(indices)
+        return np.where(indices >= 0, arr[np.maximum(indices, 0)], default)
+
+    def mother_pdgid(self, indices):
+        return self.take(self.pdgid, self.take(self.mother, indices), default=0)
+
+    def daughters_by_mother(self, motherid, abspdgid=MUON_ID):
+        """
+        OrderedDict of mother index -> list of daughter indices, for particles with
+        |pdgId| == abspdgid whose mother has pdgId == motherid (in record order)
+        """
+        out = OrderedDict()
+        cands = self.interesting[np.abs(self.pdgid[self.interesting]) == abspdgid]
+        sel = cands[self.mother_pdgid(cands) == motherid]
+        for i in sel:
+            out.setdefault(self.mother[i], []).append(i)
+        return out
+
+class ChunkGenIndex(GenIndex):
+    """
+    `GenIndex` for the gen particles of a whole chunk of events at once (columnar engine).
+
+    Particles are flat arrays with per-event `offsets`, and `motherkey` is the key of
+    the first mother of each particle within its event (-1 if none). Indices in `mother`,
+    `grandmother` and `ancestor` are into the flat arrays, with -1 for missing ones.
+    Mothers are resolved for every particle, which gives the same answers as the
+    lazy resolution in `GenIndex`.
+    """
+
+    def __init__(self, offsets, pdgid, motherkey):
+        self.parts = None
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.pdgid = np.asarray(pdgid, dtype=np.int64)
+        counts = np.diff(self.offsets)
+        self.parents = np.repeat(np.arange(len(counts)), counts)
+        motherkey = np.asarray(motherkey, dtype=np.int64)
+        inrange = (motherkey >= 0) & (motherkey < counts[self.parents])
+        self.mother = np.where(inrange, self.offsets[:-1][self.parents] + motherkey, -1)
+
+        abspdgid = np.abs(self.pdgid)
+        self.interesting = np.nonzero((abspdgid == MUON_ID) | np.isin(abspdgid, EXOTIC_IDS))[0]
+        self.grandmother = self.take(self.mother, self.mother)
+
+        ismuon = abspdgid == MUON_ID
+        cur = np.where(ismuon, self.mother, -1)
+        found = np.zeros(len(self.pdgid), dtype=bool)
+        for _ in range(MAX_ANCESTOR_DEPTH):
+            todo = ismuon & ~found & (cur >= 0)
+            if not todo.any(): break
+            found[todo] = np.abs(self.pdgid[cur[todo]]) != MUON_ID
+            climb = todo & ~found
+            cur[climb] = self.mother[cur[climb]]
+        self.ancestor = np.where(found, cur, -1)
+
+    def first_daughters(self, motherid, abspdgid=MUON_ID):
+        """
+        Per event, the number of distinct mothers with pdgId == motherid of particles with
+        |pdgId| == abspdgid, and the first two such daughters in record order (-1 if missing),
+        i.e., the first entry of `GenIndex.daughters_by_mother` for events with one mother.
+        """
+        nevents = len(self.offsets)-1
+        cands = self.interesting[np.abs(self.pdgid[self.interesting]) == abspdgid]
+        sel = cands[self.mother_pdgid(cands) == motherid]
+        nmothers = np.bincount(self.parents[np.unique(self.mother[sel])], minlength=nevents)
+        first = -np.ones((nevents, 2), dtype=np.int64)
+        evts, ifirst = np.unique(self.parents[sel], return_index=True)
+        first[evts,0] = sel[ifirst]
+        isecond = ifirst+1
+        ok = isecond < len(sel)
+        ok[ok] = self.parents[sel[isecond[ok]]] == evts[ok]
+        first[evts[ok],1] = sel[isecond[ok]]
+        return nmothers, first
@@ -0,0 +1,168 @@
+"""
+Chunk-level kernels over flat (content, offsets) arrays for the columnar babymaker.
+
+Everything here only needs numpy. If numba is available, the loops get jitted,
+otherwise they run as (slower) plain python over the same arrays.
+"""
+
+from __future__ import print_function, division
+
+import math
+
+import numpy as np
+
+try:
+    import numba
+    jit = numba.njit(cache=True)
+except ImportError:
+    numba = None
+    def jit(f):
+        return f
+
+
+@jit
+def unroll_vtxindx_starts(mu_offsets, vtx_offsets, bugged):
+    """
+    Return the start index into the flat vtxIndx content for each muon.
+
+    For 2017 data before run 305405, vtxIndx() is cumulative over the muons
+    of an event (missing clear()), so only the new elements on the right
+    belong to a muon. This mirrors `indices[curr_length:]` in `pick_best_objects`.
+    """
+    starts = vtx_offsets[:-1].copy()
+    for ievt in range(len(mu_offsets)-1):
+        if not bugged[ievt]: continue
+        curr_length = 0
+        for imu in range(mu_offsets[ievt], mu_offsets[ievt+1]):
+            start = min(vtx_offsets[imu] + curr_length, vtx_offsets[imu+1])
+            curr_length += vtx_offsets[imu+1] - start
+            starts[imu] = start
+    return starts
+
+@jit
+def _pick_best_objects_kernel(active, dv_offsets, dv_chi2, dv_passid,
+        mu_offsets, mu_pt, mu_charge, vtx_starts, vtx_stops, vtx_content,
+        best, secondary):
+    for ievt in range(len(active)):
+        if not active[ievt]: continue
+        dv0 = dv_offsets[ievt]
+        ndv = dv_offsets[ievt+1] - dv0
+        mu0 = mu_offsets[ievt]
+        nmu = mu_offsets[ievt+1] - mu0
+
+        # number of muon associations, charge sum and first two muons per DV
+        nassoc = np.zeros(ndv, dtype=np.int64)
+        qsum = np.zeros(ndv, dtype=np.int64)
+        imu_a = -np.ones(ndv, dtype=np.int64)
+        imu_b = -np.ones(ndv, dtype=np.int64)
+        for imu in range(nmu):
+            for k in range(vtx_starts[mu0+imu], vtx_stops[mu0+imu]):
+                idv = vtx_content[k]
+                if idv < 0 or idv >= ndv: continue
+                if nassoc[idv] == 0: imu_a[idv] = imu
+                elif nassoc[idv] == 1: imu_b[idv] = imu
+                nassoc[idv] += 1
+                qsum[idv] += mu_charge[mu0+imu]
+
+        # good DVs with exactly 2 OS muons, sorted by chi2
+        order = np.argsort(dv_chi2[dv0:dv0+ndv], kind="mergesort")
+        cands = np.empty(ndv, dtype=np.int64)
+        ncands = 0
+        for idv in order:
+            if dv_passid[dv0+idv] and nassoc[idv] == 2 and qsum[idv] == 0:
+                cands[ncands] = idv
+                ncands += 1
+        if ncands == 0: continue
+
+        bestidv = cands[0]
+        imu1, imu2 = imu_a[bestidv], imu_b[bestidv]
+        if mu_pt[mu0+imu2] > mu_pt[mu0+imu1]:
+            imu1, imu2 = imu2, imu1
+        best[ievt, 0] = bestidv
+        best[ievt, 1] = imu1
+        best[ievt, 2] = imu2
+
+        if ncands >= 2 and nmu >= 4:
+            for icand in range(1, ncands):
+                idv2 = cands[icand]
+                jmu1, jmu2 = imu_a[idv2], imu_b[idv2]
+                if jmu1 == imu1 or jmu1 == imu2 or jmu2 == imu1 or jmu2 == imu2: continue
+                if mu_pt[mu0+jmu2] > mu_pt[mu0+jmu1]:
+                    jmu1, jmu2 = jmu2, jmu1
+                secondary[ievt, 0] = idv2
+                secondary[ievt, 1] = jmu1
+                secondary[ievt, 2] = jmu2
+                break
+
+def pick_best_objects_chunk(active, dv_offsets, dv_chi2, dv_passid,
+        mu_offsets, mu_pt, mu_charge, vtx_offsets, vtx_content, bugged):
+    """
+    Chunk version of `babymaker.pick_best_objects`.
+
+    `dv_*`/`mu_*` are flat per-object arrays with per-event offsets, and
+    `vtx_offsets`/`vtx_content` hold the flattened vtxIndx() vector of every muon
+    (one offsets entry per muon). `bugged` flags events with the cumulative 2017
+    vtxIndx() bug, and events with `active` False are skipped.
+
+    Returns two (nevents, 3) int arrays of (idv, imu1, imu2) for the best and
+    secondary DVs, with -1 if none. Indices are local to each event.
+    """
+    nevents = len(active)
+    best = -np.ones((nevents, 3), dtype=np.int64)
+    secondary = -np.ones((nevents, 3), dtype=np.int64)
+    mu_offsets = np.asarray(mu_offsets, dtype=np.int64)
+    vtx_offsets = np.asarray(vtx_offsets, dtype=np.int64)
+    vtx_starts = unroll_vtxindx_starts(mu_offsets, vtx_offsets, np.asarray(bugged, dtype=np.bool_))
+    _pick_best_objects_kernel(
+            np.asarray(active, dtype=np.bool_),
+            np.asarray(dv_offsets, dtype=np.int64),
+            np.asarray(dv_chi2),
+            np.asarray(dv_passid, dtype=np.bool_),
+            mu_offsets,
+            np.asarray(mu_pt),
+            np.asarray(mu_charge, dtype=np.int64),
+            vtx_starts,
+            vtx_offsets[1:],
+            np.asarray(vtx_content, dtype=np.int64),
+            best, secondary,
+            )
+    return best, secondary
+
+@jit
+def _nearest_dr_kernel(offsets, eta, phi, qevt, qeta, qphi, index, dr):
+    for iq in range(len(qevt)):
+        ievt = qevt[iq]
+        if ievt < 0: continue
+        start = offsets[ievt]
+        for k in range(start, offsets[ievt+1]):
+            dphi = (qphi[iq] - phi[k] + math.pi) % (2*math.pi) - math.pi
+            d = math.hypot(qeta[iq] - eta[k], dphi)
+            # strict < keeps the first of equally close candidates, like a stable sort
+            if d < dr[iq]:
+                dr[iq] = d
+                index[iq] = k - start
+
+def nearest_dr(offsets, eta, phi, qevt, qeta, qphi):
+    """
+    Nearest neighbour in DeltaR for a chunk of query objects (e.g., selected muons).
+
+    `eta`/`phi` are the flat candidates (e.g., jets or gen muons) with per-event
+    `offsets`, and query `i` at (`qeta[i]`, `qphi[i]`) is matched against the
+    candidates of event `qevt[i]` (-1 to skip the query).
+
+    Returns the index of the nearest candidate local to its event (-1 if there
+    is none) and its DeltaR (999. if there is none).
+    """
+    nq = len(qevt)
+    index = -np.ones(nq, dtype=np.int64)
+    dr = np.full(nq, 999.)
+    _nearest_dr_kernel(
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(eta, dtype=np.float64),
+            np.asarray(phi, dtype=np.float64),
+            np.asarray(qevt, dtype=np.int64),
+            np.asarray(qeta, dtype=np.float64),
+            np.asarray(qphi, dtype=np.float64),
+            index, dr,
+            )
+    return index, dr
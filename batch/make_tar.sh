@@ -1,4 +1,11 @@
 #!/usr/bin/env bash
 
+# shared read-only voxel map for the pixel material lookup (see pixel_lookup.py)
+[ -e data/pixel_voxels_2018.npz ] || python pixel_lookup.py
+# memory-mappable beamspot tables (see beamspots.py)
+for f in data/beamspots_*.pkl; do
+    [ -e "$f" ] && [ ! -e "${f%.pkl}.npz" ] && python beamspots.py "$f"
+done
+
 # tar cvzf package.tar.gz slim_and_skim.py data/*.gz
-tar cvzf package.tar.gz babymaker.py data/
+tar cvzf package.tar.gz babymaker.py columnar.py kernels.py pixel_lookup.py npzutils.py propagation.py genindex.py treewriter.py profiling.py beamspots.py readaudit.py compression.py dimuon.py selections.py data/
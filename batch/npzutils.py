@@ -0,0 +1,35 @@
+"""
+Memory-mapped reading of the .npz lookup tables in data/ (pixel voxel map, beamspots).
+"""
+
+from __future__ import print_function, division
+
+import struct
+import zipfile
+
+import numpy as np
+
+def load_npz_mmap(fname, mmap_mode="r"):
+    """
+    Like `np.load` of an uncompressed .npz (as written by `np.savez`),
+    but returns a dict of arrays memory-mapped from the file
+    """
+    arrays = {}
+    with zipfile.ZipFile(fname) as zf, open(fname, "rb") as fh:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("{} in {} is compressed, can't memory-map it".format(info.filename, fname))
+            # skip the local file header to get to the .npy member
+            fh.seek(info.header_offset)
+            header = fh.read(30)
+            namelen, extralen = struct.unpack("<HH", header[26:30])
+            fh.seek(info.header_offset + 30 + namelen + extralen)
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fh)
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            arrays[name] = np.memmap(fname, dtype=dtype, mode=mmap_mode, shape=shape,
+                    order="F" if fortran_order else "C", offset=fh.tell())
+    return arrays
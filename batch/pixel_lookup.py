@@ -0,0 +1,292 @@
+"""
+Indexed, batched version of `point_in_which_module`/`dist_to_imodule_plane`/`imodule_to_layernum`
+from `data/calculate_pixel.cc`.
+
+Modules are read from `data/pixel_module_volumes_2018.h` (15 floats per module:
+rotation matrix rows, translation, half-widths). A uniform (x, y, z) grid is
+built once, where each cell lists the modules whose bounding box overlaps it,
+so a lookup only tests a handful of candidate modules instead of all 1856.
+Candidates are tested in increasing module index with the same float32
+arithmetic, so results match the linear scan (first matching module wins).
+
+    lookup = PixelLookup()
+    imodule, layernum, planedist = lookup.lookup(x, y, z)
+
+For the inner pixel volume, `PixelVoxelMap` additionally reads a precomputed
+voxel map of module membership (made once with `python pixel_lookup.py`)
+through a read-only memory map. Voxels fully inside one module or outside all
+of them answer directly, and only points in voxels that straddle a module
+boundary (or outside the map) go through the grid lookup.
+"""
+
+from __future__ import print_function, division
+
+import os
+import re
+import zlib
+import argparse
+
+import numpy as np
+
+from kernels import jit
+from npzutils import load_npz_mmap
+
+DEFAULT_HEADER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pixel_module_volumes_2018.h")
+DEFAULT_VOXELMAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pixel_voxels_2018.npz")
+
+# voxel map values besides module indices
+VOXEL_EMPTY = -1
+VOXEL_BOUNDARY = -2
+
+def read_module_volumes(fname=DEFAULT_HEADER):
+    """
+    Parse the C++ header into (volumes, layernums) numpy arrays of shape (NMODULES, 15) and (NMODULES,)
+    """
+    with open(fname, "r") as fh:
+        text = fh.read()
+    layers = re.search(r"module_layernums\[NMODULES\]\s*=\s*\{([^}]*)\}", text).group(1)
+    layernums = np.array([int(x) for x in layers.split(",") if x.strip()], dtype=np.int32)
+    body = text[text.index("module_volumes[NMODULES][15]"):]
+    rows = re.findall(r"\{([^{}]*)\}", body)
+    volumes = np.array([[float(x) for x in row.split(",")] for row in rows], dtype=np.float32)
+    if volumes.shape != (len(layernums), 15):
+        raise ValueError("Inconsistent module tables in {}: {} volumes, {} layer numbers".format(fname, volumes.shape, len(layernums)))
+    return volumes, layernums
+
+def module_corners(volumes):
+    """
+    Return (NMODULES, 8, 3) array of global corner positions of each module box
+    """
+    rot = volumes[:,:9].astype(np.float64).reshape(-1, 3, 3)
+    trans = volumes[:,9:12].astype(np.float64)
+    half = volumes[:,12:15].astype(np.float64)
+    signs = np.array([[sx, sy, sz] for sx in [-1,1] for sy in [-1,1] for sz in [-1,1]], dtype=np.float64)
+    # local axes are the rows of the rotation matrix
+    return trans[:,None,:] + np.einsum("ck,mk,mkj->mcj", signs, half, rot)
+
+@jit
+def _lookup_kernel(xs, ys, zs, volumes, lo, cellsize, shape, cell_offsets, cell_modules, imodules, planedists):
+    for i in range(len(xs)):
+        px, py, pz = xs[i], ys[i], zs[i]
+        ix = int(np.floor((px - lo[0]) / cellsize[0]))
+        iy = int(np.floor((py - lo[1]) / cellsize[1]))
+        iz = int(np.floor((pz - lo[2]) / cellsize[2]))
+        if ix < 0 or iy < 0 or iz < 0 or ix >= shape[0] or iy >= shape[1] or iz >= shape[2]:
+            continue
+        icell = (ix*shape[1] + iy)*shape[2] + iz
+        for k in range(cell_offsets[icell], cell_offsets[icell+1]):
+            imodule = cell_modules[k]
+            arr = volumes[imodule]
+            sx = px - arr[9]
+            sy = py - arr[10]
+            sz = pz - arr[11]
+            inside = True
+            for j in range(3):
+                if abs(arr[3*j]*sx + arr[3*j+1]*sy + arr[3*j+2]*sz) > arr[j+12]:
+                    inside = False
+                    break
+            if inside:
+                imodules[i] = imodule
+                planedists[i] = abs(arr[6]*sx + arr[7]*sy + arr[8]*sz)
+                break
+
+class PixelLookup(object):
+    """
+    Grid-indexed point-in-module lookup over the pixel module boxes
+    """
+
+    def __init__(self, fname=DEFAULT_HEADER, cellsize=(1.0, 1.0, 2.0)):
+        self.volumes, self.layernums = read_module_volumes(fname)
+        self.cellsize = np.array(cellsize, dtype=np.float32)
+        self.build_index()
+
+    def build_index(self):
+        corners = module_corners(self.volumes)
+        bbox_lo = corners.min(axis=1)
+        bbox_hi = corners.max(axis=1)
+        # pad by one cell so float32 round-off at the edges can't drop a candidate
+        self.lo = (bbox_lo.min(axis=0) - self.cellsize).astype(np.float32)
+        hi = bbox_hi.max(axis=0) + self.cellsize
+        self.shape = np.ceil((hi - self.lo) / self.cellsize).astype(np.int64)
+
+        # for every module, all cells overlapping its bounding box (+ a small margin)
+        margin = 1e-3
+        ilo = np.floor((bbox_lo - margin - self.lo) / self.cellsize).astype(np.int64)
+        ihi = np.floor((bbox_hi + margin - self.lo) / self.cellsize).astype(np.int64)
+        cells, modules = [], []
+        for imodule in range(len(self.volumes)):
+            ix, iy, iz = np.meshgrid(
+                    np.arange(ilo[imodule,0], ihi[imodule,0]+1),
+                    np.arange(ilo[imodule,1], ihi[imodule,1]+1),
+                    np.arange(ilo[imodule,2], ihi[imodule,2]+1),
+                    indexing="ij",
+                    )
+            icells = ((ix*self.shape[1] + iy)*self.shape[2] + iz).ravel()
+            cells.append(icells)
+            modules.append(np.full(len(icells), imodule, dtype=np.int64))
+        cells = np.concatenate(cells)
+        modules = np.concatenate(modules)
+        # CSR layout, with modules in increasing index within each cell
+        order = np.lexsort((modules, cells))
+        self.cell_modules = modules[order]
+        counts = np.bincount(cells, minlength=int(np.prod(self.shape)))
+        self.cell_offsets = np.zeros(len(counts)+1, dtype=np.int64)
+        np.cumsum(counts, out=self.cell_offsets[1:])
+
+    def point_in_which_module(self, x, y, z):
+        return self.lookup(x, y, z)[0]
+
+    def lookup(self, x, y, z):
+        """
+        Given arrays of positions (cm), return arrays of
+        - imodule: index of the containing module, or -1
+        - layernum: layer number of that module, or -1
+        - planedist: distance to the module plane, or 999
+        """
+        xs = np.atleast_1d(np.asarray(x, dtype=np.float32))
+        ys = np.atleast_1d(np.asarray(y, dtype=np.float32))
+        zs = np.atleast_1d(np.asarray(z, dtype=np.float32))
+        imodules = -np.ones(len(xs), dtype=np.int64)
+        planedists = np.full(len(xs), 999., dtype=np.float32)
+        _lookup_kernel(xs, ys, zs, self.volumes, self.lo, self.cellsize, self.shape,
+                self.cell_offsets, self.cell_modules, imodules, planedists)
+        layernums = np.where(imodules >= 0, self.layernums[np.maximum(imodules, 0)], -1)
+        return imodules, layernums, planedists
+
+    def get_pixel_info(self, x, y, z):
+        """
+        Batched `Looper.get_pixel_rectangle_info`: same as `lookup`, but skips the
+        lookup (imodule -1) in the rho regions without modules
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z, dtype=np.float64))
+        rho = np.hypot(x, y)
+        skip = ((0.0 < rho) & (rho < 2.4)) | ((3.7 < rho) & (rho < 5.7))
+        imodules = -np.ones(len(x), dtype=np.int64)
+        layernums = -np.ones(len(x), dtype=np.int64)
+        planedists = np.full(len(x), 999., dtype=np.float32)
+        todo = ~skip
+        if todo.any():
+            imodules[todo], layernums[todo], planedists[todo] = self.lookup(x[todo], y[todo], z[todo])
+        return imodules, layernums, planedists
+
+@jit
+def _fill_voxels_kernel(voxels, lo, cellsize, volumes, bbox_lo, bbox_hi, eps):
+    nx, ny, nz = voxels.shape
+    half = 0.5*cellsize
+    for imodule in range(len(volumes)):
+        arr = volumes[imodule]
+        ilo = np.floor((bbox_lo[imodule] - lo)/cellsize)
+        ihi = np.floor((bbox_hi[imodule] - lo)/cellsize)
+        for ix in range(max(int(ilo[0]), 0), min(int(ihi[0])+1, nx)):
+            for iy in range(max(int(ilo[1]), 0), min(int(ihi[1])+1, ny)):
+                for iz in range(max(int(ilo[2]), 0), min(int(ihi[2])+1, nz)):
+                    # earlier (lower index) modules win, like the linear scan
+                    if voxels[ix, iy, iz] != VOXEL_EMPTY: continue
+                    cx = lo[0] + (ix+0.5)*cellsize[0] - arr[9]
+                    cy = lo[1] + (iy+0.5)*cellsize[1] - arr[10]
+                    cz = lo[2] + (iz+0.5)*cellsize[2] - arr[11]
+                    # separated along a module axis?
+                    disjoint = False
+                    inside = True
+                    for i in range(3):
+                        dist = abs(arr[3*i]*cx + arr[3*i+1]*cy + arr[3*i+2]*cz)
+                        extent = abs(arr[3*i])*half[0] + abs(arr[3*i+1])*half[1] + abs(arr[3*i+2])*half[2]
+                        if dist > arr[i+12] + extent + eps: disjoint = True
+                        # box is convex, so the voxel is inside if its furthest corner is
+                        if dist + extent > arr[i+12] - eps: inside = False
+                    # separated along a global axis?
+                    for j in range(3):
+                        dist = abs((cx, cy, cz)[j])
+                        extent = abs(arr[j])*arr[12] + abs(arr[3+j])*arr[13] + abs(arr[6+j])*arr[14]
+                        if dist > half[j] + extent + eps: disjoint = True
+                    if disjoint: continue
+                    voxels[ix, iy, iz] = imodule if inside else VOXEL_BOUNDARY
+
+@jit
+def _voxel_lookup_kernel(xs, ys, zs, volumes, voxels, lo, cellsize, imodules, planedists):
+    nx, ny, nz = voxels.shape
+    for i in range(len(xs)):
+        px, py, pz = xs[i], ys[i], zs[i]
+        ix = int(np.floor((px - lo[0]) / cellsize[0]))
+        iy = int(np.floor((py - lo[1]) / cellsize[1]))
+        iz = int(np.floor((pz - lo[2]) / cellsize[2]))
+        if ix < 0 or iy < 0 or iz < 0 or ix >= nx or iy >= ny or iz >= nz:
+            imodules[i] = VOXEL_BOUNDARY
+            continue
+        imodule = voxels[ix, iy, iz]
+        imodules[i] = imodule
+        if imodule >= 0:
+            arr = volumes[imodule]
+            planedists[i] = abs(arr[6]*(px - arr[9]) + arr[7]*(py - arr[10]) + arr[8]*(pz - arr[11]))
+
+def build_voxel_map(fname=DEFAULT_VOXELMAP, header=DEFAULT_HEADER, rhomax=11., cellsize=(0.1, 0.1, 0.5), eps=1e-3):
+    """
+    Precompute the voxel map over |x|,|y| < rhomax and the z range of the modules,
+    and save it as an uncompressed .npz that `PixelVoxelMap` memory-maps
+    """
+    volumes, _ = read_module_volumes(header)
+    corners = module_corners(volumes)
+    bbox_lo = corners.min(axis=1)
+    bbox_hi = corners.max(axis=1)
+    cellsize = np.array(cellsize, dtype=np.float64)
+    lo = np.array([-rhomax, -rhomax, bbox_lo[:,2].min()])
+    hi = np.array([rhomax, rhomax, bbox_hi[:,2].max()])
+    shape = tuple(np.ceil((hi - lo)/cellsize).astype(np.int64))
+    voxels = np.full(shape, VOXEL_EMPTY, dtype=np.int16)
+    _fill_voxels_kernel(voxels, lo, cellsize, volumes.astype(np.float64), bbox_lo, bbox_hi, eps)
+    np.savez(fname, voxels=voxels, lo=lo, cellsize=cellsize, checksum=np.array(geometry_checksum(volumes)))
+    return voxels
+
+def geometry_checksum(volumes):
+    return zlib.crc32(np.ascontiguousarray(volumes, dtype=np.float32).tobytes()) & 0xffffffff
+
+class PixelVoxelMap(PixelLookup):
+    """
+    `PixelLookup` that answers from the precomputed voxel map where possible
+    """
+
+    def __init__(self, fname=DEFAULT_VOXELMAP, header=DEFAULT_HEADER, **kwargs):
+        super(PixelVoxelMap, self).__init__(header, **kwargs)
+        arrays = load_npz_mmap(fname)
+        if int(arrays["checksum"]) != geometry_checksum(self.volumes):
+            raise ValueError("Voxel map {} was made from a different geometry than {}".format(fname, header))
+        self.voxels = np.asarray(arrays["voxels"])
+        self.voxel_lo = np.array(arrays["lo"])
+        self.voxel_cellsize = np.array(arrays["cellsize"])
+
+    def lookup(self, x, y, z):
+        xs = np.atleast_1d(np.asarray(x, dtype=np.float32))
+        ys = np.atleast_1d(np.asarray(y, dtype=np.float32))
+        zs = np.atleast_1d(np.asarray(z, dtype=np.float32))
+        imodules = np.empty(len(xs), dtype=np.int64)
+        planedists = np.full(len(xs), 999., dtype=np.float32)
+        _voxel_lookup_kernel(xs, ys, zs, self.volumes, self.voxels, self.voxel_lo, self.voxel_cellsize, imodules, planedists)
+        # boundary voxels and points outside the map get the exact test
+        exact = imodules == VOXEL_BOUNDARY
+        if exact.any():
+            imodules[exact], _, planedists[exact] = super(PixelVoxelMap, self).lookup(xs[exact], ys[exact], zs[exact])
+        layernums = np.where(imodules >= 0, self.layernums[np.maximum(imodules, 0)], -1)
+        return imodules, layernums, planedists
+
+def get_pixel_lookup(voxelmap=DEFAULT_VOXELMAP):
+    """
+    `PixelVoxelMap` if the voxel map has been built, otherwise `PixelLookup`
+    """
+    if voxelmap and os.path.exists(voxelmap):
+        return PixelVoxelMap(voxelmap)
+    return PixelLookup()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the pixel voxel map used by PixelVoxelMap")
+    parser.add_argument("-o", "--output", help="output .npz", default=DEFAULT_VOXELMAP)
+    parser.add_argument("--rhomax", help="transverse half-size of the map in cm", default=11., type=float)
+    parser.add_argument("--cellsize", help="voxel size in x, y, z in cm", default=[0.1, 0.1, 0.5], type=float, nargs=3)
+    args = parser.parse_args()
+
+    voxels = build_voxel_map(args.output, rhomax=args.rhomax, cellsize=args.cellsize)
+    print(">>> Wrote {} voxels of {} ({:.1f} MB) to {}".format(voxels.shape, args.cellsize, voxels.nbytes/1e6, args.output))
+    for name, sel in [("outside modules", voxels == VOXEL_EMPTY), ("inside a module", voxels >= 0), ("on a boundary", voxels == VOXEL_BOUNDARY)]:
+        print(">>>   {:.2f}% {}".format(100.*sel.mean(), name))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Optional per-stage timing for the babymaker (`--profile`).
+
+`StageTimer` attributes wall time to named stages. `switch` changes the current
+top-level stage and `push`/`pop` (or `with timer.stage(...)`) time nested
+stages like the pixel lookup, whose time is then not counted in the enclosing
+stage. Per-event latencies go into a fixed log-spaced histogram, so reports
+from many jobs can just be added. The report is written as a JSON sidecar
+next to the output file, and
+
+    python profiling.py output*.perf.json
+
+merges and summarizes any number of them (e.g., from all condor jobs of a sample).
+"""
+
+from __future__ import print_function, division
+
+import os
+import json
+import socket
+import tempfile
+import argparse
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+# per-event latency histogram edges in seconds: 10 bins per decade from 1us to 10s
+LATENCY_EDGES = np.logspace(-6, 1, 71)
+
+class NullTimer(object):
+    """
+    Does nothing, so that the instrumented code costs ~nothing when not profiling
+    """
+    enabled = False
+    class _NullStage(object):
+        def __enter__(self): return self
+        def __exit__(self, *args): return False
+    _null_stage = _NullStage()
+
+    def switch(self, name): pass
+    def push(self, name): pass
+    def pop(self): pass
+    def new_event(self, n=1): pass
+    def stage(self, name): return self._null_stage
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+    def __enter__(self):
+        self.timer.push(self.name)
+        return self
+    def __exit__(self, *args):
+        self.timer.pop()
+        return False
+
+class StageTimer(object):
+    enabled = True
+
+    def __init__(self):
+        self.clock = timeit.default_timer
+        self.totals = OrderedDict()
+        self.counts = OrderedDict()
+        self.stack = [None]
+        self.tlast = self.clock()
+        self.tstart = self.tlast
+        self.tevent = None
+        self.latency_counts = np.zeros(len(LATENCY_EDGES)+1, dtype=np.int64)
+        self.nevents = 0
+        self.nlast = 0
+
+    def _charge(self):
+        now = self.clock()
+        name = self.stack[-1]
+        if name is not None:
+            self.totals[name] = self.totals.get(name, 0.) + (now - self.tlast)
+        self.tlast = now
+
+    def _enter(self, name):
+        if name is not None:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def switch(self, name):
+        self._charge()
+        self.stack[-1] = name
+        self._enter(name)
+
+    def push(self, name):
+        self._charge()
+        self.stack.append(name)
+        self._enter(name)
+
+    def pop(self):
+        self._charge()
+        self.stack.pop()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def new_event(self, n=1):
+        """
+        Mark the start of the next event (or `n` events processed together, e.g., a chunk)
+        """
+        now = self.clock()
+        if self.tevent is not None and self.nlast > 0:
+            ibin = np.searchsorted(LATENCY_EDGES, (now - self.tevent)/self.nlast)
+            self.latency_counts[ibin] += self.nlast
+            self.nevents += self.nlast
+        self.tevent = now
+        self.nlast = n
+
+    def report(self, **extra):
+        self._charge()
+        self.new_event(0)
+        report = OrderedDict()
+        report["host"] = socket.gethostname()
+        report["walltime"] = self.clock() - self.tstart
+        report["nevents_timed"] = int(self.nevents)
+        report["stages"] = OrderedDict(
+                (name, dict(total=self.totals[name], count=self.counts.get(name, 0)))
+                for name in self.totals)
+        report["latency_edges"] = LATENCY_EDGES.tolist()
+        report["latency_counts"] = self.latency_counts.tolist()
+        report.update(extra)
+        return report
+
+def timed(iterable, timer, name="read"):
+    """
+    Yield from `iterable`, starting a new event and charging the time spent
+    getting the next item (e.g., TChain::GetEntry) to stage `name`
+    """
+    it = iter(iterable)
+    while True:
+        timer.new_event()
+        timer.switch(name)
+        try:
+            item = next(it)
+        except StopIteration:
+            timer.switch(None)
+            return
+        yield item
+
+def capture_output(func):
+    """
+    Return what `func` prints from C++ (e.g., PrintCacheStats) as a string
+    """
+    import ROOT as r
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    r.gSystem.RedirectOutput(path, "w")
+    try:
+        func()
+    finally:
+        r.gSystem.RedirectOutput(getattr(r, "nullptr", 0))
+    with open(path) as fh:
+        text = fh.read()
+    os.remove(path)
+    return text
+
+def get_cache_stats(ch=None):
+    """
+    Read global I/O counters, and cache statistics of the chain's current tree if given
+    """
+    import ROOT as r
+    stats = OrderedDict()
+    stats["bytes_read"] = int(r.TFile.GetFileBytesRead())
+    stats["read_calls"] = int(r.TFile.GetFileReadCalls())
+    tree = ch.GetTree() if ch is not None else None
+    if not tree:
+        return stats
+    cache = tree.GetReadCache(tree.GetCurrentFile())
+    if cache:
+        stats["efficiency"] = cache.GetEfficiency()
+        stats["efficiency_rel"] = cache.GetEfficiencyRel()
+        stats["learn_entries"] = r.TTreeCache.GetLearnEntries()
+        stats["cache_size"] = int(cache.GetBufferSize())
+    stats["print_cache_stats"] = capture_output(tree.PrintCacheStats)
+    return stats
+
+def sidecar_name(fname_out):
+    return os.path.splitext(fname_out)[0] + ".perf.json"
+
+def write_report(report, fname_out):
+    fname = sidecar_name(fname_out)
+    with open(fname, "w") as fh:
+        json.dump(report, fh, indent=2)
+    return fname
+
+def merge_reports(reports):
+    """
+    Sum stage times, event counts and latency histograms of several reports
+    """
+    merged = OrderedDict()
+    merged["njobs"] = 0
+    merged["walltime"] = 0.
+    merged["nevents_timed"] = 0
+    merged["stages"] = OrderedDict()
+    merged["latency_edges"] = LATENCY_EDGES.tolist()
+    latency_counts = np.zeros(len(LATENCY_EDGES)+1, dtype=np.int64)
+    for report in reports:
+        merged["njobs"] += report.get("njobs", 1)
+        merged["walltime"] += report["walltime"]
+        merged["nevents_timed"] += report["nevents_timed"]
+        for name, d in report["stages"].items():
+            m = merged["stages"].setdefault(name, dict(total=0., count=0))
+            m["total"] += d["total"]
+            m["count"] += d["count"]
+        latency_counts += np.array(report["latency_counts"], dtype=np.int64)
+    merged["latency_counts"] = latency_counts.tolist()
+    return merged
+
+def latency_quantile(report, q):
+    counts = np.array(report["latency_counts"], dtype=np.float64)
+    if counts.sum() == 0: return float("nan")
+    upper_edges = np.append(LATENCY_EDGES, np.inf)
+    ibin = np.searchsorted(np.cumsum(counts)/counts.sum(), q)
+    return upper_edges[min(ibin, len(upper_edges)-1)]
+
+def print_summary(report):
+    nevents = max(report["nevents_timed"], 1)
+    print(">>> {} job(s), {} events, {:.1f}s wall time".format(report.get("njobs", 1), report["nevents_timed"], report["walltime"]))
+    print("{:<16s} {:>10s} {:>8s} {:>12s}".format("stage", "total [s]", "frac", "per evt [us]"))
+    for name, d in sorted(report["stages"].items(), key=lambda x: -x[1]["total"]):
+        print("{:<16s} {:>10.2f} {:>8.1%} {:>12.1f}".format(name, d["total"], d["total"]/max(report["walltime"], 1e-9), 1e6*d["total"]/nevents))
+    print(">>> Per-event latency quantiles (upper bin edges): " + ", ".join(
+        "{}%: {:.2g}s".format(int(100*q), latency_quantile(report, q)) for q in [0.5, 0.9, 0.99]))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge and summarize babymaker .perf.json reports")
+    parser.add_argument("reports", help="report files", nargs="+")
+    parser.add_argument("-o", "--output", help="write the merged report here", default="")
+    args = parser.parse_args()
+
+    reports = []
+    for fname in args.reports:
+        with open(fname) as fh:
+            reports.append(json.load(fh))
+    merged = merge_reports(reports)
+    print_summary(merged)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(merged, fh, indent=2)
@@ -0,0 +1,91 @@
+"""
+Closed-form version of `recalculate_phi_at_DV` from `data/propagation_utils.cc`.
+
+The transverse trajectory there is a circle traversed at constant angular
+frequency w, starting at the track reference point. Instead of stepping in
+time until the point reaches the cylinder through the DV, we intersect the
+circle with the cylinder and evaluate the momentum direction at the first
+crossing. Everything is plain numpy over arrays of muons, so the cost does
+not grow with the displacement.
+
+`bench_propagation.py` compares this against the stepped version.
+"""
+
+from __future__ import print_function, division
+
+import numpy as np
+
+# same constants as propagation_utils.cc
+BFIELD = 3.8 # Tesla
+MUON_MASS = 0.10566 # GeV
+SPEED_OF_LIGHT = 0.29979 # m/ns
+MAX_STEPS = 10000
+
+def helix_parameters(px, py, pz, charge):
+    """
+    Return transverse velocities (vx, vy) and angular frequency w, in the units of propagation_utils.cc
+    """
+    px, py, pz = (np.asarray(v, dtype=np.float64) for v in (px, py, pz))
+    charge = np.asarray(charge, dtype=np.float64)
+    pxy = np.hypot(px, py)
+    energy = np.sqrt(px**2 + py**2 + pz**2 + MUON_MASS**2)
+    vx = px/energy * SPEED_OF_LIGHT
+    vy = py/energy * SPEED_OF_LIGHT
+    with np.errstate(divide="ignore", invalid="ignore"):
+        radius = 1e3*pxy/(3.*charge*BFIELD)
+        w = np.hypot(vx, vy)/radius
+    return vx, vy, w
+
+def phi_after(vx, vy, theta):
+    """
+    Direction of the transverse momentum after turning by theta = w*t
+    """
+    return np.arctan2(vy*np.cos(theta) - vx*np.sin(theta), vy*np.sin(theta) + vx*np.cos(theta))
+
+def time_to_cylinder(refx, refy, vx, vy, w, target_rho):
+    """
+    Smallest t >= 0 where the transverse position reaches rho >= target_rho,
+    or nan if the circle never gets there
+    """
+    refx, refy, target_rho = (np.asarray(v, dtype=np.float64) for v in (refx, refy, target_rho))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # position is center + rotation(-w*t) applied to (-vy/w, vx/w)
+        a, b = vx/w, vy/w
+        cx, cy = refx + b, refy - a
+        radius = np.hypot(a, b)
+        dcenter = np.hypot(cx, cy)
+        # rho^2 = dcenter^2 + radius^2 + 2*dcenter*radius*cos(psi0 - w*t)
+        cosdelta = (target_rho**2 - dcenter**2 - radius**2)/(2.*dcenter*radius)
+        psi0 = np.arctan2(a, -b) - np.arctan2(cy, cx)
+        alpha = np.arccos(np.clip(cosdelta, -1., 1.))
+        sign = np.sign(w)
+        twopi = 2*np.pi
+        tau = np.minimum(np.mod(sign*(psi0-alpha), twopi), np.mod(sign*(psi0+alpha), twopi))
+        t = tau/np.abs(w)
+    t = np.where(np.abs(cosdelta) <= 1., t, np.nan)
+    # already outside the cylinder at the reference point
+    t = np.where(np.hypot(refx, refy) >= target_rho, 0., t)
+    return t
+
+def recalculate_phi_at_DV(refx, refy, refz, px, py, pz, charge, dvx, dvy, dt=None):
+    """
+    Vectorized `recalculate_phi_at_DV`: phi of the muon momentum where its
+    helix (from the track reference point) crosses the cylinder containing the DV.
+
+    With `dt=None`, the exact crossing is used. With a step size (0.1 in
+    propagation_utils.cc), the result of the stepped loop is reproduced instead:
+    the first sample at or beyond the crossing, advanced by one more step.
+    Trajectories that never reach the DV radius turn for MAX_STEPS+1 steps like
+    the stepped loop, or are left unchanged for `dt=None`.
+    """
+    vx, vy, w = helix_parameters(px, py, pz, charge)
+    target_rho = np.hypot(np.asarray(dvx, dtype=np.float64), np.asarray(dvy, dtype=np.float64))
+    t = time_to_cylinder(refx, refy, vx, vy, w, target_rho)
+    if dt is not None:
+        nsteps = np.minimum(np.ceil(t/dt), MAX_STEPS) + 1
+        t = np.where(np.isfinite(t), nsteps, MAX_STEPS+1)*dt
+    else:
+        t = np.where(np.isfinite(t), t, 0.)
+    with np.errstate(invalid="ignore"):
+        theta = np.where(np.isfinite(w), w*t, 0.)
+    return phi_after(vx, vy, theta)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Which input branches the babymaker actually uses, and what reading them costs.
+
+With `--audit-reads`, the event loop records which products it accesses and
+writes a .reads.json report next to the output, with the compressed and
+uncompressed size of every top-level branch, whether it was enabled and/or
+touched, and the bytes read from the files. From that report,
+
+    python readaudit.py output.reads.json --update
+
+stores the touched branches and a matching read cache size for the input
+type (data, mc, mc_hit_bs) in `data/read_profiles.json`. `Looper.init_tree`
+then enables only those branches instead of the broad wildcards.
+"""
+
+from __future__ import print_function, division
+
+import os
+import json
+import argparse
+from collections import OrderedDict
+
+DEFAULT_PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "read_profiles.json")
+
+# bounds for the automatic TTreeCache size, in bytes
+MIN_CACHE_SIZE = 5000000
+MAX_CACHE_SIZE = 200000000
+# what we used before there was any tuning
+DEFAULT_CACHE_SIZE = 30000000
+
+def get_input_type(is_mc, has_hit_info, has_bs_info):
+    if not is_mc:
+        return "data"
+    if has_hit_info and has_bs_info:
+        return "mc_hit_bs"
+    return "mc"
+
+def load_profiles(fname=DEFAULT_PROFILES):
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as fh:
+        return json.load(fh)
+
+def update_profiles(report, fname=DEFAULT_PROFILES):
+    profiles = load_profiles(fname)
+    profiles[report["input_type"]] = report["suggested"]
+    with open(fname, "w") as fh:
+        json.dump(profiles, fh, indent=2, sort_keys=True)
+    return profiles
+
+def branch_sizes(tree):
+    """
+    OrderedDict of top-level branch name -> dict of enabled status and
+    compressed/uncompressed bytes per entry (including sub-branches)
+    """
+    nentries = max(tree.GetEntries(), 1)
+    sizes = OrderedDict()
+    for b in tree.GetListOfBranches():
+        name = b.GetName()
+        sizes[name] = dict(
+                active=bool(tree.GetBranchStatus(name)),
+                zipbytes_per_event=b.GetZipBytes("*")/nentries,
+                totbytes_per_event=b.GetTotBytes("*")/nentries,
+                )
+    return sizes
+
+def cluster_entries(tree):
+    autoflush = tree.GetAutoFlush()
+    if autoflush > 0:
+        return autoflush
+    # negative autoflush is a size in (uncompressed) bytes
+    totbytes = max(tree.GetTotBytes(), 1)
+    return max(int(-autoflush*tree.GetEntries()/totbytes), 1) if autoflush < 0 else 1000
+
+def suggest_cache_size(tree, branches=None):
+    """
+    Cache size that holds one cluster of the given (default: enabled) branches
+    """
+    sizes = branch_sizes(tree)
+    if branches is None:
+        branches = [name for name, d in sizes.items() if d["active"]]
+    zipbytes = sum(sizes[name]["zipbytes_per_event"] for name in branches if name in sizes)
+    if zipbytes <= 0:
+        return DEFAULT_CACHE_SIZE
+    cachesize = int(1.1*zipbytes*cluster_entries(tree))
+    return min(max(cachesize, MIN_CACHE_SIZE), MAX_CACHE_SIZE)
+
+def match_branches(tree, names):
+    """
+    Top-level branch names for the product names used in the code
+    (EDM branches have a trailing ".")
+    """
+    branchnames = set(b.GetName() for b in tree.GetListOfBranches())
+    out = []
+    for name in names:
+        for cand in [name, name+"."]:
+            if cand in branchnames:
+                out.append(cand)
+                break
+    return sorted(out)
+
+class AccessRecorder(object):
+    """
+    Stands in for the TChain in the event loop and records which products
+    (attributes) are accessed
+    """
+
+    def __init__(self, ch):
+        self._ch = ch
+        self._touched = set()
+
+    def __getattr__(self, name):
+        self._touched.add(name)
+        return getattr(self._ch, name)
+
+    def touched(self):
+        return sorted(self._touched)
+
+def make_report(ch, touched, nevents_read, input_type, cache_stats=None):
+    """
+    Branch usage and read statistics for the current tree of `ch`
+    """
+    tree = ch.GetTree()
+    sizes = branch_sizes(tree)
+    touched = match_branches(tree, touched)
+    report = OrderedDict()
+    report["input_type"] = input_type
+    report["fname"] = tree.GetCurrentFile().GetName()
+    report["nevents_read"] = int(nevents_read)
+    if cache_stats is not None:
+        report["bytes_read"] = cache_stats.get("bytes_read")
+        report["read_calls"] = cache_stats.get("read_calls")
+    active = [name for name, d in sizes.items() if d["active"]]
+    report["zipbytes_per_event_active"] = sum(sizes[name]["zipbytes_per_event"] for name in active)
+    report["zipbytes_per_event_touched"] = sum(sizes[name]["zipbytes_per_event"] for name in touched)
+    report["bytes_decompressed_estimate"] = nevents_read*sum(sizes[name]["totbytes_per_event"] for name in active)
+    report["branches"] = [
+            OrderedDict([("name", name), ("active", d["active"]), ("touched", name in touched),
+                ("zipbytes_per_event", d["zipbytes_per_event"]), ("totbytes_per_event", d["totbytes_per_event"])])
+            for name, d in sorted(sizes.items(), key=lambda x: -x[1]["zipbytes_per_event"])
+            ]
+    report["suggested"] = OrderedDict([
+        ("branches", touched),
+        ("cachesize", suggest_cache_size(tree, touched)),
+        ])
+    return report
+
+def sidecar_name(fname_out):
+    return os.path.splitext(fname_out)[0] + ".reads.json"
+
+def print_summary(report):
+    print(">>> {} input, {} events read".format(report["input_type"], report["nevents_read"]))
+    if report.get("bytes_read") is not None:
+        print(">>> {:.1f} MB read in {} calls, ~{:.1f} MB decompressed".format(
+            report["bytes_read"]/1e6, report["read_calls"], report["bytes_decompressed_estimate"]/1e6))
+    print(">>> Compressed bytes/event: {:.0f} enabled, {:.0f} touched".format(
+        report["zipbytes_per_event_active"], report["zipbytes_per_event_touched"]))
+    print("{:<72s} {:>7s} {:>7s} {:>10s} {:>10s}".format("branch", "enabled", "touched", "zip B/evt", "tot B/evt"))
+    for d in report["branches"]:
+        if not (d["active"] or d["touched"]): continue
+        print("{:<72s} {:>7d} {:>7d} {:>10.0f} {:>10.0f}".format(d["name"], d["active"], d["touched"], d["zipbytes_per_event"], d["totbytes_per_event"]))
+    print(">>> Suggested: {} branches with a {:.1f} MB cache".format(len(report["suggested"]["branches"]), report["suggested"]["cachesize"]/1e6))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Summarize babymaker .reads.json reports and update the read profiles")
+    parser.add_argument("report", help="report file")
+    parser.add_argument("--update", help="store the suggested branches/cache size for this input type in {}".format(DEFAULT_PROFILES), action="store_true")
+    args = parser.parse_args()
+
+    with open(args.report) as fh:
+        report = json.load(fh)
+    print_summary(report)
+    if args.update:
+        update_profiles(report)
+        print(">>> Updated the {} profile in {}".format(report["input_type"], DEFAULT_PROFILES))
@@ -0,0 +1,178 @@
+"""
+Dtypes to read the babymaker output with in the analysis (`utils.make_df`).
+
+The branch types come from the `make_branch` calls in `Looper.init_branches`,
+which are read from babymaker.py without running it (no ROOT needed), so new
+branches get a read dtype as soon as they are added there:
+
+    branch_types = init_branch_types()         # name -> "f", "i", "b", "vf", ...
+    schema = make_schema(branch_types)         # name -> numpy dtype name
+
+Branches keep the width they are stored with (DEFAULT_DTYPES), except for the
+counts and small integers in NARROW_DTYPES, which are known to fit in fewer
+bytes. Booleans can be read as "bool", "uint8" or "packed", where packed
+flags are combined into uint64 bitmask columns (see `packed_columns`).
+"""
+
+from __future__ import print_function, division
+
+import os
+import ast
+from collections import OrderedDict
+
+BABYMAKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "babymaker.py")
+
+# make_branch type -> dtype of the decoded array
+DEFAULT_DTYPES = {
+        "f": "float32",
+        "b": "bool",
+        "i": "int32",
+        "l": "int64",
+        "vf": "float32",
+        "vi": "int32",
+        "vb": "bool",
+        }
+
+# analysis/utils.py keeps a copy (smaller_dtypes) for workers without the batch/ directory
+NARROW_DTYPES = OrderedDict([
+    ("dimuon_mass", "float32"),
+    ("dimuon_pt", "float32"),
+    ("DV_chi2prob", "float32"),
+    ("DV_ndof", "int8"),
+    ("DV_redchi2", "float32"),
+    ("DV_layerPixel", "int8"),
+    ("Muon1_charge", "int8"),
+    ("Muon1_excesshits", "int8"),
+    ("Muon1_m", "float32"),
+    ("Muon1_mass", "float32"),
+    ("Muon1_nExcessPixelHits", "int8"),
+    ("Muon1_nExpectedPixelHits", "int8"),
+    ("Muon1_nMatchedStations", "int8"),
+    ("Muon1_nTrackerLayersWithMeasurement", "int8"),
+    ("Muon1_nValidMuonHits", "int8"),
+    ("Muon1_nValidPixelHits", "int8"),
+    ("Muon1_nValidStripHits", "int8"),
+    ("Muon2_charge", "int8"),
+    ("Muon2_excesshits", "int8"),
+    ("Muon2_m", "float32"),
+    ("Muon2_mass", "float32"),
+    ("Muon2_nExcessPixelHits", "int8"),
+    ("Muon2_nExpectedPixelHits", "int8"),
+    ("Muon2_nMatchedStations", "int8"),
+    ("Muon2_nTrackerLayersWithMeasurement", "int8"),
+    ("Muon2_nValidMuonHits", "int8"),
+    ("Muon2_nValidPixelHits", "int8"),
+    ("Muon2_nValidStripHits", "int8"),
+    ("categ", "int8"),
+    ("luminosityBlock", "int32"),
+    ("nDV", "int8"),
+    ("nDV_good", "int8"),
+    ("nDV_raw", "int8"),
+    ("nGenMuon", "int8"),
+    ("nGenPart", "int16"),
+    ("nJet", "int8"),
+    ("nMuon", "int8"),
+    ("nMuon_good", "int8"),
+    ("nMuon_raw", "int8"),
+    ("nPV", "int8"),
+    ("nPVM", "int8"),
+    ("run", "int32"),
+    ])
+# value of the int/float branches in events where they aren't filled (`Looper.clear_branches`)
+SENTINEL = 999
+# largest value of the integer dtypes that can't hold SENTINEL
+SMALL_INTS = {"int8": 127, "uint8": 255}
+
+def holds_sentinel(name):
+    # branches that are only filled in some of the events (second pair, gen matches, BToPhi info)
+    return name.startswith(("sublead_", "BToPhi_")) or "_genMatch_" in name
+
+# the subleading pair has the same ranges, but keeps SENTINEL in events without a second DV
+for _name, _dtype in list(NARROW_DTYPES.items()):
+    if _name.startswith(("Muon1_", "Muon2_", "DV_")):
+        NARROW_DTYPES["sublead_"+_name] = "int16" if _dtype in SMALL_INTS else _dtype
+
+BOOL_MODES = ["bool", "uint8", "packed"]
+
+def _evaluate(node, env):
+    # branch name expressions: literals, loop variables and their sums
+    if isinstance(node, ast.Name) and node.id in env:
+        return env[node.id]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return _evaluate(node.left, env) + _evaluate(node.right, env)
+    return ast.literal_eval(node)
+
+def _collect(statements, env, out):
+    for stmt in statements:
+        if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call):
+            call = stmt.value
+            func = call.func
+            fname = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+            if fname != "make_branch" or not call.args: continue
+            try:
+                name = _evaluate(call.args[0], env)
+                tstr = _evaluate(call.args[1], env) if len(call.args) > 1 else "vi"
+            except ValueError:
+                continue
+            out[name] = tstr
+        elif isinstance(stmt, ast.For) and isinstance(stmt.target, ast.Name):
+            try:
+                values = _evaluate(stmt.iter, env)
+            except ValueError:
+                continue
+            for value in values:
+                inner = dict(env)
+                inner[stmt.target.id] = value
+                _collect(stmt.body, inner, out)
+        elif isinstance(stmt, ast.If):
+            # branches of all configurations (is_btophi, is_hzdzd, ...)
+            _collect(stmt.body, env, out)
+            _collect(stmt.orelse, env, out)
+
+def init_branch_types(fname=BABYMAKER):
+    """
+    OrderedDict of branch name -> `make_branch` type string for the branches made in
+    `Looper.init_branches` of `fname`, for every configuration (data/MC, BToPhi, ...).
+    Calls with names that aren't built from literals and loop variables are skipped.
+    """
+    with open(fname) as fh:
+        tree = ast.parse(fh.read(), fname)
+    out = OrderedDict()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == "init_branches":
+            _collect(node.body, {}, out)
+    return out
+
+def make_schema(branch_types=None, extra=None, bools="bool"):
+    """
+    OrderedDict of branch name -> dtype name to read with.
+    `branch_types` (default: `init_branch_types()`) gives the stored types, NARROW_DTYPES
+    and then `extra` (name -> dtype) override them, and booleans are read as `bools`
+    (one of BOOL_MODES). Raises ValueError for integer dtypes that can't hold SENTINEL
+    on branches that aren't filled in every event (`holds_sentinel`).
+    """
+    if bools not in BOOL_MODES:
+        raise ValueError("bools must be one of {}, not {}".format(BOOL_MODES, bools))
+    if branch_types is None:
+        branch_types = init_branch_types()
+    schema = OrderedDict()
+    for name, tstr in branch_types.items():
+        schema[name] = DEFAULT_DTYPES.get(tstr)
+    schema.update(NARROW_DTYPES)
+    if extra:
+        schema.update(extra)
+    for name, dtype in schema.items():
+        if holds_sentinel(name) and SENTINEL > SMALL_INTS.get(dtype, SENTINEL):
+            raise ValueError("{} is {} in events where it isn't filled, which doesn't fit in {}".format(name, SENTINEL, dtype))
+    for name, dtype in schema.items():
+        if dtype == "bool":
+            schema[name] = bools
+    return schema
+
+def packed_columns(schema):
+    """
+    OrderedDict of flag name -> (column, bit) for the "packed" booleans in `schema`,
+    64 flags per uint64 column named packed_bools0, packed_bools1, ...
+    """
+    names = [name for name, dtype in schema.items() if dtype == "packed"]
+    return OrderedDict((name, ("packed_bools{}".format(i // 64), i % 64)) for i, name in enumerate(names))
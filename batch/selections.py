@@ -0,0 +1,200 @@
+"""
+The pass_* selection flags of the babymaker, defined once.
+
+Each cut is a function of the columns of one muon pair (leading: `Muon1_`,
+`Muon2_`, `DV_`, `lxy`, ...; subleading: the same names with the `sublead_`
+prefix) and of the flags evaluated before it. Cuts only use comparisons,
+`abs` and `&`/`|`/`^`, so the same code runs on the scalars of one event in
+`Looper.run` and on whole arrays in the columnar engine, and
+
+    flags = evaluate_all(df)
+
+re-derives every flag from the columns of existing babies (dataframes or dicts
+of arrays), e.g., to study a changed cut without rerunning the babymaker.
+Flags re-derived from babies use the stored float32 columns, so events exactly
+at a threshold can differ from the babymaker in rare cases.
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+import numpy as np
+
+mask_ranges = [
+    [0.43,0.49],
+    [0.52,0.58],
+    [0.73,0.84],
+    [0.96,1.08],
+    [2.91,3.27],
+    [3.47,3.89],
+    [8.99,9.87],
+    [9.61,10.77],
+    ]
+
+# per-pair thresholds. NOTE the subleading pair is loosened wrt 2mu
+THRESHOLDS = {
+        "lead": dict(dxyscaled=0.1, dxysig=2., absdphimudv=0.02, iso="passiso"),
+        "sublead": dict(dxyscaled=0.05, dxysig=1., absdphimudv=0.1, iso="passiso4mu"),
+        }
+
+# event-level columns that the pair cuts use, read without the sublead_ prefix
+EVENT_COLUMNS = ["pass_l1"]
+
+# name -> (function of (columns, thresholds), pairs it applies to, whether it's an output branch)
+CUTS = OrderedDict()
+
+def cut(name, pairs=("lead", "sublead"), output=True):
+    def decorator(func):
+        CUTS[name] = (func, pairs, output)
+        return func
+    return decorator
+
+def in_mass_mask(mass):
+    """
+    True outside of the masked resonance windows in `mask_ranges`
+    """
+    out = True
+    for low, high in mask_ranges:
+        out = out & ((mass < low) | (mass > high))
+    return out
+
+@cut("pass_excesshits")
+def _excesshits(c, t):
+    # both muons need to have no excess hits if the displacement is >3.5cm (otherwise we're within the 1st bpix layer and extra hits don't make sense to calculate)
+    return (
+            (c["lxy"] < 3.5)
+            | ((c["Muon1_nValidPixelHits"] - c["Muon1_nExpectedPixelHits"] <= 0)
+                & (c["Muon2_nValidPixelHits"] - c["Muon2_nExpectedPixelHits"] <= 0))
+            )
+
+@cut("pass_materialveto")
+def _materialveto(c, t):
+    return c["DV_distPixel"] > 0.05
+
+@cut("pass_dxyscaled")
+def _dxyscaled(c, t):
+    scale = c["lxy"]*c["dimuon_mass"]/c["dimuon_pt"]
+    return (abs(c["Muon1_dxyCorr"]/scale) > t["dxyscaled"]) & (abs(c["Muon2_dxyCorr"]/scale) > t["dxyscaled"])
+
+@cut("pass_dxysig")
+def _dxysig(c, t):
+    return (abs(c["Muon1_dxyCorr"]/c["Muon1_dxyError"]) > t["dxysig"]) & (abs(c["Muon2_dxyCorr"]/c["Muon2_dxyError"]) > t["dxysig"])
+
+@cut("pass_baseline")
+def _baseline(c, t):
+    return (
+            c["Muon1_passid"] & c["Muon2_passid"]
+            # & (cosphi > 0) # redundant with absdphimudv cut
+            & (c["absdphimumu"] < 2.8)
+            & (c["absdphimudv"] < t["absdphimudv"])
+            & c["dimuon_isos"]
+            & c["pass_l1"]
+            & (c["lxy"] < 11.)
+            )
+
+@cut("pass_baseline_iso")
+def _baseline_iso(c, t):
+    return c["pass_baseline"] & c["Muon1_"+t["iso"]] & c["Muon2_"+t["iso"]]
+
+@cut("pass_baseline_isohalf", pairs=("lead",))
+def _baseline_isohalf(c, t):
+    return c["pass_baseline"] & (c["Muon1_"+t["iso"]] ^ c["Muon2_"+t["iso"]])
+
+# baseline+"extra" is baseline with pixel requirements and logabsetaphi<1.25
+@cut("pass_extra", output=False)
+def _extra(c, t):
+    return c["pass_excesshits"] & c["pass_materialveto"] & (c["logabsetaphi"] < 1.25)
+
+@cut("pass_baseline_extra")
+def _baseline_extra(c, t):
+    return c["pass_baseline"] & c["pass_extra"]
+
+@cut("pass_baseline_extra_iso")
+def _baseline_extra_iso(c, t):
+    return c["pass_baseline_iso"] & c["pass_extra"]
+
+@cut("pass_baseline_extra_isohalf", pairs=("lead",))
+def _baseline_extra_isohalf(c, t):
+    return c["pass_baseline_isohalf"] & c["pass_extra"]
+
+@cut("pass_all")
+def _all(c, t):
+    return c["pass_baseline_iso"] & c["pass_extra"] & c["pass_dxyscaled"] & c["pass_dxysig"]
+
+class PairColumns(object):
+    """
+    Columns of one pair by unprefixed name: flags evaluated so far, event-level
+    columns, and otherwise `cols[prefix+name]`
+    """
+
+    def __init__(self, cols, prefix, flags):
+        self.cols = cols
+        self.prefix = prefix
+        self.flags = flags
+
+    def __getitem__(self, name):
+        if name in self.flags:
+            return self.flags[name]
+        if name in EVENT_COLUMNS:
+            return self.cols[name]
+        return self.cols[self.prefix+name]
+
+def evaluate(cols, which="lead", names=None, prefix=None):
+    """
+    OrderedDict of flag name (without prefix) -> value for the `which` ("lead"
+    or "sublead") pair, including the internal ones (e.g., pass_extra).
+    `names` restricts it to those flags (and the ones they use, which must
+    come before them in `CUTS`). The pair columns are read with `prefix`
+    (default: "" for lead and "sublead_" for sublead)
+    """
+    if prefix is None:
+        prefix = "" if which == "lead" else "sublead_"
+    thresholds = THRESHOLDS[which]
+    flags = OrderedDict()
+    c = PairColumns(cols, prefix, flags)
+    for name, (func, pairs, _) in CUTS.items():
+        if which not in pairs: continue
+        flags[name] = func(c, thresholds)
+        if names is not None and all(x in flags for x in names): break
+    return flags
+
+def evaluate_fourmu(mass_pair1, mass_pair2, fourmuon_mass, lead_pass_all, sublead_pass_all):
+    """
+    (pass_fourmu, pass_fourmu_nomask)
+    """
+    common = (
+            (abs(mass_pair1 - mass_pair2) < 0.05*(mass_pair1 + mass_pair2)/2.)
+            & lead_pass_all
+            & sublead_pass_all
+            & (115 < fourmuon_mass) & (fourmuon_mass < 135)
+            )
+    return common & in_mass_mask(mass_pair1) & in_mass_mask(mass_pair2), common
+
+def output_names(which="lead"):
+    prefix = "" if which == "lead" else "sublead_"
+    return [prefix+name for name, (_, pairs, output) in CUTS.items() if output and which in pairs]
+
+def evaluate_all(cols):
+    """
+    All pass_* flags of the babymaker output (except pass_l1 and the gen matching)
+    from baby columns, as an OrderedDict of branch name -> array. Pairs that
+    weren't filled (lxy/sublead_lxy at the 999 default) fail everything, like
+    in the babymaker.
+    """
+    out = OrderedDict()
+    has_pair = {}
+    for which in ["lead", "sublead"]:
+        prefix = "" if which == "lead" else "sublead_"
+        has_pair[which] = np.asarray(cols[prefix+"lxy"]) != 999
+        with np.errstate(divide="ignore", invalid="ignore"):
+            flags = evaluate(cols, which)
+        for name in output_names(which):
+            out[name] = np.asarray(flags[name[len(prefix):]], dtype=bool) & has_pair[which]
+    has_both = has_pair["lead"] & has_pair["sublead"]
+    pass_fourmu, pass_fourmu_nomask = evaluate_fourmu(
+            np.asarray(cols["dimuon_mass"]), np.asarray(cols["sublead_dimuon_mass"]), np.asarray(cols["FourMuon_mass"]),
+            out["pass_all"], out["sublead_pass_all"])
+    out["pass_fourmu"] = has_both & pass_fourmu
+    out["pass_fourmu_nomask"] = has_both & pass_fourmu_nomask
+    return out
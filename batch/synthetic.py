@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+"""
+Small synthetic Scouting inputs for testing and benchmarking the babymaker
+without grid access:
+
+    python synthetic.py -o synthetic_Run2018_data.root -n 5000
+    python synthetic.py -o synthetic_BToPhi_Run2018_mc.root -n 5000 --mc --grandmother-id 521 --hit-info
+    python synthetic.py -o displaced.root --ndv 2 --lxy-dist flat --lxy 11
+
+Events get a Poisson number of displaced vertices, each with a dimuon from
+the decay of a particle of mass `--mass` flying along the DV direction, plus
+extra prompt muons, calo jets, primary vertices, MET/rho, the L1 seeds and
+HLT bit from the triggerMaker, and optionally the per-muon expected pixel hits
+(hitMaker), the beamspot (beamSpotMaker) and, with `--mc`, the gen record.
+The products are written like EDM branches (`edm::Wrapper`s, split), so the
+babymaker and the columnar engine read them like the real thing. Writing
+needs the CMSSW dictionaries (DataFormats/Scouting, reco::GenParticle), i.e.,
+a CMSSW environment. The babymaker picks the year and the gen-info side trees
+from the file name, as usual.
+"""
+
+from __future__ import print_function, division
+
+import os
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+# generator settings (see --help for the meaning), overridden from the command line
+DEFAULTS = OrderedDict([
+    ("ndv", 1.2),
+    ("nextramuons", 0.5),
+    ("njets", 3.),
+    ("npv", 20.),
+    ("lxy_dist", "exp"),
+    ("lxy", 1.),
+    ("mass", 2.),
+    ("ptmin", 5.),
+    ("ptscale", 15.),
+    ("l1rate", 0.7),
+    ("events_per_lumi", 500),
+    ("year", 2018),
+    ("mother_id", 6000211),
+    ("grandmother_id", 0),
+    ])
+
+L1_SEEDS = [
+        "L1_DoubleMu4_SQ_OS_dR_Max1p2", "L1_DoubleMu4p5_SQ_OS_dR_Max1p2",
+        "L1_DoubleMu0er1p4_SQ_OS_dR_Max1p4", "L1_DoubleMu_15_7",
+        "L1_SingleMu22", "L1_DoubleMu_12_5", "L1_HTT200er",
+        ]
+# roughly the beamspots of the years, and a typical run
+BEAMSPOTS = {2017: (0.085, -0.033, 0.3), 2018: (0.097, -0.062, 0.)}
+DATA_RUNS = {2017: 305112, 2018: 320500}
+# radii of the pixel barrel layers (Phase 1), for the hit counts
+PIXEL_RADII = np.array([2.9, 6.8, 10.9, 16.0])
+MUON_MASS = 0.10566
+
+def draw_lxy(rng, dist, scale, n):
+    if dist == "exp":
+        return rng.exponential(scale, n)
+    if dist == "flat":
+        return rng.uniform(0., scale, n)
+    raise ValueError("Unknown displacement distribution {} (choose from exp, flat)".format(dist))
+
+def p4_from_ptetaphim(pt, eta, phi, mass):
+    px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+    return np.stack([px, py, pz, np.sqrt(px**2+py**2+pz**2+mass**2)], axis=-1)
+
+def two_body(rng, parent, mass, mdaughter=MUON_MASS):
+    """
+    (n, 4) arrays of (px, py, pz, E) for the two daughters of the `parent` four-vectors
+    of mass `mass`, decaying isotropically in the rest frame
+    """
+    n = len(parent)
+    pstar = np.sqrt(np.maximum(mass**2/4 - mdaughter**2, 0.))
+    costh = rng.uniform(-1., 1., n)
+    sinth = np.sqrt(1. - costh**2)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    prest = np.stack([pstar*sinth*np.cos(phi), pstar*sinth*np.sin(phi), pstar*costh], axis=-1)
+    erest = np.sqrt(pstar**2 + mdaughter**2)*np.ones(n)
+    beta = parent[:,:3]/parent[:,3:]
+    beta2 = np.maximum((beta**2).sum(axis=-1), 1e-12)
+    gamma = 1./np.sqrt(1. - np.minimum(beta2, 1.-1e-12))
+    bp = (beta*prest).sum(axis=-1)
+    p = prest + (((gamma-1.)*bp/beta2)[:,None] + (gamma*erest)[:,None])*beta
+    d1 = np.concatenate([p, (gamma*(erest + bp))[:,None]], axis=-1)
+    return d1, parent - d1
+
+def ptetaphi(p4):
+    pt = np.hypot(p4[:,0], p4[:,1])
+    return pt, np.arcsinh(p4[:,2]/pt), np.arctan2(p4[:,1], p4[:,0])
+
+def local_index(evt, counts):
+    """
+    Index of each element within its event, for elements ordered by event
+    """
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return np.arange(len(evt)) - offsets[evt]
+
+def generate(nevents, config=DEFAULTS, seed=42):
+    """
+    OrderedDict of columns for `nevents` events: per-event arrays (`event`,
+    `nMuon`, `MET_pt`, `l1result`, ...) and flat arrays for the collections
+    (`Muon_pt`, `DV_x`, ...), ordered by event. `Pair_*` columns are the gen-level
+    parents and daughters of the DVs (one pair per DV, in the same order).
+    """
+    cfg = dict(DEFAULTS)
+    cfg.update(config)
+    rng = np.random.RandomState(seed)
+    bsx, bsy, bsz = BEAMSPOTS[cfg["year"]]
+    out = OrderedDict()
+
+    out["event"] = np.arange(1, nevents+1, dtype=np.uint64)
+    out["luminosityBlock"] = 1 + (np.arange(nevents)//max(int(cfg["events_per_lumi"]), 1)).astype(np.uint32)
+    out["BS_x"] = np.full(nevents, bsx, dtype=np.float32)
+    out["BS_y"] = np.full(nevents, bsy, dtype=np.float32)
+    out["BS_z"] = np.full(nevents, bsz, dtype=np.float32)
+    out["MET_pt"] = rng.exponential(30., nevents)
+    out["MET_phi"] = rng.uniform(-np.pi, np.pi, nevents)
+    out["rho"] = rng.exponential(8., nevents)
+    out["l1result"] = rng.uniform(size=(nevents, len(L1_SEEDS))) < cfg["l1rate"]
+
+    # primary vertices, first one is the hard scatter
+    npv = np.maximum(rng.poisson(cfg["npv"], nevents), 1)
+    pvevt = np.repeat(np.arange(nevents), npv)
+    out["nPV"] = npv
+    out["PV_x"] = bsx + rng.normal(0., 0.001, len(pvevt))
+    out["PV_y"] = bsy + rng.normal(0., 0.001, len(pvevt))
+    out["PV_z"] = bsz + rng.normal(0., 3.5, len(pvevt))
+    out["PV_tracksSize"] = rng.poisson(15, len(pvevt)) + 2
+    ipv0 = np.concatenate([[0], np.cumsum(npv)[:-1]])
+    pvx, pvy, pvz = out["PV_x"][ipv0], out["PV_y"][ipv0], out["PV_z"][ipv0]
+
+    # DVs and their (gen-level) dimuon pairs
+    ndv = rng.poisson(cfg["ndv"], nevents)
+    dvevt = np.repeat(np.arange(nevents), ndv)
+    n = len(dvevt)
+    lxy = draw_lxy(rng, cfg["lxy_dist"], cfg["lxy"], n)
+    parent = p4_from_ptetaphim(cfg["ptmin"] + rng.exponential(cfg["ptscale"], n),
+            rng.uniform(-2., 2., n), rng.uniform(-np.pi, np.pi, n), cfg["mass"])
+    ppt, peta, pphi = ptetaphi(parent)
+    vx = bsx + lxy*np.cos(pphi)
+    vy = bsy + lxy*np.sin(pphi)
+    vz = pvz[dvevt] + lxy*np.sinh(peta)
+    mu1, mu2 = two_body(rng, parent, cfg["mass"])
+    out["nDV"] = ndv
+    out["DV_x"], out["DV_y"], out["DV_z"] = vx, vy, vz
+    out["DV_xError"] = 0.002 + 0.005*lxy*rng.uniform(0.5, 1.5, n)
+    out["DV_yError"] = 0.002 + 0.005*lxy*rng.uniform(0.5, 1.5, n)
+    out["DV_zError"] = 0.005 + 0.01*lxy*rng.uniform(0.5, 1.5, n)
+    out["DV_chi2"] = rng.chisquare(1, n)
+    out["DV_ndof"] = np.ones(n, dtype=np.int32)
+    out["DV_tracksSize"] = np.full(n, 2, dtype=np.int32)
+    out["Pair_parent"] = parent
+    out["Pair_mu1"] = mu1
+    out["Pair_mu2"] = mu2
+    out["Pair_pvz"] = pvz[dvevt]
+
+    # reco muons: two per DV (slightly smeared), then some prompt ones
+    nextra = rng.poisson(cfg["nextramuons"], nevents)
+    xevt = np.repeat(np.arange(nevents), nextra)
+    nx = len(xevt)
+    mevt = np.concatenate([dvevt, dvevt, xevt])
+    order = np.argsort(mevt, kind="mergesort")
+    mevt = mevt[order]
+    gen = np.concatenate([mu1, mu2, p4_from_ptetaphim(3. + rng.exponential(5., nx),
+        rng.uniform(-2.4, 2.4, nx), rng.uniform(-np.pi, np.pi, nx), MUON_MASS)])[order]
+    pt, eta, phi = ptetaphi(gen)
+    m = len(mevt)
+    pt = pt*(1. + rng.normal(0., 0.01, m))
+    charge = np.concatenate([-np.ones(n), np.ones(n), rng.choice([-1., 1.], nx)])[order].astype(np.int32)
+    dv_local = local_index(dvevt, ndv)
+    vtxindx = np.concatenate([dv_local, dv_local, -np.ones(nx, dtype=np.int64)])[order]
+    mvx = np.concatenate([vx, vx, pvx[xevt]])[order]
+    mvy = np.concatenate([vy, vy, pvy[xevt]])[order]
+    mvz = np.concatenate([vz, vz, pvz[xevt]])[order]
+    mlxy = np.hypot(mvx-bsx, mvy-bsy)
+    out["nMuon"] = np.bincount(mevt, minlength=nevents)
+    out["Muon_pt"], out["Muon_eta"], out["Muon_phi"] = pt, eta, phi
+    out["Muon_charge"] = charge
+    out["Muon_vtxIndx"] = vtxindx
+    out["Muon_dxy"] = (-(mvx-bsx)*np.sin(phi) + (mvy-bsy)*np.cos(phi)) + rng.normal(0., 0.002, m)
+    out["Muon_dz"] = (mvz - pvz[mevt]) - ((mvx-bsx)*np.cos(phi) + (mvy-bsy)*np.sin(phi))*np.sinh(eta) + rng.normal(0., 0.005, m)
+    out["Muon_dxyError"] = 0.001 + 0.002*rng.exponential(1., m)
+    out["Muon_dzError"] = 0.002 + 0.004*rng.exponential(1., m)
+    npix = (PIXEL_RADII[None,:] > mlxy[:,None]).sum(axis=1)
+    out["Muon_nValidPixelHits"] = np.maximum(npix - (rng.uniform(size=m) < 0.1), 0).astype(np.int32)
+    out["Muon_nExpectedPixelHits"] = npix.astype(np.int32)
+    out["Muon_nTrackerLayersWithMeasurement"] = (npix + rng.randint(6, 11, m)).astype(np.int32)
+    out["Muon_nValidStripHits"] = (out["Muon_nTrackerLayersWithMeasurement"] - npix + rng.randint(0, 5, m)).astype(np.int32)
+    out["Muon_nValidMuonHits"] = rng.randint(10, 40, m).astype(np.int32)
+    out["Muon_nMatchedStations"] = rng.randint(1, 5, m).astype(np.int32)
+    out["Muon_ndof"] = (out["Muon_nValidMuonHits"] + out["Muon_nValidStripHits"] + out["Muon_nValidPixelHits"] - 5).astype(np.float32)
+    out["Muon_chi2"] = out["Muon_ndof"]*rng.uniform(0.5, 1.5, m)
+    out["Muon_trackIso"] = rng.exponential(1., m)
+    out["Muon_trk_qoverp"] = charge/(pt*np.cosh(eta))
+    out["Muon_trk_lambda"] = np.arctan(np.sinh(eta))
+    out["Muon_trk_dsz"] = out["Muon_dz"]*np.cos(out["Muon_trk_lambda"])
+    out["Muon_trk_qoverpError"] = 0.01*np.abs(out["Muon_trk_qoverp"])
+    out["Muon_trk_lambdaError"] = np.full(m, 1e-3)
+    out["Muon_trk_phiError"] = np.full(m, 1e-3)
+    out["Muon_trk_dszError"] = out["Muon_dzError"]
+
+    # calo jets
+    njet = rng.poisson(cfg["njets"], nevents)
+    nj = njet.sum()
+    out["nJet"] = njet
+    out["Jet_pt"] = 20. + rng.exponential(30., nj)
+    out["Jet_eta"] = rng.uniform(-3., 3., nj)
+    out["Jet_phi"] = rng.uniform(-np.pi, np.pi, nj)
+    out["Jet_m"] = out["Jet_pt"]*rng.uniform(0.05, 0.2, nj)
+    out["Jet_mvaDiscriminator"] = rng.uniform(-1., 1., nj)
+    out["Jet_btagDiscriminator"] = rng.uniform(0., 1., nj)
+    return out
+
+class SyntheticWriter(object):
+    """
+    Writes `generate` columns into an EDM-like Events tree. Needs PyROOT with
+    the CMSSW dictionaries.
+    """
+
+    UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "synthetic_utils.cc")
+    PRODUCTS = [
+            # (branch name, wrapped type)
+            ("ScoutingMuons_hltScoutingMuonPackerCalo__HLT", "vector<ScoutingMuon>"),
+            ("ScoutingVertexs_hltScoutingMuonPackerCalo_displacedVtx_HLT", "vector<ScoutingVertex>"),
+            ("ScoutingVertexs_hltScoutingPrimaryVertexPackerCaloMuon_primaryVtx_HLT", "vector<ScoutingVertex>"),
+            ("ScoutingCaloJets_hltScoutingCaloPacker__HLT", "vector<ScoutingCaloJet>"),
+            ("double_hltScoutingCaloPacker_caloMetPt_HLT", "double"),
+            ("double_hltScoutingCaloPacker_caloMetPhi_HLT", "double"),
+            ("double_hltScoutingCaloPacker_rho_HLT", "double"),
+            ("Strings_triggerMaker_l1name_SLIM", "vector<string>"),
+            ("bools_triggerMaker_l1result_SLIM", "vector<bool>"),
+            ("bools_triggerMaker_hltresult_SLIM", "vector<bool>"),
+            ]
+    HIT_PRODUCTS = [("ints_hitMaker_nexpectedhitsmultiple_SLIM", "vector<int>")]
+    BS_PRODUCTS = [
+            ("float_beamSpotMaker_x_SLIM", "float"),
+            ("float_beamSpotMaker_y_SLIM", "float"),
+            ("float_beamSpotMaker_z_SLIM", "float"),
+            ]
+    GEN_PRODUCTS = [("recoGenParticles_genParticles__HLT", "vector<reco::GenParticle>")]
+
+    def __init__(self, fname, is_mc=False, hit_info=False, bs_info=True, config=DEFAULTS):
+        import ROOT as r
+        self.r = r
+        r.gROOT.ProcessLine(".L {}".format(self.UTILS))
+        self.is_mc = is_mc
+        self.hit_info = hit_info
+        self.bs_info = bs_info
+        self.cfg = dict(DEFAULTS)
+        self.cfg.update(config)
+        self.run = 1 if is_mc else DATA_RUNS[self.cfg["year"]]
+        self.ctor_args = {}
+
+        self.tfile = r.TFile(fname, "RECREATE")
+        self.tree = r.TTree("Events", "")
+        self.aux = r.edm.EventAuxiliary()
+        self.tree.Branch("EventAuxiliary", "edm::EventAuxiliary", self.aux, 32000, 99)
+        products = list(self.PRODUCTS)
+        if hit_info: products += self.HIT_PRODUCTS
+        if bs_info: products += self.BS_PRODUCTS
+        if is_mc: products += self.GEN_PRODUCTS
+        self.wrappers = OrderedDict()
+        for name, typename in products:
+            wrapper = r.edm.Wrapper(typename)()
+            self.tree.Branch(name+".", "edm::Wrapper<{}>".format(typename), wrapper, 32000, 99)
+            self.wrappers[name] = wrapper
+        self.l1names = r.std.vector("string")()
+        for name in L1_SEEDS:
+            self.l1names.push_back(name)
+
+    def constructor_args(self, classname):
+        """
+        (name, type) of the arguments of the longest constructor, from the
+        dictionary, since the member lists differ between CMSSW versions
+        """
+        if classname not in self.ctor_args:
+            tclass = self.r.TClass.GetClass(classname)
+            ctors = [m for m in tclass.GetListOfMethods() if m.GetName() == classname]
+            args = max(([(a.GetName(), a.GetTypeName()) for a in m.GetListOfMethodArgs()] for m in ctors), key=len)
+            self.ctor_args[classname] = args
+        return self.ctor_args[classname]
+
+    def make_object(self, classname, values):
+        """
+        `classname` object with constructor arguments taken from `values` by name
+        (0 or empty for the ones not given)
+        """
+        args = []
+        for name, typename in self.constructor_args(classname):
+            if "vector" in typename:
+                vec = self.r.std.vector(typename.split("<", 1)[1].rsplit(">", 1)[0].strip())()
+                for x in values.get(name, []):
+                    vec.push_back(x)
+                args.append(vec)
+            elif typename in ["float", "double"]:
+                args.append(float(values.get(name, 0.)))
+            elif typename == "bool":
+                args.append(bool(values.get(name, True)))
+            else:
+                args.append(int(values.get(name, 0)))
+        return getattr(self.r, classname)(*args)
+
+    def make_collection(self, classname, cols, prefix, lo, hi, extra=None):
+        r = self.r
+        vec = r.std.vector(classname)()
+        names = [(k, k[len(prefix):]) for k in cols if k.startswith(prefix)]
+        for i in range(lo, hi):
+            values = dict((member, cols[k][i]) for k, member in names)
+            if extra is not None:
+                values.update(extra(i))
+            vec.push_back(self.make_object(classname, values))
+        return vec
+
+    def set_product(self, name, obj):
+        self.r.set_wrapper(self.wrappers[name], obj)
+
+    def make_gen(self, cols, lo, hi):
+        """
+        Proton and gluon, then per DV the (optional) grandmother, the parent and
+        its two muons, with the muons produced at the DV
+        """
+        r = self.r
+        parts = r.std.vector("reco::GenParticle")()
+        r.add_gen_particle(parts, 1, 0., 0., 6500., 6500., 0., 0., 0., 2212, 4, -1)
+        r.add_gen_particle(parts, 0, 0., 0., 100., 100., 0., 0., 0., 21, 21, 0)
+        gmid, mid = int(self.cfg["grandmother_id"]), int(self.cfg["mother_id"])
+        for i in range(lo, hi):
+            parent = cols["Pair_parent"][i]
+            pv = (float(cols["BS_x"][0]), float(cols["BS_y"][0]), float(cols["Pair_pvz"][i]))
+            dv = (float(cols["DV_x"][i]), float(cols["DV_y"][i]), float(cols["DV_z"][i]))
+            imother = 1
+            if gmid:
+                # B meson-like grandmother with some extra momentum along the parent
+                gm = parent*1.5
+                gm[3] = np.sqrt((gm[:3]**2).sum() + 5.279**2)
+                r.add_gen_particle(parts, 0, *(list(map(float, gm)) + list(pv) + [gmid, 2, 1]))
+                imother = parts.size()-1
+            r.add_gen_particle(parts, 0, *(list(map(float, parent)) + list(pv) + [mid, 2, imother]))
+            iparent = parts.size()-1
+            r.add_gen_particle(parts, -1, *(list(map(float, cols["Pair_mu1"][i])) + list(dv) + [13, 1, iparent]))
+            r.add_gen_particle(parts, 1, *(list(map(float, cols["Pair_mu2"][i])) + list(dv) + [-13, 1, iparent]))
+        return parts
+
+    def write(self, cols):
+        r = self.r
+        nevents = len(cols["event"])
+        offsets = dict((coll, np.concatenate([[0], np.cumsum(cols["n"+coll])]))
+                for coll in ["Muon", "DV", "PV", "Jet"])
+        vtxindx = lambda i: {"vtxIndx": [int(cols["Muon_vtxIndx"][i])] if cols["Muon_vtxIndx"][i] >= 0 else []}
+        hltresult = r.std.vector("bool")()
+        hltresult.push_back(True)
+        for ievt in range(nevents):
+            r.set_aux(self.aux, self.run, int(cols["luminosityBlock"][ievt]), int(cols["event"][ievt]), not self.is_mc)
+            mlo, mhi = offsets["Muon"][ievt], offsets["Muon"][ievt+1]
+            dlo, dhi = offsets["DV"][ievt], offsets["DV"][ievt+1]
+            self.set_product("ScoutingMuons_hltScoutingMuonPackerCalo__HLT",
+                    self.make_collection("ScoutingMuon", cols, "Muon_", mlo, mhi,
+                        extra=lambda i: dict(vtxindx(i), m=MUON_MASS, trk_pt=cols["Muon_pt"][i],
+                            trk_eta=cols["Muon_eta"][i], trk_phi=cols["Muon_phi"][i])))
+            self.set_product("ScoutingVertexs_hltScoutingMuonPackerCalo_displacedVtx_HLT",
+                    self.make_collection("ScoutingVertex", cols, "DV_", dlo, dhi))
+            self.set_product("ScoutingVertexs_hltScoutingPrimaryVertexPackerCaloMuon_primaryVtx_HLT",
+                    self.make_collection("ScoutingVertex", cols, "PV_", offsets["PV"][ievt], offsets["PV"][ievt+1]))
+            self.set_product("ScoutingCaloJets_hltScoutingCaloPacker__HLT",
+                    self.make_collection("ScoutingCaloJet", cols, "Jet_", offsets["Jet"][ievt], offsets["Jet"][ievt+1]))
+            self.set_product("double_hltScoutingCaloPacker_caloMetPt_HLT", float(cols["MET_pt"][ievt]))
+            self.set_product("double_hltScoutingCaloPacker_caloMetPhi_HLT", float(cols["MET_phi"][ievt]))
+            self.set_product("double_hltScoutingCaloPacker_rho_HLT", float(cols["rho"][ievt]))
+            self.set_product("Strings_triggerMaker_l1name_SLIM", self.l1names)
+            l1result = r.std.vector("bool")()
+            for bit in cols["l1result"][ievt]:
+                l1result.push_back(bool(bit))
+            self.set_product("bools_triggerMaker_l1result_SLIM", l1result)
+            self.set_product("bools_triggerMaker_hltresult_SLIM", hltresult)
+            if self.hit_info:
+                hits = r.std.vector("int")()
+                for n in cols["Muon_nExpectedPixelHits"][mlo:mhi]:
+                    hits.push_back(int(n))
+                self.set_product("ints_hitMaker_nexpectedhitsmultiple_SLIM", hits)
+            if self.bs_info:
+                for coord in "xyz":
+                    self.set_product("float_beamSpotMaker_{}_SLIM".format(coord), float(cols["BS_"+coord][ievt]))
+            if self.is_mc:
+                self.set_product("recoGenParticles_genParticles__HLT", self.make_gen(cols, dlo, dhi))
+            self.tree.Fill()
+        return nevents
+
+    def close(self):
+        self.tfile.cd()
+        self.tree.Write()
+        self.tfile.Close()
+
+def make_file(fname, nevents, is_mc=False, hit_info=False, bs_info=True, config=DEFAULTS, seed=42):
+    cols = generate(nevents, config=config, seed=seed)
+    writer = SyntheticWriter(fname, is_mc=is_mc, hit_info=hit_info, bs_info=bs_info, config=config)
+    writer.write(cols)
+    writer.close()
+    return cols
+
+def add_config_args(parser):
+    helps = dict(
+            ndv="mean number of displaced vertices (dimuons) per event",
+            nextramuons="mean number of extra prompt muons per event",
+            njets="mean number of calo jets per event",
+            npv="mean number of primary vertices per event",
+            lxy_dist="transverse displacement distribution of the DVs (exp or flat)",
+            lxy="mean (exp) or maximum (flat) transverse displacement in cm",
+            mass="mass of the DV dimuon parent in GeV",
+            ptmin="minimum pT of the parent in GeV",
+            ptscale="exponential slope of the parent pT above ptmin in GeV",
+            l1rate="probability for each L1 seed to fire",
+            events_per_lumi="events per lumisection",
+            year="year (2017 or 2018), for the beamspot and the run number",
+            mother_id="gen pdgId of the parent (--mc)",
+            grandmother_id="gen pdgId of a grandmother of the dimuon, e.g., 521 for BToPhi (--mc, 0 for none)",
+            )
+    for name, default in DEFAULTS.items():
+        parser.add_argument("--"+name.replace("_", "-"), dest=name, help=helps[name], default=default, type=type(default))
+
+def get_config(args):
+    return OrderedDict((name, getattr(args, name)) for name in DEFAULTS)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Write a small synthetic Scouting input file")
+    parser.add_argument("-o", "--output", help="output file (the babymaker picks the year and signal type from the name)", default="synthetic_Run2018.root", type=str)
+    parser.add_argument("-n", "--nevents", help="number of events", default=5000, type=int)
+    parser.add_argument("--mc", help="write MC (gen particles, run 1)", action="store_true")
+    parser.add_argument("--hit-info", help="write the hitMaker expected hits", action="store_true")
+    parser.add_argument("--no-bs-info", help="don't write the beamSpotMaker beamspot", action="store_true")
+    parser.add_argument("--seed", help="random seed", default=42, type=int)
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    cols = make_file(args.output, args.nevents, is_mc=args.mc, hit_info=args.hit_info, bs_info=not args.no_bs_info,
+            config=get_config(args), seed=args.seed)
+    print(">>> Wrote {} events with {} DVs and {} muons to {}".format(args.nevents, cols["nDV"].sum(), cols["nMuon"].sum(), args.output))
@@ -0,0 +1,240 @@
+"""
+Buffered writers for the output trees of the babymaker.
+"""
+
+from __future__ import print_function
+
+import os
+import array
+from collections import OrderedDict
+
+import numpy as np
+import ROOT as r
+
+FILL_UTILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fill_utils.cc")
+
+class SideTreeWriter(object):
+    """
+    Accumulates flat records (dicts of branch name without `prefix` -> value)
+    for a small side tree (btophitree, etc.) in typed arrays, and fills them into
+    the TTree in bulk every `flush_every` records and on `write()`.
+
+    `schema` is an ordered list of (name, typecode) with array typecodes ("i",
+    "f", "l", ...). Like the per-event records this replaces, branches that are
+    missing from a record keep the value from the previous record (initially 999).
+    `compression` is a ROOT compression setting for all branches (see compression.py).
+    """
+
+    def __init__(self, treename, prefix, schema, tfile=None, flush_every=10000, compression=None):
+        self.treename = treename
+        self.prefix = prefix
+        self.schema = list(schema)
+        self.tfile = tfile
+        self.flush_every = flush_every
+        self.compression = compression
+        self.current = OrderedDict((name, 999) for name, _ in self.schema)
+        self.columns = OrderedDict((name, array.array(tstr)) for name, tstr in self.schema)
+        self.tree = None
+        self.buffers = OrderedDict()
+        self.nrecords = 0
+
+    def __len__(self):
+        return self.nrecords
+
+    def fill(self, record):
+        current = self.current
+        for k, v in record.items():
+            if k not in current:
+                raise KeyError("{} has no branch {}{}".format(self.treename, self.prefix, k))
+            current[k] = v
+        for name, column in self.columns.items():
+            column.append(current[name])
+        self.nrecords += 1
+        if self.nrecords % self.flush_every == 0:
+            self.flush()
+
+    def fill_columns(self, nrecords, columns, present=None):
+        """
+        `fill` for `nrecords` records at once (columnar engine). `columns` maps branch
+        names to arrays of values, and `present` optionally maps some of them to masks
+        of the records that have the value. Other records (and branches missing from
+        `columns`) keep the value from the previous record.
+        """
+        present = present or {}
+        current = self.current
+        for k in columns:
+            if k not in current:
+                raise KeyError("{} has no branch {}{}".format(self.treename, self.prefix, k))
+        for (name, tstr), column in zip(self.schema, self.columns.values()):
+            if name not in columns:
+                column.extend([current[name]]*nrecords)
+                continue
+            values = np.asarray(columns[name])
+            mask = present.get(name)
+            if mask is not None:
+                # index of the last record at or before each one that has the value
+                last = np.maximum.accumulate(np.where(mask, np.arange(nrecords), -1))
+                values = np.where(last >= 0, values[np.maximum(last, 0)], current[name])
+            values = values.astype(np.float64 if tstr in "fd" else np.int64).tolist()
+            column.extend(values)
+            if nrecords:
+                current[name] = values[-1]
+        nprev = self.nrecords
+        self.nrecords += nrecords
+        if self.nrecords // self.flush_every > nprev // self.flush_every:
+            self.flush()
+
+    def make_tree(self):
+        if self.tfile is not None:
+            self.tfile.cd()
+        self.tree = r.TTree(self.treename, "")
+        for name, tstr in self.schema:
+            obj = array.array(tstr, [999])
+            fullname = self.prefix + name
+            branch = self.tree.Branch(fullname, obj, "{}/{}".format(fullname, tstr.upper()))
+            if self.compression is not None:
+                branch.SetCompressionSettings(self.compression)
+            self.buffers[name] = obj
+
+    def flush(self):
+        if self.tree is None:
+            self.make_tree()
+        pairs = [(self.buffers[name], column) for name, column in self.columns.items()]
+        nrows = len(pairs[0][1]) if pairs else 0
+        fill = self.tree.Fill
+        for i in range(nrows):
+            for buf, column in pairs:
+                buf[0] = column[i]
+            fill()
+        for name, tstr in self.schema:
+            self.columns[name] = array.array(tstr)
+
+    def write(self):
+        self.flush()
+        self.tree.Write()
+
+    def reset(self, tfile):
+        # continue with a new tree in `tfile` (e.g., the next output file), keeping the carry-over values
+        self.tfile = tfile
+        self.tree = None
+        self.buffers = OrderedDict()
+
+class EventsWriter(object):
+    """
+    Buffers whole events for a tree made with `Looper.make_branch` and fills
+    them in bulk through the compiled `ColumnFiller` in `data/fill_utils.cc`,
+    so that there is no python work per entry.
+
+    `schema` maps branch names to the `make_branch` type strings and `buffers`
+    to the objects the branches were made with (`Looper.schema`, `Looper.branches`).
+    Columns are given to `append` as arrays (scalars) or objects with flat
+    `content` and per-event `offsets` (vectors). Missing columns get the
+    `clear_branches` defaults: 999 for f/i/l, 0 (False) for b, empty vectors.
+
+    With `rows=True`, the event loop sets the branch buffers itself instead:
+    `clear_row` resets them to the defaults, and `append_row` stores them as the
+    next entry, both in one compiled call, and the entries are filled in bulk.
+    """
+
+    SCALAR_DTYPES = {"f": np.float32, "b": np.int8, "i": np.int32, "l": np.uint64}
+    VECTOR_DTYPES = {"vf": np.float32, "vi": np.int32}
+    loaded = False
+
+    def __init__(self, tree, schema, buffers, capacity=10000, rows=False):
+        for name, tstr in schema.items():
+            if tstr not in self.SCALAR_DTYPES and tstr not in self.VECTOR_DTYPES:
+                raise ValueError("Branch {} has type {}, which EventsWriter can't fill".format(name, tstr))
+        self.tree = tree
+        self.schema = schema
+        self.buffers = buffers
+        self.capacity = int(capacity)
+        self.rows = rows
+        self.size = 0
+        # the rows are staged by the filler, so the columns are only needed for `append`
+        ncolumns = 0 if rows else self.capacity
+        self.scalars = OrderedDict(
+                (name, np.empty(ncolumns, dtype=self.SCALAR_DTYPES[tstr]))
+                for name, tstr in schema.items() if tstr in self.SCALAR_DTYPES)
+        self.counts = OrderedDict(
+                (name, np.zeros(ncolumns, dtype=np.int64))
+                for name, tstr in schema.items() if tstr in self.VECTOR_DTYPES)
+        self.contents = OrderedDict((name, []) for name in self.counts)
+        if not EventsWriter.loaded:
+            r.gROOT.ProcessLine(".L {}".format(FILL_UTILS))
+            EventsWriter.loaded = True
+        self.filler = r.ColumnFiller(tree)
+        if rows:
+            for name, arr in self.scalars.items():
+                default = np.full(1, 0 if schema[name] == "b" else 999, dtype=arr.dtype)
+                self.filler.add_row_scalar(buffers[name].buffer_info()[0], default.ctypes.data, default.itemsize)
+            for name in self.counts:
+                if self.VECTOR_DTYPES[schema[name]] == np.float32:
+                    self.filler.add_row_vector_float(buffers[name])
+                else:
+                    self.filler.add_row_vector_int(buffers[name])
+            self.filler.clear_row()
+
+    def clear_row(self):
+        self.filler.clear_row()
+
+    def append_row(self):
+        self.filler.store_row()
+        self.size += 1
+        if self.size == self.capacity:
+            self.flush()
+
+    def append(self, nrows, columns):
+        start = 0
+        while start < nrows:
+            stop = start + min(nrows - start, self.capacity - self.size)
+            self.append_slice(columns, start, stop)
+            start = stop
+            if self.size == self.capacity:
+                self.flush()
+
+    def append_slice(self, columns, start, stop):
+        lo, hi = self.size, self.size + (stop - start)
+        for name, arr in self.scalars.items():
+            col = columns.get(name)
+            if col is None:
+                arr[lo:hi] = 0 if self.schema[name] == "b" else 999
+            else:
+                arr[lo:hi] = np.asarray(col)[start:stop]
+        for name, counts in self.counts.items():
+            col = columns.get(name)
+            if col is None:
+                counts[lo:hi] = 0
+                continue
+            offsets = np.asarray(col.offsets)
+            counts[lo:hi] = np.diff(offsets[start:stop+1])
+            self.contents[name].append(np.asarray(col.content)[offsets[start]:offsets[stop]])
+        self.size = hi
+
+    def flush(self):
+        if self.size == 0: return
+        if self.rows:
+            self.filler.fill_rows()
+            self.size = 0
+            return
+        n = self.size
+        filler = self.filler
+        filler.clear()
+        keep = []
+        for name, arr in self.scalars.items():
+            filler.add_scalar(self.buffers[name].buffer_info()[0], arr.ctypes.data, arr.itemsize)
+        for name, counts in self.counts.items():
+            dtype = self.VECTOR_DTYPES[self.schema[name]]
+            pieces = self.contents[name]
+            content = np.ascontiguousarray(np.concatenate(pieces) if pieces else np.zeros(0), dtype=dtype)
+            offsets = np.zeros(n+1, dtype=np.int64)
+            np.cumsum(counts[:n], out=offsets[1:])
+            keep.append((content, offsets))
+            if dtype == np.float32:
+                filler.add_vector_float(self.buffers[name], content.ctypes.data, offsets.ctypes.data)
+            else:
+                filler.add_vector_int(self.buffers[name], content.ctypes.data, offsets.ctypes.data)
+        filler.fill(n)
+        filler.clear()
+        for name in self.contents:
+            self.contents[name] = []
+        self.size = 0